@@ -6,3 +6,4 @@ SMALLEST = 1000000
 MAX_SUPPLY = 30_062_005
 VERSION = 1
 MAX_BLOCK_SIZE_HEX = 4096 * 1024  # 4MB in HEX format, 2MB in raw bytes
+MAX_BLOCKS_RESPONSE_SIZE_HEX = MAX_BLOCK_SIZE_HEX * 8  # transactions sent by /get_blocks in a single response
@@ -1,18 +1,50 @@
+import asyncio
 import os
 from datetime import datetime, timezone
+from itertools import groupby
 from decimal import Decimal
 from statistics import mean
-from typing import List, Union, Tuple, Dict
+from typing import AsyncIterator, List, Union, Tuple, Dict
 
 import asyncpg
 import pickledb
 from asyncpg import Connection, Pool, UndefinedColumnError, UndefinedTableError
 
-from .constants import MAX_BLOCK_SIZE_HEX, SMALLEST
-from .helpers import sha256, point_to_string, string_to_point, point_to_bytes, AddressFormat, normalize_block
+from .constants import MAX_BLOCK_SIZE_HEX, MAX_BLOCKS_RESPONSE_SIZE_HEX, SMALLEST
+from .helpers import sha256, point_to_string, string_to_point, point_to_bytes, AddressFormat, normalize_block, normalize_transaction, timestamp
+from .mempool import Mempool, MempoolEntry
+from .header_index import HeaderIndex
+from .utxo_cache import UTXOCache
 from .transactions import Transaction, CoinbaseTransaction, TransactionInput
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
+TRANSACTIONS_COLUMNS = ('block_hash', 'tx_hash', 'tx_hex', 'inputs_addresses', 'outputs_addresses', 'outputs_amounts', 'fees', 'time_received', 'block_id')
+# blocks read at once by Database.iter_blocks
+ITER_BLOCKS_PAGE_SIZE = 20
+ADDRESS_TRANSACTIONS_COLUMNS = ('address', 'block_id', 'tx_hash', 'direction')
+# tables which can be partitioned by block id, see Database._partition_tables
+PARTITIONED_TABLES = ('transactions', 'spent_outputs', 'address_transactions')
+# indexes and constraints of the partitioned tables, created again after partitioning them
+PARTITIONED_TABLES_DDL = {
+    'transactions': (
+        'CREATE INDEX transactions_tx_hash_idx ON transactions (tx_hash)',
+        'CREATE INDEX block_hash_idx ON transactions (block_hash)',
+        'CREATE INDEX transactions_block_id_idx ON transactions (block_id)',
+        'ALTER TABLE transactions ADD FOREIGN KEY (block_hash) REFERENCES blocks(hash) ON DELETE CASCADE'
+    ),
+    'spent_outputs': (
+        'CREATE INDEX spent_outputs_block_id_idx ON spent_outputs (block_id)',
+        'ALTER TABLE spent_outputs ADD FOREIGN KEY (block_id) REFERENCES blocks(id) ON DELETE CASCADE'
+    ),
+    'address_transactions': (
+        'ALTER TABLE address_transactions ADD PRIMARY KEY (address, block_id, tx_hash)',
+        'CREATE INDEX address_transactions_block_id_idx ON address_transactions (block_id)',
+        'ALTER TABLE address_transactions ADD FOREIGN KEY (block_id) REFERENCES blocks(id) ON DELETE CASCADE'
+    )
+}
+# address_transactions.direction flags
+ADDRESS_RECEIVED = 1
+ADDRESS_SENT = 2
 OLD_BLOCKS_TRANSACTIONS_ORDER = pickledb.load(dir_path + '/old_block_transactions_order.json', True)
 
 
@@ -22,10 +54,19 @@ class Database:
     instance = None
     pool: Pool = None
     is_indexed = False
+    mempool: Mempool = None
+    chain_listeners: list = None
+    header_index: HeaderIndex = None
+    utxo_cache: UTXOCache = None
+    connect_lock: asyncio.Lock = None
+    partition_blocks: int = None
+    partitions_end: int = None
 
     @staticmethod
-    async def create(user='denaro', password='', database='denaro', host='127.0.0.1', ignore: bool = False):
+    async def create(user='denaro', password='', database='denaro', host='127.0.0.1', ignore: bool = False, partition_blocks: int = None):
         self = Database()
+        self.chain_listeners = []
+        self.connect_lock = asyncio.Lock()
         self.pool = await asyncpg.create_pool(
             user=user,
             password=password,
@@ -45,6 +86,11 @@ class Database:
                     await connection.fetchrow('SELECT content FROM blocks LIMIT 1')
                 except UndefinedColumnError:
                     await connection.execute('ALTER TABLE blocks ADD COLUMN content TEXT')
+                # transactions and blocks contents are stored as bytes, queries return them in hex
+                for table, column in (('transactions', 'tx_hex'), ('blocks', 'content')):
+                    if await connection.fetchval('SELECT data_type FROM information_schema.columns WHERE table_name = $1 AND column_name = $2', table, column) == 'text':
+                        print(f'Converting {table}.{column} to bytea')
+                        await connection.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BYTEA USING decode({column}, 'hex')", timeout=3600)
                 try:
                     await connection.fetchrow('SELECT * FROM pending_spent_outputs LIMIT 1')
                 except UndefinedTableError:
@@ -65,15 +111,156 @@ class Database:
                 except UndefinedColumnError:
                     await connection.execute('ALTER TABLE unspent_outputs ADD COLUMN address TEXT NULL')
                     await self.set_unspent_outputs_addresses()
+                try:
+                    await connection.fetchrow('SELECT amount FROM unspent_outputs LIMIT 1')
+                except UndefinedColumnError:
+                    print('Adding amounts and heights to unspent outputs')
+                    await connection.execute('ALTER TABLE unspent_outputs ADD COLUMN amount BIGINT NULL, ADD COLUMN height INTEGER NULL')
+                    await connection.execute("UPDATE unspent_outputs SET address = transactions.outputs_addresses[index + 1], amount = transactions.outputs_amounts[index + 1], height = blocks.id "
+                                             "FROM transactions INNER JOIN blocks ON (blocks.hash = transactions.block_hash) WHERE transactions.tx_hash = unspent_outputs.tx_hash", timeout=3600)
+                    await connection.execute('DELETE FROM unspent_outputs a USING unspent_outputs b WHERE a.ctid < b.ctid AND a.tx_hash = b.tx_hash AND a.index = b.index', timeout=3600)
+                    await connection.execute('ALTER TABLE unspent_outputs ADD PRIMARY KEY (tx_hash, index)', timeout=3600)
+                    await connection.execute('CREATE INDEX IF NOT EXISTS unspent_outputs_address_idx ON unspent_outputs (address)', timeout=3600)
+                    print('Done.')
 
                 try:
                     await connection.fetchrow('SELECT propagation_time FROM pending_transactions LIMIT 1')
                 except UndefinedColumnError:
                     await connection.execute('ALTER TABLE pending_transactions ADD COLUMN propagation_time TIMESTAMP(0) NOT NULL DEFAULT NOW()')
+                try:
+                    await connection.fetchrow('SELECT time_received FROM pending_transactions LIMIT 1')
+                except UndefinedColumnError:
+                    await connection.execute('ALTER TABLE pending_transactions ADD COLUMN time_received TIMESTAMP')
+                try:
+                    await connection.fetchrow('SELECT time_received FROM transactions LIMIT 1')
+                except UndefinedColumnError:
+                    await connection.execute('ALTER TABLE transactions ADD COLUMN time_received TIMESTAMP')
+                try:
+                    await connection.fetchrow('SELECT block_id FROM transactions LIMIT 1')
+                except UndefinedColumnError:
+                    print('Adding block ids to transactions')
+                    await connection.execute('ALTER TABLE transactions ADD COLUMN block_id INTEGER NULL')
+                    await connection.execute('UPDATE transactions SET block_id = blocks.id FROM blocks WHERE blocks.hash = transactions.block_hash', timeout=3600)
+                    await connection.execute('CREATE INDEX IF NOT EXISTS transactions_block_id_idx ON transactions (block_id)', timeout=3600)
+                    print('Done.')
+
+                # outputs spent by each block, used to restore them when the block is removed
+                await connection.execute("""CREATE TABLE IF NOT EXISTS spent_outputs (
+                    tx_hash CHAR(64) NOT NULL,
+                    index SMALLINT NOT NULL,
+                    address TEXT NULL,
+                    amount BIGINT NULL,
+                    height INTEGER NOT NULL,
+                    block_id INTEGER NOT NULL REFERENCES blocks(id) ON DELETE CASCADE
+                )""")
+                await connection.execute('CREATE INDEX IF NOT EXISTS spent_outputs_block_id_idx ON spent_outputs (block_id)')
+                # blocks starting from undo_state.height have been added with their spent outputs
+                await connection.execute('CREATE TABLE IF NOT EXISTS undo_state (height INTEGER NOT NULL)')
+                if await connection.fetchval('SELECT height FROM undo_state') is None:
+                    await connection.execute('INSERT INTO undo_state (height) SELECT COALESCE(MAX(id), 0) + 1 FROM blocks')
+
+                # transactions of each address, used to page an address history without scanning transactions
+                await connection.execute("""CREATE TABLE IF NOT EXISTS address_transactions (
+                    address TEXT NOT NULL,
+                    block_id INTEGER NOT NULL REFERENCES blocks(id) ON DELETE CASCADE,
+                    tx_hash CHAR(64) NOT NULL,
+                    direction SMALLINT NOT NULL,
+                    PRIMARY KEY (address, block_id, tx_hash)
+                )""")
+                await connection.execute('CREATE INDEX IF NOT EXISTS address_transactions_block_id_idx ON address_transactions (block_id)')
+                if not await connection.fetchval('SELECT EXISTS (SELECT 1 FROM address_transactions)') and await connection.fetchval('SELECT EXISTS (SELECT 1 FROM blocks)'):
+                    print('Filling address_transactions table')
+                    await connection.execute(f"""INSERT INTO address_transactions (address, block_id, tx_hash, direction)
+                        SELECT address, blocks.id, tx_hash, bit_or(direction) FROM (
+                            SELECT unnest(outputs_addresses) AS address, block_hash, tx_hash, {ADDRESS_RECEIVED} AS direction FROM transactions
+                            UNION ALL
+                            SELECT unnest(inputs_addresses), block_hash, tx_hash, {ADDRESS_SENT} FROM transactions
+                        ) AS t INNER JOIN blocks ON (blocks.hash = t.block_hash)
+                        GROUP BY address, blocks.id, tx_hash""", timeout=3600)
+
+                # transactions spending each output, confirmed and pending, the inputs are read from tx_hex:
+                # version (1 byte) | inputs count (1 byte) | inputs (tx hash, 32 bytes | index, 1 byte) | ...
+                await connection.execute("""CREATE TABLE IF NOT EXISTS spent_by (
+                    tx_hash CHAR(64) NOT NULL,
+                    index SMALLINT NOT NULL,
+                    spending_tx_hash CHAR(64) NOT NULL,
+                    block_id INTEGER NOT NULL REFERENCES blocks(id) ON DELETE CASCADE,
+                    PRIMARY KEY (tx_hash, index)
+                )""")
+                await connection.execute('CREATE INDEX IF NOT EXISTS spent_by_block_id_idx ON spent_by (block_id)')
+                if not await connection.fetchval('SELECT EXISTS (SELECT 1 FROM spent_by)') and await connection.fetchval('SELECT EXISTS (SELECT 1 FROM blocks)'):
+                    print('Filling spent_by table')
+                    # coinbase transactions have the block hash as input, block 143361 spends an output twice
+                    await connection.execute("""INSERT INTO spent_by (tx_hash, index, spending_tx_hash, block_id)
+                        SELECT encode(substring(tx_hex FROM 3 + 33 * i FOR 32), 'hex'), get_byte(tx_hex, 34 + 33 * i), tx_hash, blocks.id
+                        FROM transactions INNER JOIN blocks ON (blocks.hash = transactions.block_hash),
+                        generate_series(0, get_byte(tx_hex, 1) - 1) AS i
+                        WHERE encode(substring(tx_hex FROM 3 FOR 32), 'hex') != transactions.block_hash
+                        ORDER BY blocks.id
+                        ON CONFLICT DO NOTHING""", timeout=3600)
+                await connection.execute("""CREATE TABLE IF NOT EXISTS pending_spent_by (
+                    tx_hash CHAR(64) NOT NULL,
+                    index SMALLINT NOT NULL,
+                    spending_tx_hash CHAR(64) NOT NULL REFERENCES pending_transactions(tx_hash) ON DELETE CASCADE,
+                    PRIMARY KEY (tx_hash, index, spending_tx_hash)
+                )""")
+                await connection.execute('CREATE INDEX IF NOT EXISTS pending_spent_by_spending_tx_hash_idx ON pending_spent_by (spending_tx_hash)')
+                await connection.execute("""INSERT INTO pending_spent_by (tx_hash, index, spending_tx_hash)
+                    SELECT substring(tx_hex, 5 + 66 * i, 64), ('x' || substring(tx_hex, 69 + 66 * i, 2))::BIT(8)::INTEGER, tx_hash
+                    FROM pending_transactions, generate_series(0, ('x' || substring(tx_hex, 3, 2))::BIT(8)::INTEGER - 1) AS i
+                    ON CONFLICT DO NOTHING""")
+
+                # balance and statistics of each address, updated when blocks are added and removed
+                await connection.execute("""CREATE TABLE IF NOT EXISTS address_stats (
+                    address TEXT PRIMARY KEY,
+                    balance BIGINT NOT NULL,
+                    utxo_count INTEGER NOT NULL,
+                    received BIGINT NOT NULL,
+                    sent BIGINT NOT NULL,
+                    tx_count INTEGER NOT NULL,
+                    first_height INTEGER NULL,
+                    last_height INTEGER NULL
+                )""")
+                await connection.execute('CREATE INDEX IF NOT EXISTS address_stats_balance_idx ON address_stats (balance DESC)')
+
+                await self._partition_tables(connection, partition_blocks)
+
+                await connection.execute('CREATE TABLE IF NOT EXISTS utxo_cache_state (height INTEGER NOT NULL)')
+                flush_height = await connection.fetchval('SELECT height FROM utxo_cache_state')
+                if flush_height is not None:
+                    # the node stopped while the utxo cache was enabled, unspent outputs are updated until flush_height
+                    print(f'Removing blocks after {flush_height}, their unspent outputs have not been flushed')
+                    await self._delete_blocks_and_address_stats(connection, flush_height + 1)
+                    await connection.execute('UPDATE undo_state SET height = LEAST(height, $1)', flush_height + 1)
+                    await connection.execute('DELETE FROM utxo_cache_state')
+
+                if not await connection.fetchval('SELECT EXISTS (SELECT 1 FROM address_stats)') and await connection.fetchval('SELECT EXISTS (SELECT 1 FROM blocks)'):
+                    print('Filling address_stats table')
+                    await self._rebuild_address_stats(connection)
 
         Database.instance = self
+        await self.load_header_index()
+        await self.load_mempool()
         return self
 
+    async def load_header_index(self):
+        header_index = HeaderIndex()
+        async with self.pool.acquire() as connection:
+            blocks = await connection.fetch('SELECT id, hash, timestamp, difficulty FROM blocks ORDER BY id')
+            for block in blocks:
+                header_index.append(block['id'], block['hash'], int(block['timestamp'].replace(tzinfo=timezone.utc).timestamp()), block['difficulty'])
+        self.header_index = header_index
+
+    async def load_mempool(self):
+        mempool = Mempool()
+        async with self.pool.acquire() as connection:
+            txs = await connection.fetch('SELECT tx_hex, inputs_addresses, fees, time_received, EXTRACT(EPOCH FROM NOW() - propagation_time)::BIGINT AS propagation_delta FROM pending_transactions')
+        now = timestamp()
+        for tx in txs:
+            transaction = await Transaction.from_hex(tx['tx_hex'])
+            mempool.add(MempoolEntry(transaction, tx['tx_hex'], tx['fees'], tx['inputs_addresses'], tx['time_received'], now - tx['propagation_delta']))
+        self.mempool = mempool
+
     @staticmethod
     async def get():
         if Database.instance is None:
@@ -92,175 +279,483 @@ class Database:
                 # If timstamp column doesn't exist, add it
                 await connection.execute("ALTER TABLE pending_transactions ADD COLUMN time_received TIMESTAMP;")
             utc_datetime = datetime.now(timezone.utc).replace(tzinfo=None)
-            await connection.execute(
-                'INSERT INTO pending_transactions (tx_hash, tx_hex, inputs_addresses, fees, time_received) VALUES ($1, $2, $3, $4, $5)',
-                sha256(tx_hex),
-                tx_hex,
-                [point_to_string(await tx_input.get_public_key()) for tx_input in transaction.inputs],
-                transaction.fees,
-                utc_datetime
-            )
+            inputs_addresses = [point_to_string(await tx_input.get_public_key()) for tx_input in transaction.inputs]
+            async with connection.transaction():
+                await connection.execute(
+                    'INSERT INTO pending_transactions (tx_hash, tx_hex, inputs_addresses, fees, time_received) VALUES ($1, $2, $3, $4, $5)',
+                    sha256(tx_hex),
+                    tx_hex,
+                    inputs_addresses,
+                    transaction.fees,
+                    utc_datetime
+                )
+                await connection.executemany(
+                    'INSERT INTO pending_spent_by (tx_hash, index, spending_tx_hash) VALUES ($1, $2, $3) ON CONFLICT DO NOTHING',
+                    [(tx_input.tx_hash, tx_input.index, sha256(tx_hex)) for tx_input in transaction.inputs]
+                )
         await self.add_transactions_pending_spent_outputs([transaction])
+        self.mempool.add(MempoolEntry(transaction, tx_hex, transaction.fees, inputs_addresses, utc_datetime))
         return True
 
     async def remove_pending_transaction(self, tx_hash: str):
         async with self.pool.acquire() as connection:
             await connection.execute('DELETE FROM pending_transactions WHERE tx_hash = $1', tx_hash)
+        self.mempool.remove(tx_hash)
 
     async def remove_pending_transactions_by_hash(self, tx_hashes: List[str]):
         async with self.pool.acquire() as connection:
             await connection.execute('DELETE FROM pending_transactions WHERE tx_hash = ANY($1)', tx_hashes)
+        self.mempool.remove_many(tx_hashes)
 
     async def remove_pending_transactions(self):
         async with self.pool.acquire() as connection:
             await connection.execute('DELETE FROM pending_transactions')
+        self.mempool.clear()
 
     async def delete_blockchain(self):
+        await self.flush_utxo_cache()
         async with self.pool.acquire() as connection:
-            await connection.execute('TRUNCATE transactions, blocks RESTART IDENTITY')
+            await connection.execute('TRUNCATE transactions, blocks, spent_outputs, spent_by, address_transactions, address_stats RESTART IDENTITY')
+        await self._blocks_removed(0)
 
     async def delete_block(self, id: int):
+        await self.flush_utxo_cache()
         async with self.pool.acquire() as connection:
-            await connection.execute('DELETE FROM blocks WHERE id = $1', id)
+            async with connection.transaction():
+                await self._delete_blocks_and_address_stats(connection, id, id)
+        await self._blocks_removed(id - 1)
 
     async def delete_blocks(self, offset: int):
+        await self.flush_utxo_cache()
         async with self.pool.acquire() as connection:
-            await connection.execute('DELETE FROM blocks WHERE id > $1', offset, timeout=600)
+            async with connection.transaction():
+                await self._delete_blocks_and_address_stats(connection, offset + 1)
+        await self._blocks_removed(offset)
+
+    async def _blocks_removed(self, last_block_id: int):
+        self.header_index.truncate(last_block_id)
+        async with self.pool.acquire() as connection:
+            # next blocks will be added with their spent outputs
+            await connection.execute('UPDATE undo_state SET height = LEAST(height, $1)', last_block_id + 1)
+            if self.utxo_cache is not None:
+                # the cache has been flushed before removing the blocks, unspent_outputs is consistent at last_block_id
+                await connection.execute('UPDATE utxo_cache_state SET height = $1', last_block_id)
+        if self.utxo_cache is not None:
+            self.utxo_cache.height = last_block_id
+            self.utxo_cache.flushed()
+        self._chain_changed()
+
+    def _chain_changed(self):
+        from .manager import Manager
+        Manager.difficulty = None
+        for listener in self.chain_listeners:
+            listener.chain_changed()
+
+    async def enable_utxo_cache(self, **kwargs):
+        async with self.connect_lock:
+            if self.utxo_cache is not None:
+                return
+            height = len(self.header_index)
+            async with self.pool.acquire() as connection:
+                async with connection.transaction():
+                    await connection.execute('DELETE FROM utxo_cache_state')
+                    await connection.execute('INSERT INTO utxo_cache_state (height) VALUES ($1)', height)
+            self.utxo_cache = UTXOCache(height, **kwargs)
+
+    async def disable_utxo_cache(self):
+        async with self.connect_lock:
+            if self.utxo_cache is None:
+                return
+            await self._flush_utxo_cache()
+            async with self.pool.acquire() as connection:
+                await connection.execute('DELETE FROM utxo_cache_state')
+            self.utxo_cache = None
+
+    async def flush_utxo_cache(self):
+        async with self.connect_lock:
+            await self._flush_utxo_cache()
+
+    async def _flush_utxo_cache(self):
+        cache = self.utxo_cache
+        if cache is None:
+            return
+        created, spent = cache.get_changes()
+        records = [(tx_hash, index, address, int(amount * SMALLEST), height) for tx_hash, index, address, amount, height in created]
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                await connection.copy_records_to_table('unspent_outputs', records=records, columns=('tx_hash', 'index', 'address', 'amount', 'height'))
+                await connection.execute('DELETE FROM unspent_outputs WHERE (tx_hash, index) = ANY($1::tx_output[])', spent, timeout=600)
+                await connection.execute('UPDATE utxo_cache_state SET height = $1', cache.height)
+        cache.flushed()
 
     async def remove_blocks(self, block_no: int):
-        blocks_to_remove = await self.get_blocks(block_no, 500)
-        transactions_to_remove = []
+        """
+        Removes the blocks starting from block_no and restores the outputs they spent from spent_outputs.
+        """
+        await self.flush_utxo_cache()
+        async with self.pool.acquire() as connection:
+            undo_height = await connection.fetchval('SELECT height FROM undo_state')
+        if block_no < undo_height:
+            # some blocks have been added before spent outputs were stored
+            await self._remove_blocks_from_transactions(block_no)
+            return
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                # restore the outputs which have been created before the removed blocks, the ones created
+                # by the removed blocks are deleted with their transactions
+                await connection.execute(
+                    'INSERT INTO unspent_outputs (tx_hash, index, address, amount, height) '
+                    'SELECT tx_hash, index, address, amount, height FROM spent_outputs WHERE block_id >= $1 AND height < $1 '
+                    'ON CONFLICT DO NOTHING', block_no)
+                await self._remove_address_stats(connection, block_no)
+                await self._delete_blocks(connection, block_no)
+        await self._blocks_removed(block_no - 1)
+
+    async def _remove_blocks_from_transactions(self, block_no: int):
         # cache overwritten tx hashes
-        transactions_hashes = []
-        for block_to_remove in blocks_to_remove:
-            # load transactions of overwritten blocks
-            transactions_to_remove.extend([await Transaction.from_hex(tx, False) for tx in block_to_remove['transactions']])
-            transactions_hashes.extend([sha256(tx) for tx in block_to_remove['transactions']])
-        outputs_to_be_restored = []
-        for transaction in transactions_to_remove:
-            if isinstance(transaction, Transaction):
-                # load outputs that has been spent in the overwritten transactions that has not been generated in the overwritten transactions
-                outputs_to_be_restored.extend([(tx_input.tx_hash, tx_input.index) for tx_input in transaction.inputs if tx_input.tx_hash not in transactions_hashes])
+        transactions_hashes = set()
+        spent_outputs = []
+        offset = block_no
+        # every removed block is read, get_blocks returns them in batches limited by count and size
+        while True:
+            blocks_to_remove = await self.get_blocks(offset, 500)
+            if not blocks_to_remove:
+                break
+            for block_to_remove in blocks_to_remove:
+                # load transactions of overwritten blocks
+                for tx in block_to_remove['transactions']:
+                    transaction = await Transaction.from_hex(tx, False)
+                    transactions_hashes.add(sha256(tx))
+                    if isinstance(transaction, Transaction):
+                        spent_outputs.extend([(tx_input.tx_hash, tx_input.index) for tx_input in transaction.inputs])
+            offset = blocks_to_remove[-1]['block']['id'] + 1
+        # load outputs that has been spent in the overwritten transactions that has not been generated in the overwritten transactions
+        outputs_to_be_restored = [output for output in spent_outputs if output[0] not in transactions_hashes]
         async with self.pool.acquire() as connection:
-            # delete the blocks, it will also delete transactions and outputs thanks to references
-            await connection.execute('DELETE FROM blocks WHERE id >= $1', block_no, timeout=600)
+            async with connection.transaction():
+                await self._delete_blocks(connection, block_no)
         # add back the outputs to revert the whole chain to the previous state
         await self.add_unspent_outputs(outputs_to_be_restored)
+        # the outputs spent by the removed blocks are not known, so the statistics are calculated again
+        async with self.pool.acquire() as connection:
+            async with connection.transaction():
+                await self._rebuild_address_stats(connection)
+        await self._blocks_removed(block_no - 1)
         # add removed transactions to pending transactions, this could be improved by adding only the ones who spend only old inputs
         #for tx in transactions_to_remove:
         #    await self.add_pending_transaction(tx, verify=False)
 
+    @staticmethod
+    async def _delete_blocks(connection: Connection, block_no: int, last_block_no: int = 2 ** 31 - 1):
+        """
+        Deletes the blocks from block_no to last_block_no with their transactions and the outputs they created.
+        Transactions are deleted by block id, so that only the partitions holding these blocks are scanned.
+        Partitioned transactions have no foreign keys cascading to the outputs, so they are deleted here.
+        """
+        await connection.execute('DELETE FROM unspent_outputs WHERE tx_hash = ANY(SELECT tx_hash FROM transactions WHERE block_id BETWEEN $1 AND $2)', block_no, last_block_no, timeout=600)
+        await connection.execute('DELETE FROM pending_spent_outputs WHERE tx_hash = ANY(SELECT tx_hash FROM transactions WHERE block_id BETWEEN $1 AND $2)', block_no, last_block_no, timeout=600)
+        await connection.execute('DELETE FROM transactions WHERE block_id BETWEEN $1 AND $2', block_no, last_block_no, timeout=600)
+        await connection.execute('DELETE FROM blocks WHERE id BETWEEN $1 AND $2', block_no, last_block_no, timeout=600)
+
+    async def _delete_blocks_and_address_stats(self, connection: Connection, block_no: int, last_block_no: int = 2 ** 31 - 1):
+        """
+        Deletes the blocks from block_no to last_block_no and updates address_stats. Spent outputs are stored only for
+        the blocks starting from undo_state.height, before it the statistics are calculated again.
+        """
+        if block_no >= await connection.fetchval('SELECT height FROM undo_state'):
+            await self._remove_address_stats(connection, block_no, last_block_no)
+            await self._delete_blocks(connection, block_no, last_block_no)
+        else:
+            await self._delete_blocks(connection, block_no, last_block_no)
+            await self._rebuild_address_stats(connection)
+
+    async def _partition_tables(self, connection: Connection, partition_blocks: int = None):
+        """
+        Partitions PARTITIONED_TABLES by ranges of partition_blocks block ids, if they are not partitioned yet.
+        Partitioned transactions cannot have a unique tx_hash, so the foreign keys referencing it are dropped.
+        """
+        if await connection.fetchval("SELECT relkind FROM pg_class WHERE relname = 'transactions'") == 'p':
+            # the first partition bound is "FOR VALUES FROM (0) TO (<partition_blocks>)"
+            bound = await connection.fetchval("SELECT pg_get_expr(relpartbound, oid) FROM pg_class WHERE relname = 'transactions_0'")
+            self.partition_blocks = int(bound.rsplit('(', 1)[1].rstrip(')'))
+            # continues from the table with the fewest partitions, in case their creation was interrupted
+            last_starts = [await connection.fetchval(
+                "SELECT MAX(substring(relname FROM $2)::bigint) FROM pg_inherits JOIN pg_class ON pg_class.oid = inhrelid WHERE inhparent = $1::text::regclass",
+                table, f'^{table}_([0-9]+)$'
+            ) for table in PARTITIONED_TABLES]
+            self.partitions_end = min(last_start or 0 for last_start in last_starts) + self.partition_blocks
+            await self._create_partitions(connection)
+            return
+        if not partition_blocks:
+            return
+        self.partition_blocks = partition_blocks
+        async with connection.transaction():
+            for row in await connection.fetch("SELECT conrelid::regclass::text AS table_name, conname FROM pg_constraint WHERE confrelid = 'transactions'::regclass"):
+                await connection.execute(f'ALTER TABLE {row["table_name"]} DROP CONSTRAINT {row["conname"]}')
+            for table in PARTITIONED_TABLES:
+                print(f'Partitioning {table} every {partition_blocks} blocks')
+                await connection.execute(f'ALTER TABLE {table} RENAME TO {table}_unpartitioned')
+                await connection.execute(f'CREATE TABLE {table} (LIKE {table}_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (block_id)')
+                await connection.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+                await self._create_partitions(connection, (table,), 0)
+                await connection.execute(f'INSERT INTO {table} SELECT * FROM {table}_unpartitioned', timeout=3600)
+                await connection.execute(f'DROP TABLE {table}_unpartitioned')
+                for statement in PARTITIONED_TABLES_DDL[table]:
+                    await connection.execute(statement, timeout=3600)
+            print('Done.')
+
+    async def _create_partitions(self, connection: Connection, tables: Tuple[str] = PARTITIONED_TABLES, start: int = None):
+        """
+        Creates the partitions from start, by default the end of the last created one, up to the one after the last
+        block, so that new blocks never go to the default partition.
+        """
+        size = self.partition_blocks
+        if start is None:
+            start = self.partitions_end
+        last_block_id = await connection.fetchval('SELECT COALESCE(MAX(id), 0) FROM blocks')
+        end = (last_block_id // size + 2) * size
+        for table in tables:
+            for partition_start in range(start, end, size):
+                await connection.execute(f'CREATE TABLE IF NOT EXISTS {table}_{partition_start} PARTITION OF {table} FOR VALUES FROM ({partition_start}) TO ({partition_start + size})')
+        self.partitions_end = max(self.partitions_end or 0, end)
+
+    @staticmethod
+    async def _remove_address_stats(connection: Connection, block_no: int, last_block_no: int = 2 ** 31 - 1):
+        """
+        Subtracts from address_stats what the blocks from block_no to last_block_no added, before they are deleted.
+        Their spent outputs have to be in spent_outputs.
+        """
+        await connection.execute("""
+            WITH delta AS (
+                SELECT address, SUM(received) AS received, SUM(sent) AS sent, SUM(utxo_count) AS utxo_count, SUM(tx_count) AS tx_count FROM (
+                    SELECT o.address, o.amount AS received, 0 AS sent, 1 AS utxo_count, 0 AS tx_count
+                    FROM transactions, unnest(outputs_addresses, outputs_amounts) AS o(address, amount)
+                    WHERE transactions.block_id BETWEEN $1 AND $2
+                    UNION ALL
+                    SELECT address, 0, amount, -1, 0 FROM spent_outputs WHERE block_id BETWEEN $1 AND $2
+                    UNION ALL
+                    SELECT address, 0, 0, 0, 1 FROM address_transactions WHERE block_id BETWEEN $1 AND $2
+                ) AS d GROUP BY address
+            )
+            UPDATE address_stats SET
+                balance = balance - delta.received + delta.sent,
+                utxo_count = address_stats.utxo_count - delta.utxo_count,
+                received = address_stats.received - delta.received,
+                sent = address_stats.sent - delta.sent,
+                tx_count = address_stats.tx_count - delta.tx_count,
+                last_height = (SELECT MAX(block_id) FROM address_transactions WHERE address_transactions.address = address_stats.address AND block_id NOT BETWEEN $1 AND $2)
+            FROM delta WHERE address_stats.address = delta.address""", block_no, last_block_no, timeout=600)
+        await connection.execute('DELETE FROM address_stats WHERE tx_count = 0 AND received = 0 AND sent = 0')
+
+    @staticmethod
+    async def _rebuild_address_stats(connection: Connection):
+        await connection.execute('TRUNCATE address_stats')
+        await connection.execute("""
+            INSERT INTO address_stats (address, balance, utxo_count, received, sent, tx_count, first_height, last_height)
+            SELECT address, SUM(balance), SUM(utxo_count), SUM(received), SUM(received) - SUM(balance), SUM(tx_count), MIN(first_height), MAX(last_height) FROM (
+                SELECT o.address, 0 AS balance, 0 AS utxo_count, o.amount AS received, 0 AS tx_count, NULL::INTEGER AS first_height, NULL::INTEGER AS last_height
+                FROM transactions, unnest(outputs_addresses, outputs_amounts) AS o(address, amount)
+                UNION ALL
+                SELECT address, amount, 1, 0, 0, NULL, NULL FROM unspent_outputs
+                UNION ALL
+                SELECT address, 0, 0, 0, COUNT(*), MIN(block_id), MAX(block_id) FROM address_transactions GROUP BY address
+            ) AS s GROUP BY address""", timeout=3600)
+
+    @staticmethod
+    def _get_address_stats_records(outputs: List[tuple], spent_outputs: List[tuple], address_transactions: List[tuple]) -> List[list]:
+        # address: [balance, utxo_count, received, sent, tx_count]
+        stats = {}
+        for _, _, address, amount, _ in outputs:
+            address_stats = stats.setdefault(address, [0, 0, 0, 0, 0])
+            address_stats[0] += amount
+            address_stats[1] += 1
+            address_stats[2] += amount
+        for _, _, address, amount, _, _ in spent_outputs:
+            address_stats = stats.setdefault(address, [0, 0, 0, 0, 0])
+            address_stats[0] -= amount
+            address_stats[1] -= 1
+            address_stats[3] += amount
+        for address, _, _, _ in address_transactions:
+            stats.setdefault(address, [0, 0, 0, 0, 0])[4] += 1
+        return [[address for address in stats]] + [[values[n] for values in stats.values()] for n in range(5)]
+
     async def get_pending_transactions_limit(self, limit: int = MAX_BLOCK_SIZE_HEX, hex_only: bool = False, check_signatures: bool = True) -> List[Union[Transaction, str]]:
-        async with self.pool.acquire() as connection:
-            txs = await connection.fetch(f'SELECT tx_hex FROM pending_transactions ORDER BY fees / LENGTH(tx_hex) DESC, LENGTH(tx_hex), tx_hex')
-        txs_hex = [tx['tx_hex'] for tx in txs]
-        return_txs = []
-        size = 0
-        for tx in txs_hex:
-            if size + len(tx) > limit:
-                break
-            return_txs.append(tx)
-            size += len(tx)
+        entries = self.mempool.get_limit(limit)
         if hex_only:
-            return return_txs
-        return [await Transaction.from_hex(tx_hex, check_signatures) for tx_hex in return_txs]
+            return [entry.tx_hex for entry in entries]
+        return [entry.tx for entry in entries]
 
     async def get_need_propagate_transactions(self, last_propagation_delta: int = 600, limit: int = MAX_BLOCK_SIZE_HEX) -> List[Union[Transaction, str]]:
-        async with self.pool.acquire() as connection:
-            txs = await connection.fetch(f"SELECT tx_hex, NOW() - propagation_time as delta FROM pending_transactions ORDER BY fees / LENGTH(tx_hex) DESC, LENGTH(tx_hex), tx_hex")
-        return_txs = []
-        size = 0
-        for tx in txs:
-            tx_hex = tx['tx_hex']
-            if size + len(tx_hex) > limit:
-                break
-            size += len(tx_hex)
-            if tx['delta'].total_seconds() > last_propagation_delta:
-                return_txs.append(tx_hex)
-        return return_txs
+        return [entry.tx_hex for entry in self.mempool.get_need_propagate(last_propagation_delta, limit)]
 
     async def update_pending_transactions_propagation_time(self, txs_hash: List[str]):
         async with self.pool.acquire() as connection:
             await connection.execute("UPDATE pending_transactions SET propagation_time = NOW() WHERE tx_hash = ANY($1)", txs_hash)
+        self.mempool.set_propagation_time(txs_hash)
 
     async def get_next_block_average_fee(self):
-        limit = MAX_BLOCK_SIZE_HEX
-        async with self.pool.acquire() as connection:
-            txs = await connection.fetch(f'SELECT LENGTH(tx_hex) as size, fees FROM pending_transactions ORDER BY fees / LENGTH(tx_hex) DESC, LENGTH(tx_hex) ASC')
-        fees = []
-        size = 0
-        for tx in txs:
-            if size + tx['size'] > limit:
-                break
-            fees.append(tx['fees'])
-            size += tx['size']
-        return int(mean(fees) * SMALLEST) // Decimal(SMALLEST)
+        return self.mempool.get_average_fee(MAX_BLOCK_SIZE_HEX)
 
     async def get_pending_blocks_count(self):
-        async with self.pool.acquire() as connection:
-            txs = await connection.fetch(f'SELECT LENGTH(tx_hex) as size FROM pending_transactions')
-        return int(sum([tx['size'] for tx in txs]) / MAX_BLOCK_SIZE_HEX + 1)
+        return self.mempool.get_blocks_count()
 
     async def clear_duplicate_pending_transactions(self):
         async with self.pool.acquire() as connection:
-            await connection.execute('DELETE FROM pending_transactions WHERE tx_hash = ANY(SELECT tx_hash FROM transactions)')
+            res = await connection.fetch('DELETE FROM pending_transactions USING transactions WHERE transactions.tx_hash = pending_transactions.tx_hash RETURNING pending_transactions.tx_hash')
+        self.mempool.remove_many([row['tx_hash'] for row in res])
 
     async def add_transaction(self, transaction: Union[Transaction, CoinbaseTransaction], block_hash: str):
         await self.add_transactions([transaction], block_hash)
 
+    @staticmethod
+    async def _get_transactions_inputs_addresses(transactions: List[Union[Transaction, CoinbaseTransaction]]) -> List[List[str]]:
+        # public keys may have to be retrieved from the inputs transactions, so this has to be done before a block is written
+        return [[point_to_string(await tx_input.get_public_key()) for tx_input in transaction.inputs] if isinstance(transaction, Transaction) else [] for transaction in transactions]
+
+    @staticmethod
+    def _get_transactions_records(transactions: List[Union[Transaction, CoinbaseTransaction]], inputs_addresses: List[List[str]], block_hash: str, block_id: int, times_received: Dict[str, datetime]) -> List[tuple]:
+        return [(
+            block_hash,
+            transaction.hash(),
+            bytes.fromhex(transaction.hex()),
+            transaction_inputs_addresses,
+            [tx_output.address for tx_output in transaction.outputs],
+            [tx_output.amount * SMALLEST for tx_output in transaction.outputs],
+            transaction.fees if isinstance(transaction, Transaction) else 0,
+            times_received.get(transaction.hash()),
+            block_id
+        ) for transaction, transaction_inputs_addresses in zip(transactions, inputs_addresses)]
+
+    @staticmethod
+    async def _get_times_received(connection: Connection, transactions: List[Union[Transaction, CoinbaseTransaction]], block_hash: str) -> Dict[str, datetime]:
+        tx_hashes = [transaction.hash() for transaction in transactions if isinstance(transaction, Transaction)]
+        res = await connection.fetch('SELECT tx_hash, time_received FROM pending_transactions WHERE tx_hash = ANY($1)', tx_hashes) if tx_hashes else []
+        times_received = {row['tx_hash']: row['time_received'] for row in res}
+        if len(tx_hashes) < len(transactions):
+            # coinbase transactions are received with their block
+            block_timestamp = await connection.fetchval('SELECT timestamp FROM blocks WHERE hash = $1', block_hash)
+            times_received.update({transaction.hash(): block_timestamp for transaction in transactions if isinstance(transaction, CoinbaseTransaction)})
+        return times_received
+
+    @staticmethod
+    def _get_address_transactions_records(transactions_records: List[tuple], block_id: int) -> List[tuple]:
+        directions = {}
+        for _, tx_hash, _, inputs_addresses, outputs_addresses, *_ in transactions_records:
+            for address in outputs_addresses:
+                directions[(address, tx_hash)] = directions.get((address, tx_hash), 0) | ADDRESS_RECEIVED
+            for address in inputs_addresses:
+                directions[(address, tx_hash)] = directions.get((address, tx_hash), 0) | ADDRESS_SENT
+        return [(address, block_id, tx_hash, direction) for (address, tx_hash), direction in directions.items()]
+
     async def add_transactions(self, transactions: List[Union[Transaction, CoinbaseTransaction]], block_hash: str):
+        inputs_addresses = await self._get_transactions_inputs_addresses(transactions)
         async with self.pool.acquire() as connection:
-            execution_timstamp_in_pending_txs = await connection.fetch("SELECT column_name FROM information_schema.columns WHERE table_name='pending_transactions' AND column_name='time_received';")            
-            if not execution_timstamp_in_pending_txs:
-                # If timstamp column doesn't exist in pending_transactions, add it
-                await connection.execute("ALTER TABLE pending_transactions ADD COLUMN time_received TIMESTAMP;")
-            execution_timstamp_in_txs = await connection.fetch("SELECT column_name FROM information_schema.columns WHERE table_name='transactions' AND column_name='time_received';")            
-            if not execution_timstamp_in_txs:
-                # If timstamp column doesn't exist in transactions, add it
-                await connection.execute("ALTER TABLE transactions ADD COLUMN time_received TIMESTAMP;")
-            data = []
-            for transaction in transactions:
-                if isinstance(transaction, CoinbaseTransaction):
-                    tx_executed = await connection.fetchval("SELECT timestamp FROM blocks WHERE hash = $1;", block_hash)
-                elif isinstance(transaction, Transaction):
-                    tx_executed = await connection.fetchval("SELECT time_received FROM pending_transactions WHERE tx_hash = $1;", transaction.hash())
-                    #if tx_executed is None:
-                         # Get timestamp from transaction object
-                    #    tx_executed = datetime.fromtimestamp(transaction.timestamp, timezone.utc).replace(tzinfo=None)
-                else:
-                    tx_executed = None
-                data.append((
-                    block_hash,
-                    transaction.hash(),
-                    transaction.hex(),
-                    [point_to_string(await tx_input.get_public_key()) for tx_input in transaction.inputs] if isinstance(transaction, Transaction) else [],
-                    [tx_output.address for tx_output in transaction.outputs],
-                    [tx_output.amount * SMALLEST for tx_output in transaction.outputs],
-                    transaction.fees if isinstance(transaction, Transaction) else 0,
-                    tx_executed
-                ))
-            stmt = await connection.prepare('INSERT INTO transactions (block_hash, tx_hash, tx_hex, inputs_addresses, outputs_addresses, outputs_amounts, fees, time_received) VALUES ($1, $2, $3, $4, $5, $6, $7, $8)')
-            await stmt.executemany(data)
+            times_received = await self._get_times_received(connection, transactions, block_hash)
+            block_id = await connection.fetchval('SELECT id FROM blocks WHERE hash = $1', block_hash)
+            records = self._get_transactions_records(transactions, inputs_addresses, block_hash, block_id, times_received)
+            await connection.copy_records_to_table('transactions', records=records, columns=TRANSACTIONS_COLUMNS)
+            await connection.copy_records_to_table('address_transactions', records=self._get_address_transactions_records(records, block_id), columns=ADDRESS_TRANSACTIONS_COLUMNS)
 
     async def add_block(self, id: int, block_hash: str, block_content: str, address: str, random: int, difficulty: Decimal, reward: Decimal, timestamp: Union[datetime, int]):
         async with self.pool.acquire() as connection:
-            stmt = await connection.prepare('INSERT INTO blocks (id, hash, content, address, random, difficulty, reward, timestamp) VALUES ($1, $2, $3, $4, $5, $6, $7, $8)')
-            await stmt.fetchval(
-                id,
-                block_hash,
-                block_content,
-                address,
-                random,
-                difficulty,
-                reward,
-                timestamp if isinstance(timestamp, datetime) else datetime.utcfromtimestamp(timestamp)
-            )
+            block = await self._insert_block(connection, id, block_hash, block_content, address, random, difficulty, reward, timestamp)
+        self._block_added(block)
+
+    @staticmethod
+    async def _insert_block(connection: Connection, id: int, block_hash: str, block_content: str, address: str, random: int, difficulty: Decimal, reward: Decimal, timestamp: Union[datetime, int]) -> dict:
+        block = await connection.fetchrow(
+            'INSERT INTO blocks (id, hash, content, address, random, difficulty, reward, timestamp) VALUES ($1, $2, $3, $4, $5, $6, $7, $8) RETURNING *',
+            id,
+            block_hash,
+            bytes.fromhex(block_content),
+            address,
+            random,
+            difficulty,
+            reward,
+            timestamp if isinstance(timestamp, datetime) else datetime.utcfromtimestamp(timestamp)
+        )
+        return normalize_block(block)
+
+    def _block_added(self, block: dict):
+        self.header_index.append(block['id'], block['hash'], block['timestamp'], block['difficulty'])
+        self.header_index.last_block = block
         from .manager import Manager
         Manager.difficulty = None
 
+    async def _get_spent_outputs_records(self, transactions: List[Transaction], block_id: int) -> List[tuple]:
+        records = []
+        for transaction in transactions:
+            for tx_input in transaction.inputs:
+                output = await tx_input.get_related_output_info()
+                height = output.get('height')
+                if height is None:
+                    height = await self.get_block_id((await tx_input.get_transaction_info())['block_hash'])
+                records.append((tx_input.tx_hash, tx_input.index, output['address'], int(output['amount'] * SMALLEST), height, block_id))
+        return records
+
+    async def connect_block(self, id: int, block_hash: str, block_content: str, address: str, random: int, difficulty: Decimal, reward: Decimal, timestamp: Union[datetime, int], coinbase_transaction: CoinbaseTransaction, transactions: List[Transaction]):
+        """
+        Writes a block with its transactions, its new unspent outputs and removes the spent ones and the confirmed pending
+        transactions, in a single database transaction: if anything fails, nothing of the block is left in the database.
+        The spent outputs are stored in spent_outputs, so that remove_blocks can restore them.
+        """
+        all_transactions = [coinbase_transaction] + transactions
+        inputs_addresses = await self._get_transactions_inputs_addresses(all_transactions)
+        spent_outputs = await self._get_spent_outputs_records(transactions, id)
+        tx_hashes = [transaction.hash() for transaction in transactions]
+        removed_tx_hashes = []
+        inputs = [(tx_input.tx_hash, tx_input.index) for transaction in transactions for tx_input in transaction.inputs]
+        outputs = [(transaction.hash(), index, output.address, int(output.amount * SMALLEST), id) for transaction in transactions + [coinbase_transaction] for index, output in enumerate(transaction.outputs)]
+        async with self.connect_lock:
+            cache = self.utxo_cache
+            async with self.pool.acquire() as connection:
+                async with connection.transaction():
+                    block = await self._insert_block(connection, id, block_hash, block_content, address, random, difficulty, reward, timestamp)
+                    times_received = await self._get_times_received(connection, all_transactions, block_hash)
+                    records = self._get_transactions_records(all_transactions, inputs_addresses, block_hash, id, times_received)
+                    await connection.copy_records_to_table('transactions', records=records, columns=TRANSACTIONS_COLUMNS)
+                    address_transactions = self._get_address_transactions_records(records, id)
+                    await connection.copy_records_to_table('address_transactions', records=address_transactions, columns=ADDRESS_TRANSACTIONS_COLUMNS)
+                    await connection.execute(
+                        'INSERT INTO address_stats (address, balance, utxo_count, received, sent, tx_count, first_height, last_height) '
+                        'SELECT *, $7, $7 FROM unnest($1::TEXT[], $2::BIGINT[], $3::INTEGER[], $4::BIGINT[], $5::BIGINT[], $6::INTEGER[]) '
+                        'ON CONFLICT (address) DO UPDATE SET balance = address_stats.balance + EXCLUDED.balance, utxo_count = address_stats.utxo_count + EXCLUDED.utxo_count, '
+                        'received = address_stats.received + EXCLUDED.received, sent = address_stats.sent + EXCLUDED.sent, '
+                        'tx_count = address_stats.tx_count + EXCLUDED.tx_count, last_height = EXCLUDED.last_height',
+                        *self._get_address_stats_records(outputs, spent_outputs, address_transactions), id)
+                    if cache is None:
+                        await connection.copy_records_to_table('unspent_outputs', records=outputs, columns=('tx_hash', 'index', 'address', 'amount', 'height'))
+                    if transactions:
+                        await connection.copy_records_to_table('spent_outputs', records=spent_outputs, columns=('tx_hash', 'index', 'address', 'amount', 'height', 'block_id'))
+                        await connection.execute(
+                            'INSERT INTO spent_by (tx_hash, index, spending_tx_hash, block_id) SELECT *, $4 FROM unnest($1::CHAR(64)[], $2::SMALLINT[], $3::CHAR(64)[]) ON CONFLICT DO NOTHING',
+                            [tx_input.tx_hash for transaction in transactions for tx_input in transaction.inputs],
+                            [tx_input.index for transaction in transactions for tx_input in transaction.inputs],
+                            [transaction.hash() for transaction in transactions for _ in transaction.inputs],
+                            id
+                        )
+                        # pending transactions spending the same outputs as the block are removed too
+                        removed_tx_hashes = [row['tx_hash'] for row in await connection.fetch(
+                            'DELETE FROM pending_transactions WHERE tx_hash = ANY($1) OR tx_hash = ANY(SELECT spending_tx_hash FROM pending_spent_by WHERE (tx_hash, index) = ANY($2::tx_output[])) RETURNING tx_hash',
+                            tx_hashes, inputs
+                        )]
+                        if cache is None:
+                            await connection.execute('DELETE FROM unspent_outputs WHERE (tx_hash, index) = ANY($1::tx_output[])', inputs)
+                        await connection.execute('DELETE FROM pending_spent_outputs WHERE (tx_hash, index) = ANY($1::tx_output[])', inputs)
+            self._block_added(block)
+            self.mempool.remove_many(tx_hashes + removed_tx_hashes)
+            if cache is not None:
+                cache.connect(id, {(tx_hash, index): {'address': output_address, 'amount': Decimal(amount) / SMALLEST, 'height': height} for tx_hash, index, output_address, amount, height in outputs}, inputs)
+                if cache.need_flush():
+                    await self._flush_utxo_cache()
+            # the next partition is created once a block enters the last one
+            if self.partition_blocks and id + self.partition_blocks >= self.partitions_end:
+                async with self.pool.acquire() as connection:
+                    await self._create_partitions(connection)
+
     async def get_transaction(self, tx_hash: str, check_signatures: bool = True) -> Union[Transaction, CoinbaseTransaction]:
         async with self.pool.acquire() as connection:
-            res = tx = await connection.fetchrow('SELECT tx_hex, block_hash FROM transactions WHERE tx_hash = $1', tx_hash)
+            res = tx = await connection.fetchrow("SELECT encode(tx_hex, 'hex') AS tx_hex, block_hash FROM transactions WHERE tx_hash = $1", tx_hash)
         if res is not None:
             tx = await Transaction.from_hex(res['tx_hex'], check_signatures)
             tx.block_hash = res['block_hash']
@@ -269,117 +764,141 @@ class Database:
     async def get_transaction_info(self, tx_hash: str) -> dict:
         async with self.pool.acquire() as connection:
             res = await connection.fetchrow('SELECT * FROM transactions WHERE tx_hash = $1', tx_hash)
-        return dict(res) if res is not None else None
+        return normalize_transaction(res) if res is not None else None
 
     async def get_transactions_info(self, tx_hashes: List[str]) -> Dict[str, dict]:
         async with self.pool.acquire() as connection:
             res = await connection.fetch('SELECT * FROM transactions WHERE tx_hash = ANY($1)', tx_hashes)
-        return {res['tx_hash']: dict(res) for res in res}
+        return {res['tx_hash']: normalize_transaction(res) for res in res}
 
 
     async def get_pending_transaction(self, tx_hash: str, check_signatures: bool = True) -> Transaction:
-        async with self.pool.acquire() as connection:
-            res = await connection.fetchrow('SELECT tx_hex FROM pending_transactions WHERE tx_hash = $1', tx_hash)
-        return await Transaction.from_hex(res['tx_hex'], check_signatures) if res is not None else None
+        entry = self.mempool.get(tx_hash)
+        return entry.tx if entry is not None else None
 
     async def get_pending_transactions_by_hash(self, hashes: List[str], check_signatures: bool = True) -> List[Transaction]:
-        async with self.pool.acquire() as connection:
-            res = await connection.fetch('SELECT tx_hex FROM pending_transactions WHERE tx_hash = ANY($1)', hashes)
-        return [await Transaction.from_hex(tx['tx_hex'], check_signatures) for tx in res]
+        return [self.mempool.get(tx_hash).tx for tx_hash in dict.fromkeys(hashes) if tx_hash in self.mempool]
 
     async def get_transactions(self, tx_hashes: List[str]):
         async with self.pool.acquire() as connection:
-            res = await connection.fetch('SELECT tx_hex FROM transactions WHERE tx_hash = ANY($1)', tx_hashes)
+            res = await connection.fetch("SELECT encode(tx_hex, 'hex') AS tx_hex FROM transactions WHERE tx_hash = ANY($1)", tx_hashes)
         return {sha256(res['tx_hex']): await Transaction.from_hex(res['tx_hex']) for res in res}
 
-    async def get_transaction_hash_by_contains_multi(self, contains: List[str], ignore: str = None):
+    @staticmethod
+    def _outputs_from_hex(outputs_hex: List[str]) -> List[Tuple[str, int]]:
+        # an output in hex is its tx hash followed by its index byte, as in the transactions inputs
+        return [(output_hex[:64], int(output_hex[64:66], 16)) for output_hex in outputs_hex]
+
+    async def get_spending_transaction_hash(self, outputs: List[Tuple[str, int]], ignore: str = None) -> Union[str, None]:
+        """
+        Returns the hash of a confirmed transaction spending one of outputs, other than ignore.
+        """
         async with self.pool.acquire() as connection:
-            if ignore is not None:
-                res = await connection.fetchrow(
-                    'SELECT tx_hash FROM transactions WHERE tx_hex LIKE ANY($1) AND tx_hash != $2 LIMIT 1',
-                    [f"%{contains}%" for contains in contains],
-                    ignore
-                )
-            else:
-                res = await connection.fetchrow(
-                    'SELECT tx_hash FROM transactions WHERE tx_hex LIKE ANY($1) LIMIT 1',
-                    [f"%{contains}%" for contains in contains],
-                )
-        return res['tx_hash'] if res is not None else None
+            return await connection.fetchval(
+                'SELECT spending_tx_hash FROM spent_by WHERE (tx_hash, index) = ANY($1::tx_output[]) AND spending_tx_hash IS DISTINCT FROM $2 LIMIT 1',
+                outputs, ignore
+            )
+
+    async def get_pending_spending_transactions_hashes(self, outputs: List[Tuple[str, int]], ignore: str = None) -> List[str]:
+        async with self.pool.acquire() as connection:
+            res = await connection.fetch(
+                'SELECT DISTINCT spending_tx_hash FROM pending_spent_by WHERE (tx_hash, index) = ANY($1::tx_output[]) AND spending_tx_hash IS DISTINCT FROM $2',
+                outputs, ignore
+            )
+        return [row['spending_tx_hash'] for row in res]
+
+    async def remove_pending_spending_transactions(self, outputs: List[Tuple[str, int]]) -> None:
+        """
+        Removes the pending transactions spending one of outputs.
+        """
+        async with self.pool.acquire() as connection:
+            res = await connection.fetch(
+                'DELETE FROM pending_transactions WHERE tx_hash = ANY(SELECT spending_tx_hash FROM pending_spent_by WHERE (tx_hash, index) = ANY($1::tx_output[])) RETURNING tx_hash',
+                outputs
+            )
+        self.mempool.remove_many([row['tx_hash'] for row in res])
+
+    async def get_transaction_hash_by_contains_multi(self, contains: List[str], ignore: str = None):
+        return await self.get_spending_transaction_hash(self._outputs_from_hex(contains), ignore)
 
     async def get_pending_transactions_by_contains(self, contains: str):
+        # pending transactions spending the outputs of the transaction contains
         async with self.pool.acquire() as connection:
-            res = await connection.fetch('SELECT tx_hex FROM pending_transactions WHERE tx_hex LIKE $1 AND tx_hash != $2', f"%{contains}%", contains)
-        return [await Transaction.from_hex(res['tx_hex']) for res in res] if res is not None else None
+            res = await connection.fetch(
+                'SELECT tx_hex FROM pending_transactions WHERE tx_hash = ANY(SELECT spending_tx_hash FROM pending_spent_by WHERE tx_hash = $1) AND tx_hash != $1',
+                contains
+            )
+        return [await Transaction.from_hex(res['tx_hex']) for res in res]
 
     async def remove_pending_transactions_by_contains(self, search: List[str]) -> None:
-        async with self.pool.acquire() as connection:
-            await connection.execute('DELETE FROM pending_transactions WHERE tx_hex LIKE ANY($1)', [f"%{c}%" for c in search])
+        await self.remove_pending_spending_transactions(self._outputs_from_hex(search))
 
     async def get_pending_transaction_by_contains_multi(self, contains: List[str], ignore: str = None):
-        async with self.pool.acquire() as connection:
-            if ignore is not None:
-                res = await connection.fetchrow(
-                    'SELECT tx_hex FROM pending_transactions WHERE tx_hex LIKE ANY($1) AND tx_hash != $2 LIMIT 1',
-                    [f"%{contains}%" for contains in contains],
-                    ignore
-                )
-            else:
-                res = await connection.fetchrow(
-                    'SELECT tx_hex FROM pending_transactions WHERE tx_hex LIKE ANY($1) LIMIT 1',
-                    [f"%{contains}%" for contains in contains],
-                )
-        return await Transaction.from_hex(res['tx_hex']) if res is not None else None
+        tx_hashes = await self.get_pending_spending_transactions_hashes(self._outputs_from_hex(contains), ignore)
+        return await self.get_pending_transaction(tx_hashes[0]) if tx_hashes else None
 
     async def get_last_block(self) -> dict:
-        async with self.pool.acquire() as connection:
-            last_block = await connection.fetchrow("SELECT * FROM blocks ORDER BY id DESC LIMIT 1")
-        return normalize_block(last_block) if last_block is not None else None
+        if not len(self.header_index):
+            return None
+        if self.header_index.last_block is None:
+            async with self.pool.acquire() as connection:
+                last_block = await connection.fetchrow("SELECT * FROM blocks ORDER BY id DESC LIMIT 1")
+            self.header_index.last_block = normalize_block(last_block)
+        return dict(self.header_index.last_block)
 
     async def get_next_block_id(self) -> int:
-        async with self.pool.acquire() as connection:
-            last_id = await connection.fetchval('SELECT id FROM blocks ORDER BY id DESC LIMIT 1', column=0)
-        last_id = last_id if last_id is not None else 0
-        return last_id + 1
+        return self.header_index.get_next_id()
+
+    async def get_block_id(self, block_hash: str) -> Union[int, None]:
+        block_id = self.header_index.get_id(block_hash)
+        if block_id is None:
+            # not in the chain, or colliding entry of the index
+            async with self.pool.acquire() as connection:
+                block_id = await connection.fetchval('SELECT id FROM blocks WHERE hash = $1', block_hash)
+        return block_id
+
+    async def get_block_timestamp(self, block_id: int) -> Union[int, None]:
+        return self.header_index.get_timestamp(block_id)
 
     async def get_block(self, block_hash: str) -> dict:
         async with self.pool.acquire() as connection:
             block = await connection.fetchrow('SELECT * FROM blocks WHERE hash = $1', block_hash)
         return normalize_block(block) if block is not None else None
 
-    async def get_blocks(self, offset: int, limit: int) -> list:
+    async def get_block_contents(self, offset: int, limit: int) -> List[str]:
         async with self.pool.acquire() as connection:
-            transactions: list = await connection.fetch(f'SELECT tx_hex, block_hash FROM transactions WHERE block_hash = ANY(SELECT hash FROM blocks WHERE id >= $1 ORDER BY id LIMIT $2)', offset, limit)
-            #transactions: list = await connection.fetch(f'SELECT tx_hex, block_hash, time_received FROM transactions WHERE block_hash = ANY(SELECT hash FROM blocks WHERE id >= $1 ORDER BY id LIMIT $2)', offset, limit)
-            blocks = await connection.fetch(f'SELECT * FROM blocks WHERE id >= $1 ORDER BY id LIMIT $2', offset, limit)
-
-        index = {block['hash']: [] for block in blocks}
-        for transaction in transactions:
-            #time_received = 0
-            #if transaction["time_received"] is not None:
-                 #Convert time_recieved to a unix timestamp          
-            #    time_received = int(round(transaction['time_received'].replace(tzinfo=timezone.utc).timestamp()))
-            # Convert the unix timestamp to it's smallest possible representation in bytes (4 bytes)
-            #time_received_bytes = await Transaction.timestamp_to_bytes(time_received)
-            
-            # Append bytes in hex format to the end of the transaction data
-            #index[transaction['block_hash']].append(transaction['tx_hex']+time_received_bytes.hex())
-            index[transaction['block_hash']].append(transaction['tx_hex'])
-
-        result = []
+            res = await connection.fetch("SELECT encode(content, 'hex') AS content FROM blocks WHERE id >= $1 ORDER BY id LIMIT $2", offset, limit)
+        return [row['content'] for row in res]
+
+    async def iter_blocks(self, offset: int, limit: int) -> AsyncIterator[dict]:
+        """
+        Yields the blocks from offset with their transactions, one at a time, reading ITER_BLOCKS_PAGE_SIZE blocks at once.
+        A connection is held only while a page is read, so slow readers of the stream do not keep it.
+        Stops before the block which would bring the transactions over MAX_BLOCKS_RESPONSE_SIZE_HEX.
+        """
         size = 0
-        for block in blocks:
-            block = normalize_block(block)
-            block_hash = block['hash']
-            txs = OLD_BLOCKS_TRANSACTIONS_ORDER.get(block_hash) or index[block_hash]
-            size += sum(len(tx) for tx in txs)
-            if size > MAX_BLOCK_SIZE_HEX * 8:
-                break
-            result.append({
-                'block': block,
-                'transactions': txs
-            })
-        return result
+        end = offset + limit
+        for page_offset in range(offset, end, ITER_BLOCKS_PAGE_SIZE):
+            page_end = min(page_offset + ITER_BLOCKS_PAGE_SIZE, end)
+            async with self.pool.acquire() as connection:
+                rows = await connection.fetch(
+                    "SELECT blocks.*, encode(transactions.tx_hex, 'hex') AS tx_hex FROM blocks LEFT JOIN transactions ON (transactions.block_hash = blocks.hash "
+                    'AND transactions.block_id >= $1 AND transactions.block_id < $2) WHERE blocks.id >= $1 AND blocks.id < $2 ORDER BY blocks.id', page_offset, page_end
+                )
+            if not rows:
+                return
+            for _, block_rows in groupby(rows, key=lambda row: row['id']):
+                block_rows = list(block_rows)
+                block = normalize_block(block_rows[0])
+                del block['tx_hex']
+                txs = OLD_BLOCKS_TRANSACTIONS_ORDER.get(block['hash']) or [row['tx_hex'] for row in block_rows if row['tx_hex'] is not None]
+                size += sum(len(tx) for tx in txs)
+                if size > MAX_BLOCKS_RESPONSE_SIZE_HEX:
+                    return
+                yield {'block': block, 'transactions': txs}
+
+    async def get_blocks(self, offset: int, limit: int) -> list:
+        return [block_info async for block_info in self.iter_blocks(offset, limit)]
 
     async def get_block_by_id(self, block_id: int) -> dict:
         async with self.pool.acquire() as connection:
@@ -388,12 +907,12 @@ class Database:
 
     async def get_block_transactions(self, block_hash: str, check_signatures: bool = True, hex_only: bool = False) -> List[Union[Transaction, CoinbaseTransaction]]:
         async with self.pool.acquire() as connection:
-            txs = await connection.fetch('SELECT tx_hex FROM transactions WHERE block_hash = $1', block_hash)
+            txs = await connection.fetch("SELECT encode(tx_hex, 'hex') AS tx_hex FROM transactions WHERE block_hash = $1", block_hash)
         return [tx['tx_hex'] if hex_only else await Transaction.from_hex(tx['tx_hex'], check_signatures) for tx in txs]
 
     async def get_block_transaction_hashes(self, block_hash: str) -> List[str]:
         async with self.pool.acquire() as connection:
-            txs = await connection.fetch("SELECT tx_hash FROM transactions WHERE block_hash = $1 AND tx_hex NOT LIKE '%' || block_hash || '%'", block_hash)
+            txs = await connection.fetch("SELECT tx_hash FROM transactions WHERE block_hash = $1 AND position(decode(block_hash, 'hex') IN tx_hex) = 0", block_hash)
         return [tx['tx_hash'] for tx in txs]
 
     async def get_block_nice_transactions(self, block_hash: str) -> List[dict]:
@@ -404,11 +923,14 @@ class Database:
     async def add_unspent_outputs(self, outputs: List[Tuple[str, int]]) -> None:
         if not outputs:
             return
+        # address, amount and height are taken from the transactions which created the outputs
+        outputs = [(output[0], output[1]) for output in outputs]
         async with self.pool.acquire() as connection:
-            if len(outputs[0]) == 2:
-                await connection.executemany('INSERT INTO unspent_outputs (tx_hash, index) VALUES ($1, $2)', outputs)
-            elif len(outputs[0]) == 3:
-                await connection.executemany('INSERT INTO unspent_outputs (tx_hash, index, address) VALUES ($1, $2, $3)', outputs)
+            await connection.execute(
+                'INSERT INTO unspent_outputs (tx_hash, index, address, amount, height) '
+                'SELECT transactions.tx_hash, outputs.index, transactions.outputs_addresses[outputs.index + 1], transactions.outputs_amounts[outputs.index + 1], blocks.id '
+                'FROM UNNEST($1::tx_output[]) AS outputs INNER JOIN transactions ON (transactions.tx_hash = outputs.tx_hash) INNER JOIN blocks ON (blocks.hash = transactions.block_hash) '
+                'ON CONFLICT DO NOTHING', outputs)
 
     async def add_pending_spent_outputs(self, outputs: List[Tuple[str, int]]) -> None:
         async with self.pool.acquire() as connection:
@@ -437,19 +959,37 @@ class Database:
             await connection.execute('DELETE FROM pending_spent_outputs WHERE (tx_hash, index) = ANY($1::tx_output[])', inputs)
 
     async def get_unspent_outputs(self, outputs: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        if self.utxo_cache is not None:
+            return list(await self.get_unspent_outputs_info(outputs))
         async with self.pool.acquire() as connection:
             results = await connection.fetch('SELECT tx_hash, index FROM unspent_outputs WHERE (tx_hash, index) = ANY($1::tx_output[])', outputs)
             return [(row['tx_hash'], row['index']) for row in results]
 
+    async def get_unspent_outputs_info(self, outputs: List[Tuple[str, int]]) -> Dict[Tuple[str, int], dict]:
+        cache = self.utxo_cache
+        if cache is not None:
+            found, outputs = cache.get(outputs)
+            if not outputs:
+                return found
+            generation = cache.generation
+        async with self.pool.acquire() as connection:
+            results = await connection.fetch('SELECT tx_hash, index, address, amount, height FROM unspent_outputs WHERE (tx_hash, index) = ANY($1::tx_output[])', outputs)
+        results = {(row['tx_hash'], row['index']): {'address': row['address'], 'amount': Decimal(row['amount']) / SMALLEST if row['amount'] is not None else None, 'height': row['height']} for row in results}
+        if cache is not None:
+            # outputs may have been spent by a block connected in the meantime
+            results = {outpoint: output for outpoint, output in results.items() if outpoint not in cache.spent}
+            cache.add_fetched(results, generation)
+            results.update(found)
+        return results
+
     async def get_unspent_outputs_hash(self) -> str:
+        await self.flush_utxo_cache()
         async with self.pool.acquire() as connection:
             rows = await connection.fetch('SELECT tx_hash, index FROM unspent_outputs ORDER BY tx_hash, index')
             return sha256(''.join(row['tx_hash'] + bytes([row['index']]).hex() for row in rows))
 
     async def get_pending_spent_outputs(self, outputs: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
-        async with self.pool.acquire() as connection:
-            results = await connection.fetch('SELECT tx_hash, index FROM pending_spent_outputs WHERE (tx_hash, index) = ANY($1::tx_output[])', outputs)
-            return [(row['tx_hash'], row['index']) for row in results]
+        return self.mempool.get_spent_outputs(outputs)
 
     async def set_unspent_outputs_addresses(self):
         assert self.is_indexed, 'cannot set unspent outputs addresses if addresses are not indexed'
@@ -458,7 +998,7 @@ class Database:
 
     async def get_unspent_outputs_from_all_transactions(self):
         async with self.pool.acquire() as connection:
-            txs = await connection.fetch('SELECT tx_hex, blocks.id AS block_no FROM transactions INNER JOIN blocks ON (transactions.block_hash = blocks.hash) ORDER BY blocks.id ASC')
+            txs = await connection.fetch("SELECT encode(tx_hex, 'hex') AS tx_hex, blocks.id AS block_no FROM transactions INNER JOIN blocks ON (transactions.block_hash = blocks.hash) ORDER BY blocks.id ASC")
         outputs = set()
         last_block_no = 0
         for tx in txs:
@@ -472,18 +1012,39 @@ class Database:
             outputs.update({(tx_hash, index) for index in range(len(transaction.outputs))})  # append
         return list(outputs)
 
+    async def get_address_history(self, address: str, limit: int = 50, cursor: str = None, offset: int = 0) -> Tuple[List[Tuple[int, str, str]], Union[str, None]]:
+        """
+        Returns the (block id, tx hash, tx hex) of the transactions of address, newest first, from address_transactions,
+        and the cursor of the next page, or None if there are no more transactions.
+        The cursor is "<block id>:<tx hash>" of the last transaction of the previous page, and costs the same at any page.
+        """
+        point = string_to_point(address)
+        addresses = [point_to_string(point, address_format) for address_format in list(AddressFormat)]
+        if cursor is not None:
+            block_id, tx_hash = cursor.split(':')
+            block_id = int(block_id)
+        else:
+            block_id, tx_hash = 2 ** 31 - 1, ''
+        async with self.pool.acquire() as connection:
+            # every address format is looked up on its own, so each lookup reads the index in order
+            res = await connection.fetch(
+                "SELECT DISTINCT ON (h.block_id, h.tx_hash) h.block_id, h.tx_hash, encode(transactions.tx_hex, 'hex') AS tx_hex "
+                'FROM unnest($1::text[]) AS a(address) CROSS JOIN LATERAL ('
+                '    SELECT block_id, tx_hash FROM address_transactions WHERE address_transactions.address = a.address AND (block_id, tx_hash) < ($2, $3)'
+                '    ORDER BY block_id DESC, tx_hash DESC LIMIT $4'
+                ') AS h INNER JOIN transactions ON (transactions.block_id = h.block_id AND transactions.tx_hash = h.tx_hash) '
+                'ORDER BY h.block_id DESC, h.tx_hash DESC LIMIT $5 OFFSET $6', addresses, block_id, tx_hash, limit + offset + 1, limit + 1, offset)
+        history = [(row['block_id'], row['tx_hash'], row['tx_hex']) for row in res]
+        next_cursor = f'{history[limit - 1][0]}:{history[limit - 1][1]}' if len(history) > limit else None
+        return history[:limit], next_cursor
+
     async def get_address_transactions(self, address: str, check_pending_txs: bool = False, check_signatures: bool = False, limit: int = 50, offset: int = 0) -> List[Union[Transaction, CoinbaseTransaction]]:
         point = string_to_point(address)
         search = ['%' + point_to_bytes(string_to_point(address), address_format).hex() + '%' for address_format in list(AddressFormat)]
         addresses = [point_to_string(point, address_format) for address_format in list(AddressFormat)]
+        history, _ = await self.get_address_history(address, limit, offset=offset)
+        txs = [{'tx_hex': tx_hex} for _, _, tx_hex in history]
         async with self.pool.acquire() as connection:
-            # Adjusted SQL query to include OFFSET for pagination
-            txs = await connection.fetch(
-                'SELECT tx_hex, blocks.id AS block_no FROM transactions '
-                'INNER JOIN blocks ON (transactions.block_hash = blocks.hash) '
-                'WHERE $1 && inputs_addresses OR $1 && outputs_addresses '
-                'ORDER BY block_no DESC LIMIT $2 OFFSET $3', addresses, limit, offset)
-            
             if check_pending_txs:
                 pending_txs = await connection.fetch(
                     "SELECT tx_hex FROM pending_transactions WHERE tx_hex LIKE ANY($1) "
@@ -517,12 +1078,37 @@ class Database:
             if await connection.fetchrow('SELECT tx_hash, index FROM unspent_outputs WHERE address IS NULL') is not None:
                 await self.set_unspent_outputs_addresses()
             if not check_pending_txs:
-                unspent_outputs = await connection.fetch('SELECT unspent_outputs.tx_hash, index, transactions.outputs_amounts[index + 1] AS amount FROM unspent_outputs INNER JOIN transactions ON (transactions.tx_hash = unspent_outputs.tx_hash) WHERE address = ANY($1)', addresses)
+                unspent_outputs = await connection.fetch('SELECT tx_hash, index, amount FROM unspent_outputs WHERE address = ANY($1)', addresses)
             else:
-                unspent_outputs = await connection.fetch('SELECT unspent_outputs.tx_hash, index, transactions.outputs_amounts[index + 1] AS amount FROM unspent_outputs INNER JOIN transactions ON (transactions.tx_hash = unspent_outputs.tx_hash) WHERE address = ANY($1) AND CONCAT(unspent_outputs.tx_hash, unspent_outputs.index) != ALL(SELECT CONCAT(pending_spent_outputs.tx_hash, pending_spent_outputs.index) FROM pending_spent_outputs)', addresses, timeout=60)
+                unspent_outputs = await connection.fetch('SELECT tx_hash, index, amount FROM unspent_outputs WHERE address = ANY($1) AND CONCAT(unspent_outputs.tx_hash, unspent_outputs.index) != ALL(SELECT CONCAT(pending_spent_outputs.tx_hash, pending_spent_outputs.index) FROM pending_spent_outputs)', addresses, timeout=60)
         return [TransactionInput(tx_hash, index, amount=Decimal(amount) / SMALLEST, public_key=point) for tx_hash, index, amount in unspent_outputs]
 
+    async def get_address_stats(self, address: str) -> dict:
+        """
+        Returns the statistics of address from address_stats, summed over its address formats.
+        Amounts are returned as Decimal, heights are None if the address has never been seen.
+        """
+        point = string_to_point(address)
+        addresses = [point_to_string(point, address_format) for address_format in list(AddressFormat)]
+        async with self.pool.acquire() as connection:
+            res = await connection.fetchrow(
+                'SELECT COALESCE(SUM(balance), 0) AS balance, COALESCE(SUM(utxo_count), 0) AS utxo_count, COALESCE(SUM(received), 0) AS received, '
+                'COALESCE(SUM(sent), 0) AS sent, COALESCE(SUM(tx_count), 0) AS tx_count, MIN(first_height) AS first_height, MAX(last_height) AS last_height '
+                'FROM address_stats WHERE address = ANY($1)', addresses)
+        stats = dict(res)
+        for key in ('balance', 'received', 'sent'):
+            stats[key] = Decimal(stats[key]) / SMALLEST
+        stats['utxo_count'], stats['tx_count'] = int(stats['utxo_count']), int(stats['tx_count'])
+        return stats
+
+    async def get_rich_list(self, limit: int = 100, offset: int = 0) -> List[dict]:
+        async with self.pool.acquire() as connection:
+            res = await connection.fetch('SELECT address, balance, utxo_count, tx_count FROM address_stats ORDER BY balance DESC LIMIT $1 OFFSET $2', limit, offset)
+        return [{'address': row['address'], 'balance': Decimal(row['balance']) / SMALLEST, 'utxo_count': row['utxo_count'], 'tx_count': row['tx_count']} for row in res]
+
     async def get_address_balance(self, address: str, check_pending_txs: bool = False) -> Decimal:
+        if not check_pending_txs:
+            return (await self.get_address_stats(address))['balance']
         point = string_to_point(address)
         search = ['%'+point_to_bytes(string_to_point(address), address_format).hex()+'%' for address_format in list(AddressFormat)]
         addresses = [point_to_string(point, address_format) for address_format in list(AddressFormat)]
@@ -542,8 +1128,8 @@ class Database:
         point = string_to_point(address)
         addresses = [point_to_string(point, address_format) for address_format in list(AddressFormat)]
         async with self.pool.acquire() as connection:
-            unspent_outputs = await connection.fetch('SELECT unspent_outputs.tx_hash, index, transactions.outputs_amounts[index + 1] AS amount FROM unspent_outputs INNER JOIN transactions ON (transactions.tx_hash = unspent_outputs.tx_hash) INNER JOIN blocks ON (blocks.hash = transactions.block_hash) WHERE unspent_outputs.address = ANY($1) AND blocks.id >= $2', addresses, block_no)
-            spending_txs = await connection.fetch('SELECT tx_hex, blocks.id AS block_no FROM transactions INNER JOIN blocks ON (transactions.block_hash = blocks.hash) WHERE $1 = ANY(inputs_addresses) AND blocks.id >= $2 LIMIT $2', address, block_no)
+            unspent_outputs = await connection.fetch('SELECT tx_hash, index, amount FROM unspent_outputs WHERE address = ANY($1) AND height >= $2', addresses, block_no)
+            spending_txs = await connection.fetch("SELECT encode(tx_hex, 'hex') AS tx_hex, block_id AS block_no FROM transactions WHERE $1 = ANY(inputs_addresses) AND block_id >= $2 LIMIT $2", address, block_no)
         unspent_outputs = [TransactionInput(tx_hash, index, amount=Decimal(amount) / SMALLEST, public_key=point) for tx_hash, index, amount in unspent_outputs]
         spending_txs = [await Transaction.from_hex(tx['tx_hex'], False) for tx in spending_txs]
         spent_outputs = sum([tx.inputs for tx in spending_txs], [])
@@ -562,7 +1148,7 @@ class Database:
                 await connection.execute("ALTER TABLE transactions ADD COLUMN time_received TIMESTAMP;")
 
             get_pending = False
-            res = await connection.fetchrow('SELECT tx_hex, tx_hash, block_hash, inputs_addresses, time_received FROM transactions WHERE tx_hash = $1', tx_hash)
+            res = await connection.fetchrow("SELECT encode(tx_hex, 'hex') AS tx_hex, tx_hash, block_hash, inputs_addresses, time_received FROM transactions WHERE tx_hash = $1", tx_hash)
             if res is None:
                 get_pending = True
                 res = await connection.fetchrow('SELECT tx_hex, tx_hash, inputs_addresses, time_received FROM pending_transactions WHERE tx_hash = $1', tx_hash)
@@ -0,0 +1,84 @@
+from array import array
+from decimal import Decimal
+from typing import Dict, Union
+
+
+class HeaderIndex:
+    """
+    Compact in-memory index of the chain headers, kept by Database while blocks are added and removed.
+
+    Block ids start from 1 and are contiguous, so the block n is stored at position n - 1 of the arrays:
+    hashes are kept as 32 raw bytes each, timestamps as 32 bits integers and difficulties multiplied by 10.
+    The hash -> id map is keyed by the last 8 bytes of the hash (the first ones depend on the previous block
+    hash), lookups are verified against the full hash and callers fall back to the database on collisions.
+    """
+
+    def __init__(self):
+        self.hashes = bytearray()
+        self.timestamps = array('L')
+        self.difficulties = array('H')
+        self.ids: Dict[int, int] = {}
+        self.last_block: dict = None
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @staticmethod
+    def _key(block_hash: bytes) -> int:
+        return int.from_bytes(block_hash[-8:], 'little')
+
+    def append(self, block_id: int, block_hash: str, timestamp: int, difficulty: Union[Decimal, float]):
+        assert block_id == len(self) + 1, f'block {block_id} is not the next one of the index'
+        hash_bytes = bytes.fromhex(block_hash)
+        self.hashes += hash_bytes
+        self.timestamps.append(timestamp)
+        self.difficulties.append(int(round(Decimal(difficulty) * 10)))
+        self.ids[self._key(hash_bytes)] = block_id
+
+    def truncate(self, last_block_id: int):
+        """
+        Removes every block after last_block_id.
+        """
+        last_block_id = max(last_block_id, 0)
+        for block_id in range(len(self), last_block_id, -1):
+            hash_bytes = bytes(self.hashes[(block_id - 1) * 32:block_id * 32])
+            if self.ids.get(self._key(hash_bytes)) == block_id:
+                del self.ids[self._key(hash_bytes)]
+        del self.hashes[last_block_id * 32:]
+        del self.timestamps[last_block_id:]
+        del self.difficulties[last_block_id:]
+        if self.last_block is not None and self.last_block['id'] > last_block_id:
+            self.last_block = None
+
+    def get_next_id(self) -> int:
+        return len(self) + 1
+
+    def has(self, block_id: int) -> bool:
+        return 1 <= block_id <= len(self)
+
+    # heights calculated from BLOCKS_COUNT are Decimal, arrays are indexed by int
+    def get_hash(self, block_id: int) -> str:
+        block_id = int(block_id)
+        return self.hashes[(block_id - 1) * 32:block_id * 32].hex() if self.has(block_id) else None
+
+    def get_timestamp(self, block_id: int) -> int:
+        block_id = int(block_id)
+        return self.timestamps[block_id - 1] if self.has(block_id) else None
+
+    def get_difficulty(self, block_id: int) -> Decimal:
+        block_id = int(block_id)
+        return Decimal(self.difficulties[block_id - 1]) / 10 if self.has(block_id) else None
+
+    def get_id(self, block_hash: str) -> Union[int, None]:
+        """
+        Returns the id of the block, None if the block is not in the chain or its entry has been
+        overwritten by a colliding one.
+        """
+        try:
+            hash_bytes = bytes.fromhex(block_hash)
+        except ValueError:
+            return None
+        block_id = self.ids.get(self._key(hash_bytes))
+        if block_id is None or self.hashes[(block_id - 1) * 32:block_id * 32] != hash_bytes:
+            return None
+        return block_id
@@ -48,11 +48,19 @@ def byte_length(i: int):
 
 def normalize_block(block) -> dict:
     block = dict(block)
+    if isinstance(block.get('content'), bytes):
+        block['content'] = block['content'].hex()
     block['address'] = block['address'].strip(' ')
     block['timestamp'] = int(block['timestamp'].replace(tzinfo=timezone.utc).timestamp())
     return block
 
 
+def normalize_transaction(transaction) -> dict:
+    transaction = dict(transaction)
+    transaction['tx_hex'] = transaction['tx_hex'].hex()
+    return transaction
+
+
 def x_to_y(x: int, is_odd: bool = False):
     a, b, p = CURVE.a, CURVE.b, CURVE.p
     y2 = x ** 3 + a * x + b
@@ -1,6 +1,7 @@
 import hashlib
 from decimal import Decimal
 from io import BytesIO
+from itertools import permutations
 from math import ceil, floor, log
 from typing import Tuple, List, Union
 
@@ -10,11 +11,13 @@ from . import Database
 from .constants import MAX_SUPPLY, ENDIAN, MAX_BLOCK_SIZE_HEX
 from .database import OLD_BLOCKS_TRANSACTIONS_ORDER
 from .helpers import sha256, timestamp, bytes_to_string, string_to_bytes
+from .signatures import SignatureVerifier
 from .transactions import CoinbaseTransaction, Transaction
 
 BLOCK_TIME = 180
 BLOCKS_COUNT = Decimal(500)
 START_DIFFICULTY = Decimal('6.0')
+GENESIS_PREVIOUS_HASH = (30_06_2005).to_bytes(32, ENDIAN).hex()
 
 _print = print
 print = ic
@@ -71,12 +74,23 @@ async def calculate_difficulty() -> Tuple[Decimal, dict]:
         return START_DIFFICULTY, dict()
     last_block = dict(last_block)
     last_block['address'] = last_block['address'].strip(' ')
+    last_adjust_block_timestamp = None
+    if last_block['id'] >= BLOCKS_COUNT and last_block['id'] % BLOCKS_COUNT == 0:
+        last_adjust_block_timestamp = await database.get_block_timestamp(int(last_block['id'] - BLOCKS_COUNT + 1))
+    return get_next_difficulty(last_block, last_adjust_block_timestamp), last_block
+
+
+def get_next_difficulty(last_block: dict, last_adjust_block_timestamp: int = None) -> Decimal:
+    """
+    Returns the difficulty of the block after last_block, which needs id, difficulty and timestamp.
+    last_adjust_block_timestamp is the timestamp of the block last_block['id'] - BLOCKS_COUNT + 1, it is used only
+    when the difficulty is adjusted.
+    """
     if last_block['id'] < BLOCKS_COUNT:
-        return START_DIFFICULTY, last_block
+        return START_DIFFICULTY
 
     if last_block['id'] % BLOCKS_COUNT == 0:
-        last_adjust_block = await database.get_block_by_id(last_block['id'] - BLOCKS_COUNT + 1)
-        elapsed = last_block['timestamp'] - last_adjust_block['timestamp']
+        elapsed = last_block['timestamp'] - last_adjust_block_timestamp
         average_per_block = elapsed / BLOCKS_COUNT
         last_difficulty = last_block['difficulty']
         if last_block['id'] <= 17500:
@@ -94,9 +108,14 @@ async def calculate_difficulty() -> Tuple[Decimal, dict]:
             new_difficulty = hashrate_to_difficulty_wrong(hashrate)
         else:
             new_difficulty = hashrate_to_difficulty(hashrate)
-        return new_difficulty, last_block
+        return new_difficulty
 
-    return last_block['difficulty'], last_block
+    return last_block['difficulty']
+
+
+def get_block_hash(block_content: str, block_no: int) -> str:
+    # block 17972 is stored with another hash, next block refers to it
+    return sha256(block_content) if block_no != 17972 else '37cb1a0522c039330775e07d824c94e0422dbfb2dba6dcd421f4dc9f11601672'
 
 
 async def get_difficulty() -> Tuple[Decimal, dict]:
@@ -177,7 +196,7 @@ async def clear_pending_transactions(transactions=None):
     if double_spend_inputs == set(used_inputs):
         await database.remove_pending_transactions()
     elif double_spend_inputs:
-        await database.remove_pending_transactions_by_contains([tx_input[0] + bytes([tx_input[1]]).hex() for tx_input in double_spend_inputs])
+        await database.remove_pending_spending_transactions(list(double_spend_inputs))
 
 
 def get_transactions_merkle_tree_ordered(transactions: List[Union[Transaction, str]]):
@@ -215,6 +234,47 @@ def block_to_bytes(last_block_hash: str, block: dict) -> bytes:
            + block['random'].to_bytes(4, ENDIAN)
 
 
+def get_block_content(block: dict, hex_txs: List[str], last_block_hash: str) -> str:
+    """
+    Returns the content of a block, rebuilding it from its fields and its transactions without the coinbase one when
+    it is not set, as old blocks have been stored without it.
+    """
+    i = block['id']
+    block['merkle_tree'] = get_transactions_merkle_tree(hex_txs) if i > 22500 else get_transactions_merkle_tree_ordered(hex_txs)
+    block_content = block.get('content') or block_to_bytes(last_block_hash, block)
+
+    if i <= 22500 and sha256(block_content) != block['hash'] and i != 17972:
+        for l in permutations(hex_txs):
+            _hex_txs = list(l)
+            block['merkle_tree'] = get_transactions_merkle_tree_ordered(_hex_txs)
+            block_content = block_to_bytes(last_block_hash, block)
+            if sha256(block_content) == block['hash']:
+                break
+    elif 131309 < i < 150000 and sha256(block_content) != block['hash']:
+        for diff in range(0, 100):
+            block['difficulty'] = diff / 10
+            block_content = block_to_bytes(last_block_hash, block)
+            if sha256(block_content) == block['hash']:
+                break
+    return block_content.hex() if isinstance(block_content, bytes) else block_content
+
+
+async def get_stored_block_content(block_info: dict) -> str:
+    """
+    Returns the content of a block read with Database.get_blocks, rebuilding it in memory when it is not stored.
+    """
+    block = block_info['block']
+    if block.get('content'):
+        return block['content']
+    transactions = [await Transaction.from_hex(tx, False) for tx in block_info['transactions']]
+    hex_txs = [tx.hex() for tx in transactions if isinstance(tx, Transaction)]
+    return get_block_content(dict(block), hex_txs, get_previous_block_hash(block['id']))
+
+
+def get_previous_block_hash(block_id: int) -> str:
+    return Database.instance.header_index.get_hash(block_id - 1) if block_id > 1 else GENESIS_PREVIOUS_HASH
+
+
 def split_block_content(block_content: str):
     _bytes = bytes.fromhex(block_content)
     stream = BytesIO(_bytes)
@@ -279,20 +339,30 @@ async def check_block(block_content: str, transactions: List[Transaction], minin
 
     if transactions:
         check_inputs = sum([[(tx_input.tx_hash, tx_input.index) for tx_input in transaction.inputs] for transaction in transactions], [])
-        unspent_outputs = await database.get_unspent_outputs(check_inputs)
+        # address and amount of the spent outputs are read from the unspent outputs table, without the parent transactions
+        unspent_outputs = await database.get_unspent_outputs_info(check_inputs)
         if len(set(check_inputs)) != len(check_inputs) or set(check_inputs) - set(unspent_outputs) != set():
             print('double spend in block')
             spent_outputs = set(check_inputs) - set(unspent_outputs)
             print(len(spent_outputs))
             return False
-        input_txs_hash = sum([[tx_input.tx_hash for tx_input in transaction.inputs] for transaction in transactions], [])
-        input_txs = await database.get_transactions_info(input_txs_hash)
-        # move after pp('after get_transactions', time.time() - t)
         for transaction in transactions:
-            await transaction._fill_transaction_inputs(input_txs)
+            await transaction._fill_transaction_inputs(unspent_outputs)
 
     for transaction in transactions:
-        if not await transaction.verify(check_double_spend=False):
+        if not await transaction.verify(check_double_spend=False, check_signatures=False):
+            print(f'transaction {transaction.hash()} has been not verified')
+            return False
+
+    # signatures of the whole block are verified at once, by the process pool of SignatureVerifier if enabled.
+    # signatures already verified when the transaction has been accepted in the mempool are not checked again
+    signatures = [await transaction._get_signatures(skip_cached=True) for transaction in transactions]
+    if None in signatures:
+        print('transaction signatures cannot be verified')
+        return False
+    results = await SignatureVerifier.verify_transactions([(transaction.hex(False), signatures[n]) for n, transaction in enumerate(transactions)])
+    for n, transaction in enumerate(transactions):
+        if not all(results[n]):
             print(f'transaction {transaction.hash()} has been not verified')
             return False
 
@@ -322,7 +392,7 @@ async def create_block(block_content: str, transactions: List[Transaction], last
 
     database: Database = Database.instance
     block_no = last_block['id'] + 1 if last_block != {} else 1
-    block_hash = sha256(block_content) if block_no != 17972 else '37cb1a0522c039330775e07d824c94e0422dbfb2dba6dcd421f4dc9f11601672'
+    block_hash = get_block_hash(block_content, block_no)
     previous_hash, address, merkle_tree, content_time, content_difficulty, random = split_block_content(block_content)
     if block_hash == 'a53268dd22d173dd0c9c10d7f6a64f46071c669052186a7855e9cc65e9a46939':  # block 143361 has a double spend
         for transaction in transactions:
@@ -337,25 +407,47 @@ async def create_block(block_content: str, transactions: List[Transaction], last
         if not coinbase_transaction.outputs[0].verify():
             return False
 
-    await database.add_block(block_no, block_hash, block_content, address, random, difficulty, block_reward + fees, content_time)
-    await database.add_transaction(coinbase_transaction, block_hash)
-
     try:
-        await database.add_transactions(transactions, block_hash)
-        if len(transactions) > 1 and block_no < 22500:
-            OLD_BLOCKS_TRANSACTIONS_ORDER.set(block_hash, [transaction.hex() for transaction in transactions])
+        await database.connect_block(block_no, block_hash, block_content, address, random, difficulty, block_reward + fees, content_time, coinbase_transaction, transactions)
     except Exception as e:
-        print(f'a transaction has not been added in block', e)
-        await database.delete_block(block_no)
+        print(f'block {block_no} has not been added', e)
         return False
-    await database.add_unspent_transactions_outputs(transactions + [coinbase_transaction])
+    if len(transactions) > 1 and block_no < 22500:
+        OLD_BLOCKS_TRANSACTIONS_ORDER.set(block_hash, [transaction.hex() for transaction in transactions])
     if transactions:
-        await database.remove_pending_transactions_by_hash([transaction.hash() for transaction in transactions])
-        await database.remove_unspent_outputs(transactions)
-        await database.remove_pending_spent_outputs(transactions)
-
         _print(f'Added {len(transactions)} transactions in block {block_no}. Reward: {block_reward}, Fees: {fees}')
-    Manager.difficulty = None
+    # resets the cached difficulty and notifies the chain listeners, like the block template
+    database._chain_changed()
+    return True
+
+
+async def reconnect_block(block_info: dict) -> bool:
+    """
+    Adds back a block which has been already validated and removed, like the blocks of the previous chain when
+    switching to another one fails. Difficulty and signatures are not checked again.
+    """
+    database: Database = Database.instance
+    block = block_info['block']
+    transactions = [await Transaction.from_hex(tx, False) for tx in block_info['transactions']]
+    coinbase_transaction = next((tx for tx in transactions if isinstance(tx, CoinbaseTransaction)), None)
+    transactions = [tx for tx in transactions if isinstance(tx, Transaction)]
+    old_order = OLD_BLOCKS_TRANSACTIONS_ORDER.get(block['hash'])
+    if old_order:
+        # like create_block, old blocks keep the order of their transactions in the content
+        old_order = {tx_hex: n for n, tx_hex in enumerate(old_order)}
+        transactions.sort(key=lambda tx: old_order.get(tx.hex(), len(old_order)))
+    if coinbase_transaction is None:
+        # the transactions of old blocks are read without the coinbase one
+        coinbase_transaction = CoinbaseTransaction(block['hash'], block['address'], block['reward'])
+    block_content = get_block_content(dict(block), [tx.hex() for tx in transactions], get_previous_block_hash(block['id']))
+    for transaction in transactions:
+        await transaction._fill_transaction_inputs()
+        await transaction.get_fees()
+    try:
+        await database.connect_block(block['id'], block['hash'], block_content, block['address'], block['random'], block['difficulty'], block['reward'], block['timestamp'], coinbase_transaction, transactions)
+    except Exception as e:
+        print(f'block {block["id"]} has not been added back', e)
+        return False
     return True
 
 
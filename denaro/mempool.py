@@ -0,0 +1,125 @@
+from bisect import bisect_left, insort
+from datetime import datetime
+from decimal import Decimal
+from statistics import mean
+from typing import Dict, List, Tuple, Iterator
+
+from .constants import MAX_BLOCK_SIZE_HEX, SMALLEST
+from .helpers import timestamp
+from .transactions import Transaction
+
+
+class MempoolEntry:
+    __slots__ = ('tx', 'tx_hash', 'tx_hex', 'size', 'fees', 'inputs_addresses', 'time_received', 'propagation_time', 'sort_key')
+
+    def __init__(self, tx: Transaction, tx_hex: str, fees: Decimal, inputs_addresses: List[str], time_received: datetime = None, propagation_time: int = None):
+        self.tx = tx
+        self.tx_hash = tx.hash()
+        self.tx_hex = tx_hex
+        self.size = len(tx_hex)
+        self.fees = Decimal(fees)
+        self.inputs_addresses = inputs_addresses
+        self.time_received = time_received
+        self.propagation_time = propagation_time if propagation_time is not None else timestamp()
+        # same order as "ORDER BY fees / LENGTH(tx_hex) DESC, LENGTH(tx_hex), tx_hex"
+        self.sort_key = (-self.fees / self.size, self.size, tx_hex)
+
+    @property
+    def outpoints(self) -> List[Tuple[str, int]]:
+        return [(tx_input.tx_hash, tx_input.index) for tx_input in self.tx.inputs]
+
+
+class Mempool:
+    """
+    Pending transactions held in memory by the node, pending_transactions table is only used as durable storage.
+    Transactions are kept parsed, sorted by fee rate, and indexed by the outputs they spend.
+    Listeners (like BlockTemplate) are notified with transaction_added, transaction_removed and transactions_cleared.
+    """
+
+    def __init__(self):
+        self.transactions: Dict[str, MempoolEntry] = {}
+        self.spent_outputs: Dict[Tuple[str, int], str] = {}
+        self.size = 0
+        self.listeners: list = []
+        self._index: List[tuple] = []
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __contains__(self, tx_hash: str):
+        return tx_hash in self.transactions
+
+    def get(self, tx_hash: str) -> MempoolEntry:
+        return self.transactions.get(tx_hash)
+
+    def add(self, entry: MempoolEntry):
+        if entry.tx_hash in self.transactions:
+            return
+        self.transactions[entry.tx_hash] = entry
+        insort(self._index, (entry.sort_key, entry.tx_hash))
+        for outpoint in entry.outpoints:
+            self.spent_outputs[outpoint] = entry.tx_hash
+        self.size += entry.size
+        for listener in self.listeners:
+            listener.transaction_added(entry)
+
+    def remove(self, tx_hash: str) -> MempoolEntry:
+        entry = self.transactions.pop(tx_hash, None)
+        if entry is None:
+            return None
+        del self._index[bisect_left(self._index, (entry.sort_key, entry.tx_hash))]
+        for outpoint in entry.outpoints:
+            if self.spent_outputs.get(outpoint) == tx_hash:
+                del self.spent_outputs[outpoint]
+        self.size -= entry.size
+        for listener in self.listeners:
+            listener.transaction_removed(entry)
+        return entry
+
+    def remove_many(self, tx_hashes: List[str]):
+        for tx_hash in tx_hashes:
+            self.remove(tx_hash)
+
+    def clear(self):
+        self.transactions.clear()
+        self.spent_outputs.clear()
+        self._index.clear()
+        self.size = 0
+        for listener in self.listeners:
+            listener.transactions_cleared()
+
+    def sorted(self) -> Iterator[MempoolEntry]:
+        for _, tx_hash in self._index:
+            yield self.transactions[tx_hash]
+
+    def get_limit(self, limit: int = MAX_BLOCK_SIZE_HEX) -> List[MempoolEntry]:
+        entries = []
+        size = 0
+        for entry in self.sorted():
+            if size + entry.size > limit:
+                break
+            entries.append(entry)
+            size += entry.size
+        return entries
+
+    def get_need_propagate(self, last_propagation_delta: int = 600, limit: int = MAX_BLOCK_SIZE_HEX) -> List[MempoolEntry]:
+        now = timestamp()
+        return [entry for entry in self.get_limit(limit) if now - entry.propagation_time > last_propagation_delta]
+
+    def set_propagation_time(self, tx_hashes: List[str]):
+        now = timestamp()
+        for tx_hash in tx_hashes:
+            if tx_hash in self.transactions:
+                self.transactions[tx_hash].propagation_time = now
+
+    def get_average_fee(self, limit: int = MAX_BLOCK_SIZE_HEX) -> Decimal:
+        return int(mean(entry.fees for entry in self.get_limit(limit)) * SMALLEST) // Decimal(SMALLEST)
+
+    def get_blocks_count(self) -> int:
+        return int(self.size / MAX_BLOCK_SIZE_HEX + 1)
+
+    def get_spent_outputs(self, outputs: List[Tuple[str, int]]) -> List[Tuple[str, int]]:
+        return [output for output in outputs if output in self.spent_outputs]
+
+    def get_spending_transactions(self, outputs: List[Tuple[str, int]]) -> List[str]:
+        return list(dict.fromkeys(self.spent_outputs[output] for output in outputs if output in self.spent_outputs))
@@ -0,0 +1,155 @@
+import asyncio
+import time
+from collections import deque
+from typing import List, Deque, Tuple, Dict
+
+from icecream import ic
+
+from .header_sync import HeaderChainChecker
+from .nodes_manager import NodeInterface, NodeThrottledError
+
+print = ic
+
+SYNC_CHUNK_SIZE = 1000  # /get_blocks does not accept more than 1000 blocks per request
+SYNC_MAX_IN_FLIGHT = 4
+SYNC_REQUEST_TIMEOUT = 60
+SYNC_MAX_NODE_FAILURES = 3
+# /get_blocks accepts 10 requests per minute from an address, so a node is not asked more often
+SYNC_NODE_REQUEST_INTERVAL = 6
+# how long a node which answered 429 is not asked, and how many times before it counts as failing
+SYNC_THROTTLED_DELAY = 60
+SYNC_MAX_NODE_THROTTLES = 5
+
+
+class BlockDownloader:
+    """
+    Downloads a range of blocks from several nodes at once.
+
+    The missing range is split into chunks which are requested from different nodes, keeping at most
+    max_in_flight requests running. Blocks are yielded strictly in height order, the ones of the first chunk as soon
+    as they are received, so the result can be fed to create_blocks as if it came from a single node. The rest of a
+    chunk that fails, times out or looks wrong is retried on another node, and nodes failing too often are not used
+    anymore for this download.
+    The first node is the one being synced from: only an empty chunk from it ends the download, the other
+    nodes may be behind it, so an empty chunk from them is a failure and is asked to the first node.
+    Requests to a node are spaced by SYNC_NODE_REQUEST_INTERVAL seconds to stay under its rate limit, and a node
+    answering 429 anyway is asked again after SYNC_THROTTLED_DELAY seconds.
+    When the headers of the chain have been checked, blocks whose hash does not match them are retried elsewhere.
+    """
+
+    def __init__(self, nodes: List[str], offset: int, chunk_size: int = SYNC_CHUNK_SIZE, max_in_flight: int = SYNC_MAX_IN_FLIGHT, checked_headers: HeaderChainChecker = None):
+        self.nodes: List[str] = list(dict.fromkeys(node.strip('/') for node in nodes))
+        self.primary_node = self.nodes[0]
+        self.checked_headers = checked_headers
+        self.offset = offset
+        self.chunk_size = chunk_size
+        self.max_in_flight = max(1, min(max_in_flight, len(self.nodes) * 2))
+        self.failures: Dict[str, int] = {node: 0 for node in self.nodes}
+        self.busy: Dict[str, int] = {node: 0 for node in self.nodes}
+        self.throttles: Dict[str, int] = {node: 0 for node in self.nodes}
+        self.next_request: Dict[str, float] = {node: 0 for node in self.nodes}
+        self.last_node: str = None
+        self._in_flight: Deque[Tuple[int, asyncio.Queue, asyncio.Task]] = deque()
+
+    def get_working_nodes(self) -> List[str]:
+        return [node for node in self.nodes if self.failures[node] < SYNC_MAX_NODE_FAILURES]
+
+    def _pick_node(self, exclude: List[str]) -> str:
+        nodes = [node for node in self.get_working_nodes() if node not in exclude] or self.get_working_nodes()
+        if not nodes:
+            raise Exception('No working nodes left to download blocks from')
+        # prefer the least busy node, ties are resolved by the nodes order (most recent first)
+        return min(nodes, key=lambda node: (self.busy[node], self.failures[node]))
+
+    async def _fetch(self, offset: int, limit: int, queue: asyncio.Queue):
+        """
+        Puts the blocks from offset in queue as soon as they are received, as (node url, blocks) items.
+        The blocks not received yet are asked to another node when a node fails or truncates its response.
+        """
+        received = 0
+        tried = []
+        ask_primary = False
+        while received < limit:
+            node_url = self.primary_node if ask_primary else self._pick_node(tried)
+            ask_primary = False
+            tried.append(node_url)
+            self.busy[node_url] += 1
+            node_received = 0
+            try:
+                # the request slot is taken before waiting, so that concurrent chunks wait for the next ones
+                now = time.monotonic()
+                request_time = max(now, self.next_request[node_url])
+                self.next_request[node_url] = request_time + SYNC_NODE_REQUEST_INTERVAL
+                await asyncio.sleep(request_time - now)
+                deadline = time.monotonic() + SYNC_REQUEST_TIMEOUT
+                async for blocks in NodeInterface(node_url).iter_blocks(offset + received, limit - received):
+                    if any(block['block']['id'] != offset + received + n for n, block in enumerate(blocks)):
+                        raise Exception(f'{node_url} returned unexpected blocks for offset {offset + received}')
+                    if self.checked_headers is not None and any(self.checked_headers.get_hash(block['block']['id']) not in (None, block['block']['hash']) for block in blocks):
+                        raise Exception(f'{node_url} returned blocks which do not match the checked headers')
+                    received += len(blocks)
+                    node_received += len(blocks)
+                    await queue.put((node_url, blocks))
+                    if time.monotonic() > deadline:
+                        raise Exception('request timed out')
+                if not node_received:
+                    if node_url == self.primary_node:
+                        # the primary node has no blocks after this height
+                        return
+                    ask_primary = True
+                    raise Exception(f'{node_url} has no blocks from {offset + received}')
+            except NodeThrottledError as e:
+                print(e)
+                self.next_request[node_url] = time.monotonic() + SYNC_THROTTLED_DELAY
+                self.throttles[node_url] += 1
+                if self.throttles[node_url] % SYNC_MAX_NODE_THROTTLES == 0:
+                    self.failures[node_url] += 1
+                # the node can be asked again once the delay is over
+                tried.remove(node_url)
+            except Exception as e:
+                print(f'could not download blocks {offset + received}-{offset + limit - 1} from {node_url}: {e}')
+                self.failures[node_url] += 1
+            finally:
+                self.busy[node_url] -= 1
+
+    async def _run_fetch(self, offset: int, limit: int, queue: asyncio.Queue):
+        try:
+            await self._fetch(offset, limit, queue)
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+
+    def _fill(self):
+        while len(self._in_flight) < self.max_in_flight:
+            queue = asyncio.Queue()
+            self._in_flight.append((self.chunk_size, queue, asyncio.create_task(self._run_fetch(self.offset, self.chunk_size, queue))))
+            self.offset += self.chunk_size
+
+    def cancel(self):
+        while self._in_flight:
+            self._in_flight.popleft()[2].cancel()
+
+    async def __aiter__(self):
+        try:
+            self._fill()
+            while self._in_flight:
+                limit, queue, _ = self._in_flight[0]
+                received = 0
+                # the blocks of the first chunk are yielded while they are received
+                while True:
+                    item = await queue.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    node_url, blocks = item
+                    self.last_node = node_url
+                    received += len(blocks)
+                    yield blocks
+                self._in_flight.popleft()
+                if received < limit:
+                    # the primary node has no blocks after this height, so the following chunks would be empty too
+                    break
+                self._fill()
+        finally:
+            self.cancel()
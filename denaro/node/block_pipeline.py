@@ -0,0 +1,195 @@
+import asyncio
+import time
+from typing import AsyncIterator, List, Tuple
+
+from icecream import ic
+
+from ..database import Database
+from ..signatures import SignatureVerifier
+from ..manager import create_block, get_block_content, GENESIS_PREVIOUS_HASH
+from ..transactions import Transaction, CoinbaseTransaction
+
+print = ic
+
+PIPELINE_QUEUE_SIZE = 64
+
+
+async def decode_block(block_info: dict, last_block_hash: str) -> Tuple[dict, str, List[Transaction]]:
+    """
+    Parses the transactions of a block received from another node and rebuilds its content.
+    Returns the block, its content in hex and its transactions without the coinbase one.
+    """
+    block = block_info['block']
+    txs = [await Transaction.from_hex(tx) for tx in block_info['transactions']]
+    for tx in txs:
+        if isinstance(tx, CoinbaseTransaction):
+            txs.remove(tx)
+            break
+    block_content = get_block_content(block, [tx.hex() for tx in txs], last_block_hash)
+    return block, block_content, txs
+
+
+class PipelineStage:
+    def __init__(self, name: str):
+        self.name = name
+        self.blocks = 0
+        self.busy = 0.0
+        self.waiting_input = 0.0
+        self.waiting_output = 0.0
+
+    def as_dict(self):
+        return {
+            'blocks': self.blocks,
+            'busy_seconds': round(self.busy, 3),
+            'waiting_input_seconds': round(self.waiting_input, 3),
+            'waiting_output_seconds': round(self.waiting_output, 3)
+        }
+
+
+class BlockPipeline:
+    """
+    Connects blocks received from other nodes through four stages linked by bounded queues:
+    download (network), decode (transactions parsing), validate (spent outputs lookup and signatures verification)
+    and commit (create_block).
+
+    Stages run concurrently, so decoding and validation of the next blocks happen while the current block is
+    being written to the database. Signatures of inputs spending outputs which are not committed yet are left to
+    check_block. Each stage keeps track of the time it spends working and waiting for the previous (input) or the
+    next (output) stage: the stage which is busy the most is the bottleneck.
+    """
+
+    _DONE = object()
+
+    def __init__(self, queue_size: int = PIPELINE_QUEUE_SIZE):
+        self.decode_queue = asyncio.Queue(queue_size)
+        self.validate_queue = asyncio.Queue(queue_size)
+        self.commit_queue = asyncio.Queue(queue_size)
+        self.stages = {name: PipelineStage(name) for name in ('download', 'decode', 'validate', 'commit')}
+        self.started_at: float = None
+        self.finished_at: float = None
+
+    async def _get(self, stage: PipelineStage, queue: asyncio.Queue):
+        t = time.perf_counter()
+        item = await queue.get()
+        stage.waiting_input += time.perf_counter() - t
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def _put(self, stage: PipelineStage, queue: asyncio.Queue, item):
+        t = time.perf_counter()
+        await queue.put(item)
+        stage.waiting_output += time.perf_counter() - t
+
+    async def _download(self, source: AsyncIterator[list]):
+        stage = self.stages['download']
+        try:
+            t = time.perf_counter()
+            async for blocks in source:
+                stage.busy += time.perf_counter() - t
+                for block_info in blocks:
+                    await self._put(stage, self.decode_queue, block_info)
+                    stage.blocks += 1
+                t = time.perf_counter()
+            stage.busy += time.perf_counter() - t
+            await self.decode_queue.put(self._DONE)
+        except Exception as e:
+            await self.decode_queue.put(e)
+
+    async def _decode(self, last_block_hash: str):
+        stage = self.stages['decode']
+        try:
+            while (block_info := await self._get(stage, self.decode_queue)) is not self._DONE:
+                t = time.perf_counter()
+                block, block_content, txs = await decode_block(block_info, last_block_hash)
+                last_block_hash = block['hash']
+                stage.busy += time.perf_counter() - t
+                stage.blocks += 1
+                await self._put(stage, self.validate_queue, (block, block_content, txs))
+            await self.validate_queue.put(self._DONE)
+        except Exception as e:
+            await self.validate_queue.put(e)
+
+    @staticmethod
+    async def _verify_signatures(txs: List[Transaction]):
+        # valid signatures are stored in the cache, so check_block will not verify them again while committing.
+        # invalid ones are just ignored here, check_block will verify them again and reject the block
+        signatures = [await tx._get_signatures(skip_cached=True) for tx in txs]
+        items = [(tx, tx_signatures) for tx, tx_signatures in zip(txs, signatures) if tx_signatures]
+        if not items:
+            return
+        results = await SignatureVerifier.verify_transactions([(tx.hex(False), tx_signatures) for tx, tx_signatures in items])
+        for (tx, _), result in zip(items, results):
+            if all(result):
+                SignatureVerifier.cache.add(tx.hash(), tx.inputs)
+
+    async def _validate(self):
+        stage = self.stages['validate']
+        database: Database = Database.instance
+        try:
+            while (item := await self._get(stage, self.validate_queue)) is not self._DONE:
+                t = time.perf_counter()
+                _, _, txs = item
+                # outputs created in the previous blocks of the pipeline are not committed yet, check_block will fetch them
+                inputs = [(tx_input.tx_hash, tx_input.index) for tx in txs for tx_input in tx.inputs]
+                if inputs:
+                    outputs = await database.get_unspent_outputs_info(inputs)
+                    for tx in txs:
+                        await tx._fill_transaction_inputs(outputs)
+                    await self._verify_signatures([tx for tx in txs if all(tx_input.output_info is not None for tx_input in tx.inputs)])
+                stage.busy += time.perf_counter() - t
+                stage.blocks += 1
+                await self._put(stage, self.commit_queue, item)
+            await self.commit_queue.put(self._DONE)
+        except Exception as e:
+            await self.commit_queue.put(e)
+
+    async def _commit(self, last_block: dict) -> bool:
+        stage = self.stages['commit']
+        i = last_block['id'] + 1
+        while (item := await self._get(stage, self.commit_queue)) is not self._DONE:
+            block, block_content, txs = item
+            t = time.perf_counter()
+            assert i == block['id']
+            if not await create_block(block_content, txs, last_block):
+                return False
+            stage.busy += time.perf_counter() - t
+            stage.blocks += 1
+            last_block = block
+            i += 1
+        return True
+
+    async def run(self, source: AsyncIterator[list], last_block: dict) -> bool:
+        """
+        Connects all the blocks yielded by source, which must be lists of blocks in height order starting right
+        after last_block. Returns False as soon as a block is not accepted, exceptions are raised to the caller.
+        """
+        last_block = dict(last_block)
+        last_block['id'] = last_block['id'] if last_block != {} else 0
+        last_block['hash'] = last_block['hash'] if 'hash' in last_block else GENESIS_PREVIOUS_HASH
+        self.started_at = time.perf_counter()
+        tasks = [
+            asyncio.create_task(self._download(source)),
+            asyncio.create_task(self._decode(last_block['hash'])),
+            asyncio.create_task(self._validate())
+        ]
+        try:
+            return await self._commit(last_block)
+        finally:
+            self.finished_at = time.perf_counter()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> dict:
+        if self.started_at is None:
+            return {'running': False, 'blocks': 0, 'blocks_per_second': 0, 'stages': {}}
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        committed = self.stages['commit'].blocks
+        return {
+            'running': self.finished_at is None,
+            'blocks': committed,
+            'elapsed_seconds': round(elapsed, 3),
+            'blocks_per_second': round(committed / elapsed, 3) if elapsed > 0 else 0,
+            'stages': {name: stage.as_dict() for name, stage in self.stages.items()}
+        }
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import json
+from typing import Dict, List
+
+from fastapi.encoders import jsonable_encoder
+
+from ..constants import MAX_BLOCK_SIZE_HEX
+from ..mempool import Mempool, MempoolEntry
+
+
+class BlockTemplate:
+    """
+    Selection of pending transactions for the next block, kept up to date while the mempool changes.
+
+    Transactions are picked by fee rate until MAX_BLOCK_SIZE_HEX is reached, skipping the ones which do not fit.
+    A new transaction is appended if it fits in the remaining space, otherwise the selection is rebuilt from the
+    mempool index only if it pays more than the worst selected one. The ordered hash list and the merkle root
+    are computed once per selection, and the whole /get_mining_info response once per selection and chain tip.
+
+    Miners can wait for the next change of selection or chain tip with wait_for_change.
+    """
+
+    def __init__(self, mempool: Mempool, max_size: int = MAX_BLOCK_SIZE_HEX):
+        self.mempool = mempool
+        self.max_size = max_size
+        self.selected: Dict[str, MempoolEntry] = {}
+        self.size = 0
+        self.version = 0
+        self._dirty = True
+        self._worst_key: tuple = None
+        self._sorted: List[MempoolEntry] = None
+        self._merkle_root: str = None
+        self._response_key: tuple = None
+        self._response: bytes = None
+        self._change_event = asyncio.Event()
+        mempool.listeners.append(self)
+
+    def _select(self, entry: MempoolEntry):
+        self.selected[entry.tx_hash] = entry
+        self.size += entry.size
+        if self._worst_key is None or entry.sort_key > self._worst_key:
+            self._worst_key = entry.sort_key
+
+    def _changed(self):
+        self.version += 1
+        self._sorted = None
+        self._merkle_root = None
+        self._notify()
+
+    def _notify(self):
+        # waiters keep a reference to the old event, the next ones will wait for the new one
+        self._change_event.set()
+        self._change_event = asyncio.Event()
+
+    def get_change_event(self) -> asyncio.Event:
+        return self._change_event
+
+    @staticmethod
+    async def wait_for_change(event: asyncio.Event, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def rebuild(self):
+        self.selected = {}
+        self.size = 0
+        self._worst_key = None
+        for entry in self.mempool.sorted():
+            if self.size + entry.size <= self.max_size:
+                self._select(entry)
+        self._dirty = False
+        self._changed()
+
+    def transaction_added(self, entry: MempoolEntry):
+        if self._dirty:
+            return
+        if self.size + entry.size <= self.max_size:
+            self._select(entry)
+            self._changed()
+        elif self._worst_key is not None and entry.sort_key < self._worst_key:
+            self._dirty = True
+            self._notify()
+
+    def transaction_removed(self, entry: MempoolEntry):
+        if entry.tx_hash in self.selected:
+            # space has been freed, transactions which have been skipped before may fit now
+            self._dirty = True
+            self._notify()
+
+    def transactions_cleared(self):
+        self._dirty = True
+        self._notify()
+
+    def chain_changed(self):
+        self._notify()
+
+    def get_transactions(self) -> List[MempoolEntry]:
+        if self._dirty:
+            self.rebuild()
+        if self._sorted is None:
+            # same order used by get_transactions_merkle_tree
+            self._sorted = sorted(self.selected.values(), key=lambda entry: entry.tx_hex)
+        return self._sorted
+
+    def get_merkle_root(self) -> str:
+        transactions = self.get_transactions()
+        if self._merkle_root is None:
+            # the hash of a transaction is the sha256 of its bytes, as used by get_transactions_merkle_tree
+            self._merkle_root = hashlib.sha256(b''.join(bytes.fromhex(entry.tx_hash) for entry in transactions)).hexdigest()
+        return self._merkle_root
+
+    def get_mining_info(self, difficulty, last_block: dict) -> dict:
+        transactions = self.get_transactions()
+        return {
+            'difficulty': difficulty,
+            'last_block': last_block,
+            'pending_transactions': [entry.tx_hex for entry in transactions],
+            'pending_transactions_hashes': [entry.tx_hash for entry in transactions],
+            'merkle_root': self.get_merkle_root()
+        }
+
+    def get_mining_info_response(self, difficulty, last_block: dict) -> bytes:
+        # make sure the selection is up to date before checking the cached response
+        self.get_transactions()
+        key = (self.version, last_block.get('hash'), difficulty)
+        if self._response_key != key:
+            result = {'ok': True, 'result': self.get_mining_info(difficulty, last_block)}
+            self._response = json.dumps(jsonable_encoder(result)).encode()
+            self._response_key = key
+        return self._response
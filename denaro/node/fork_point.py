@@ -0,0 +1,77 @@
+from typing import List, Union
+
+from icecream import ic
+
+from ..header_index import HeaderIndex
+from .nodes_manager import NodeInterface
+
+print = ic
+
+MAX_HASHES_PER_REQUEST = 64
+FORK_SEARCH_SIZE = 32
+
+
+def get_locator_heights(tip: int) -> List[int]:
+    """
+    Returns the heights to compare with a node, starting from the tip: the step doubles every height
+    (tip, tip - 1, tip - 3, tip - 7, ...) and the first block is always included.
+    """
+    heights = []
+    height, step = tip, 1
+    while height > 1:
+        heights.append(height)
+        height -= step
+        step *= 2
+    heights.append(1)
+    return heights
+
+
+def get_search_heights(low: int, high: int, size: int = FORK_SEARCH_SIZE) -> List[int]:
+    return sorted({low + (high - low) * n // (size + 1) for n in range(1, size + 1)} - {low, high})
+
+
+async def find_fork_point(node_interface: NodeInterface, index: HeaderIndex) -> Union[int, None]:
+    """
+    Returns the id of the last block in common with the node, or None if the node has not a block at the local tip
+    height, which means it is behind. Only block hashes are exchanged: an exponentially spaced locator bounds the fork
+    point, then a search over FORK_SEARCH_SIZE evenly spaced heights per request narrows it down.
+    """
+    tip = len(index)
+    if tip == 0:
+        return 0
+    heights = get_locator_heights(tip)
+    remote_hashes = await node_interface.get_block_hashes(heights)
+    if remote_hashes[0] is None:
+        return None
+    # low is in common with the node, high is not
+    low, high = 0, tip + 1
+    for height, remote_hash in zip(heights, remote_hashes):
+        if remote_hash == index.get_hash(height):
+            low = height
+            break
+        high = height
+    while high - low > 1:
+        heights = get_search_heights(low, high)
+        remote_hashes = await node_interface.get_block_hashes(heights)
+        for height, remote_hash in zip(heights, remote_hashes):
+            if remote_hash != index.get_hash(height):
+                high = height
+                break
+            low = height
+    return low
+
+
+async def find_fork_point_from_blocks(node_interface: NodeInterface, index: HeaderIndex, depth: int = 500) -> Union[int, None]:
+    """
+    Same as find_fork_point for nodes which do not support get_block_hashes, only the last depth blocks are compared.
+    """
+    tip = len(index)
+    remote_last_block = (await node_interface.get_block(tip))['block']
+    if remote_last_block['hash'] == index.get_hash(tip):
+        return tip
+    remote_blocks = await node_interface.get_blocks(max(tip - depth + 1, 1), depth)
+    for remote_block in reversed(remote_blocks):
+        block_id = remote_block['block']['id']
+        if remote_block['block']['hash'] == index.get_hash(block_id):
+            return block_id
+    return None
@@ -0,0 +1,86 @@
+from typing import Dict, List, Union
+
+from icecream import ic
+
+from ..header_index import HeaderIndex
+from ..helpers import timestamp
+from ..manager import BLOCKS_COUNT, check_block_is_valid, get_next_difficulty, get_block_hash, split_block_content
+from .nodes_manager import NodeInterface
+
+print = ic
+
+HEADERS_CHUNK_SIZE = 2000
+
+
+class HeaderChainChecker:
+    """
+    Checks a chain of block contents received from another node, starting after a block of the local chain:
+    every block has to follow the previous one, to have a valid timestamp and to meet the difficulty calculated like
+    calculate_difficulty does. Transactions are not involved, so a chain can be checked before downloading it.
+    The hashes of the checked blocks are kept, so that the blocks downloaded afterwards can be matched against them.
+    """
+
+    def __init__(self, index: HeaderIndex, last_block_id: int):
+        self.index = index
+        self.last_block = {
+            'id': last_block_id,
+            'hash': index.get_hash(last_block_id),
+            'timestamp': index.get_timestamp(last_block_id),
+            'difficulty': index.get_difficulty(last_block_id)
+        } if last_block_id else {'id': 0, 'timestamp': 0}
+        # timestamps of the checked blocks which are needed to adjust the difficulty
+        self.timestamps: Dict[int, int] = {}
+        self.first_block_id = self.last_block['id'] + 1
+        self.hashes = bytearray()
+
+    def _get_timestamp(self, block_id: int) -> int:
+        return self.timestamps[block_id] if block_id in self.timestamps else self.index.get_timestamp(block_id)
+
+    async def check(self, block_content: str) -> bool:
+        last_block = self.last_block
+        block_no = last_block['id'] + 1
+        previous_hash, _, _, content_time, _, _ = split_block_content(block_content)
+        if last_block['id'] and previous_hash != last_block['hash']:
+            print(f'header {block_no} does not follow the previous one')
+            return False
+        last_adjust_block_timestamp = None
+        if last_block['id'] >= BLOCKS_COUNT and last_block['id'] % BLOCKS_COUNT == 0:
+            last_adjust_block_timestamp = self._get_timestamp(int(last_block['id'] - BLOCKS_COUNT + 1))
+        difficulty = get_next_difficulty(last_block, last_adjust_block_timestamp)
+        # block 17972 is checked by check_block against its known content
+        if block_no != 17972 and not await check_block_is_valid(block_content, (difficulty, last_block)):
+            print(f'header {block_no} does not meet difficulty {difficulty}')
+            return False
+        if last_block['timestamp'] > content_time or (block_no >= 291500 and last_block['timestamp'] == content_time) or content_time > timestamp():
+            print(f'header {block_no} has an invalid timestamp')
+            return False
+        if block_no % BLOCKS_COUNT == 1:
+            self.timestamps[block_no] = content_time
+        self.last_block = {'id': block_no, 'hash': get_block_hash(block_content, block_no), 'timestamp': content_time, 'difficulty': difficulty}
+        self.hashes += bytes.fromhex(self.last_block['hash'])
+        return True
+
+    def get_hash(self, block_id: int) -> Union[str, None]:
+        """
+        Returns the hash of a checked block, None if the block has not been checked.
+        """
+        position = (block_id - self.first_block_id) * 32
+        return self.hashes[position:position + 32].hex() if 0 <= position < len(self.hashes) else None
+
+
+async def check_headers(node_interface: NodeInterface, index: HeaderIndex, last_block_id: int) -> Union[HeaderChainChecker, None]:
+    """
+    Downloads and checks the headers of the node after last_block_id, HEADERS_CHUNK_SIZE at a time.
+    Returns the checker holding the checked chain, or None if the node does not support get_headers.
+    Raises an exception at the first invalid header.
+    """
+    checker = HeaderChainChecker(index, last_block_id)
+    while True:
+        headers: List[str] = await node_interface.get_headers(checker.last_block['id'] + 1, HEADERS_CHUNK_SIZE)
+        if headers is None:
+            return None
+        for header in headers:
+            if not await checker.check(header):
+                raise Exception(f'{node_interface.url} sent an invalid header chain')
+        if len(headers) < HEADERS_CHUNK_SIZE:
+            return checker
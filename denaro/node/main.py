@@ -1,4 +1,5 @@
 import random
+import time
 from asyncio import gather
 from collections import deque
 import os
@@ -6,11 +7,12 @@ from dotenv import dotenv_values
 import re
 import json
 from decimal import Decimal
-from datetime import datetime 
+from datetime import datetime
+from typing import List, Union
 
 from asyncpg import UniqueViolationError
 from fastapi import FastAPI, Body, Query
-from fastapi.responses import RedirectResponse, Response
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
 
 from httpx import TimeoutException
 from icecream import ic
@@ -23,11 +25,22 @@ from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
-from denaro.helpers import timestamp, sha256, transaction_to_json
-from denaro.manager import create_block, get_difficulty, Manager, get_transactions_merkle_tree, \
-    split_block_content, calculate_difficulty, clear_pending_transactions, block_to_bytes, get_transactions_merkle_tree_ordered
+from denaro.helpers import timestamp, sha256, transaction_to_json, string_to_point
+from denaro.manager import create_block, reconnect_block, get_difficulty, Manager, get_transactions_merkle_tree, \
+    split_block_content, calculate_difficulty, clear_pending_transactions, block_to_bytes, get_transactions_merkle_tree_ordered, get_stored_block_content, \
+    check_block_is_valid
 from denaro.node.nodes_manager import NodesManager, NodeInterface
+from denaro.node.fork_point import find_fork_point, find_fork_point_from_blocks, MAX_HASHES_PER_REQUEST
+from denaro.node.header_sync import check_headers, HEADERS_CHUNK_SIZE
+from denaro.node.block_downloader import BlockDownloader
+from denaro.node.block_pipeline import BlockPipeline, decode_block, GENESIS_PREVIOUS_HASH
+from denaro.node.block_template import BlockTemplate
+from denaro.node.mining_pool import MiningPool, NONCE_LIMIT
+from denaro.node.orphan_pool import OrphanPool, OrphanBlock, ORPHAN_MAX_PARENTS
+from denaro.node.sync_coordinator import SyncCoordinator
 from denaro.node.utils import ip_is_local
+from denaro.node.wire import BINARY_MEDIA_TYPE, NDJSON_MEDIA_TYPE, WIRE_FORMATS_HEADER, WIRE_FORMATS, encode_blocks, decode_push_block
+from denaro.signatures import SignatureVerifier
 from denaro.transactions import Transaction, CoinbaseTransaction
 from denaro import Database
 from denaro.constants import VERSION, ENDIAN
@@ -40,7 +53,10 @@ app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 db: Database = None
 NodesManager.init()
 started = False
-is_syncing = False
+sync_pipeline: BlockPipeline = None
+block_template: BlockTemplate = None
+mining_pool: MiningPool = None
+orphan_pool = OrphanPool()
 self_url = None
 
 print = ic
@@ -53,6 +69,11 @@ app.add_middleware(
 )
 
 config = dotenv_values(".env")
+# how many nodes blocks are downloaded from at the same time while syncing
+SYNC_NODES = int(config.get('DENARO_SYNC_NODES') or 4)
+# keep unspent outputs in memory while syncing, see Database.enable_utxo_cache
+UTXO_CACHE = config.get('DENARO_UTXO_CACHE') in ('1', 'true', 'True')
+HEADERS_FIRST = config.get('DENARO_HEADERS_FIRST', '1') in ('1', 'true', 'True')
 
 async def propagate(path: str, args: dict, ignore_url=None, nodes: list = None):
     global self_url
@@ -71,37 +92,12 @@ async def propagate(path: str, args: dict, ignore_url=None, nodes: list = None):
 async def create_blocks(blocks: list):
     _, last_block = await calculate_difficulty()
     last_block['id'] = last_block['id'] if last_block != {} else 0
-    last_block['hash'] = last_block['hash'] if 'hash' in last_block else (30_06_2005).to_bytes(32, ENDIAN).hex()
+    last_block['hash'] = last_block['hash'] if 'hash' in last_block else GENESIS_PREVIOUS_HASH
     i = last_block['id'] + 1
     for block_info in blocks:
-        block = block_info['block']
-        txs_hex = block_info['transactions']
-        txs = [await Transaction.from_hex(tx) for tx in txs_hex]
-        #txs = [await Transaction.from_hex(tx, set_timestamp=True) for tx in txs_hex]
-        for tx in txs:
-            if isinstance(tx, CoinbaseTransaction):
-                txs.remove(tx)
-                break
-        hex_txs = [tx.hex() for tx in txs]
-        block['merkle_tree'] = get_transactions_merkle_tree(hex_txs) if i > 22500 else get_transactions_merkle_tree_ordered(hex_txs)
-        block_content = block.get('content') or block_to_bytes(last_block['hash'], block)
-
-        if i <= 22500 and sha256(block_content) != block['hash'] and i != 17972:
-            from itertools import permutations
-            for l in permutations(hex_txs):
-                _hex_txs = list(l)
-                block['merkle_tree'] = get_transactions_merkle_tree_ordered(_hex_txs)
-                block_content = block_to_bytes(last_block['hash'], block)
-                if sha256(block_content) == block['hash']:
-                    break
-        elif 131309 < i < 150000 and sha256(block_content) != block['hash']:
-            for diff in range(0, 100):
-                block['difficulty'] = diff / 10
-                block_content = block_to_bytes(last_block['hash'], block)
-                if sha256(block_content) == block['hash']:
-                    break
+        block, block_content, txs = await decode_block(block_info, last_block['hash'])
         assert i == block['id']
-        if not await create_block(block_content.hex() if isinstance(block_content, bytes) else block_content, txs, last_block):
+        if not await create_block(block_content, txs, last_block):
             return False
         last_block = block
         i += 1
@@ -109,6 +105,7 @@ async def create_blocks(blocks: list):
 
 
 async def _sync_blockchain(node_url: str = None):
+    global sync_pipeline
     print('sync blockchain')
     if not node_url:
         nodes = NodesManager.get_recent_nodes()
@@ -120,76 +117,188 @@ async def _sync_blockchain(node_url: str = None):
     starting_from = i = await db.get_next_block_id()
     node_interface = NodeInterface(node_url)
     local_cache = None
-    if last_block != {} and last_block['id'] > 500:
-        remote_last_block = (await node_interface.get_block(i-1))['block']
-        if remote_last_block['hash'] != last_block['hash']:
-            print(remote_last_block['hash'])
-            offset, limit = i - 500, 500
-            remote_blocks = await node_interface.get_blocks(offset, limit)
-            local_blocks = await db.get_blocks(offset, limit)
-            local_blocks = local_blocks[:len(remote_blocks)]
-            local_blocks.reverse()
-            remote_blocks.reverse()
-            print(len(remote_blocks), len(local_blocks))
-            for n, local_block in enumerate(local_blocks):
-                if local_block['block']['hash'] == remote_blocks[n]['block']['hash']:
-                    print(local_block, remote_blocks[n])
-                    last_common_block = local_block['block']['id']
-                    local_cache = local_blocks[:n]
-                    local_cache.reverse()
-                    await db.remove_blocks(last_common_block + 1)
-                    break
-
-    #return
-    limit = 1000
-    while True:
-        i = await db.get_next_block_id()
+    last_common_block = 0
+    checked_headers = None
+    if last_block != {}:
         try:
-            blocks = await node_interface.get_blocks(i, limit)
+            last_common_block = await find_fork_point(node_interface, db.header_index)
         except Exception as e:
             print(e)
-            #NodesManager.get_nodes().remove(node_url)
-            NodesManager.sync()
-            break
+            last_common_block = await find_fork_point_from_blocks(node_interface, db.header_index)
+    if HEADERS_FIRST and last_common_block is not None:
+        # the chain of the node is checked before removing or downloading any block
         try:
-            _, last_block = await calculate_difficulty()
-            if not blocks:
-                print('syncing complete')
-                if last_block['id'] > starting_from:
-                    NodesManager.update_last_message(node_url)
-                    if timestamp() - last_block['timestamp'] < 86400:
-                        # if last block is from less than a day ago, propagate it
-                        txs_hashes = await db.get_block_transaction_hashes(last_block['hash'])
-                        await propagate('push_block', {'block_content': last_block['content'], 'txs': txs_hashes, 'block_no': last_block['id']}, node_url)
-                break
-            assert await create_blocks(blocks)
+            checked_headers = await check_headers(node_interface, db.header_index, last_common_block)
         except Exception as e:
             print(e)
-            if local_cache is not None:
-                print('sync failed, reverting back to previous chain')
-                await db.delete_blocks(last_common_block)
-                await create_blocks(local_cache)
+            NodesManager.sync()
             return
+        if checked_headers is not None and checked_headers.last_block['id'] <= last_block.get('id', 0):
+            print(f'{node_url} has not a longer chain')
+            return
+    if last_block != {}:
+        if last_common_block is not None and last_common_block < last_block['id']:
+            print(f'chain forked after block {last_common_block}')
+            # keep the removed blocks, they are added back if syncing fails
+            local_cache = []
+            while len(local_cache) < last_block['id'] - last_common_block:
+                blocks = await db.get_blocks(last_common_block + len(local_cache) + 1, 500)
+                if not blocks:
+                    break
+                local_cache.extend(blocks)
+            await db.remove_blocks(last_common_block + 1)
+
+    #return
+    # the selected node goes first, other recent nodes help downloading the missing range
+    sync_nodes = [node_url] + [node for node in NodesManager.get_recent_nodes() if node.strip('/') != node_url][:SYNC_NODES - 1]
+    downloader = BlockDownloader(sync_nodes, await db.get_next_block_id(), checked_headers=checked_headers)
+    sync_pipeline = BlockPipeline()
+    if UTXO_CACHE:
+        # unspent outputs are kept in memory and written every few blocks, they are flushed when syncing ends
+        await db.enable_utxo_cache()
+    try:
+        _, last_block = await calculate_difficulty()
+        assert await sync_pipeline.run(downloader, last_block)
+    except Exception as e:
+        print(e)
+        NodesManager.sync()
+        if local_cache is not None:
+            print('sync failed, reverting back to previous chain')
+            await db.remove_blocks(last_common_block + 1)
+            for block_info in local_cache:
+                if not await reconnect_block(block_info):
+                    break
+        return
+    finally:
+        await db.disable_utxo_cache()
+    print('syncing complete')
+    _, last_block = await calculate_difficulty()
+    if last_block != {} and last_block['id'] > starting_from:
+        NodesManager.update_last_message(downloader.last_node or node_url)
+        if timestamp() - last_block['timestamp'] < 86400:
+            # if last block is from less than a day ago, propagate it
+            txs_hashes = await db.get_block_transaction_hashes(last_block['hash'])
+            await propagate('push_block', {'block_content': last_block['content'], 'txs': txs_hashes, 'block_no': last_block['id']}, node_url)
+
+
+sync_coordinator = SyncCoordinator(_sync_blockchain)
 
 
 async def sync_blockchain(node_url: str = None):
+    await sync_coordinator.sync(node_url)
+
+
+async def get_pushed_block_transactions(txs: list) -> Union[List[Transaction], None]:
+    """
+    Parses the transactions of a received block, the ones sent as hashes are taken from pending transactions.
+    Returns None if some of them are not pending.
+    """
+    final_transactions = []
+    hashes = []
+    for tx_hex in txs:
+        if len(tx_hex) == 64:  # it's an hash
+            hashes.append(tx_hex)
+        else:
+            final_transactions.append(await Transaction.from_hex(tx_hex))
+    if hashes:
+        pending_transactions = await db.get_pending_transactions_by_hash(hashes)
+        if len(pending_transactions) < len(hashes):  # one or more tx not found
+            return None
+        final_transactions.extend(pending_transactions)
+    return final_transactions
+
+
+async def request_block(node_interface: NodeInterface, block_hash: str) -> OrphanBlock:
+    block_info = await node_interface.get_block(block_hash)
+    block = block_info['block']
+    assert block.get('content'), 'block content not available'
+    # the coinbase transaction contains the block hash
+    txs = [tx for tx in block_info['transactions'] if block['hash'] not in tx]
+    return OrphanBlock(block['content'], txs, node_interface.url)
+
+
+async def connect_orphans(block_hash: str):
+    """
+    Adds the orphan blocks which were waiting for block_hash, and the ones waiting for them.
+    """
+    parents = [block_hash]
+    while parents:
+        for orphan in orphan_pool.pop_children(parents.pop()):
+            transactions = await get_pushed_block_transactions(orphan.txs)
+            if transactions is None:
+                continue
+            accepted, first = await sync_coordinator.add_block(orphan.block_hash, lambda: create_block(orphan.block_content, transactions))
+            if not accepted or not first:
+                continue
+            parents.append(orphan.block_hash)
+            await propagate('push_block', {
+                'block_content': orphan.block_content,
+                'txs': [tx.hex() for tx in transactions] if len(transactions) < 10 else orphan.txs,
+                'block_no': await db.get_block_id(orphan.block_hash)
+            }, orphan.sender_node)
+
+
+async def fetch_orphan_parents(block_hash: str, node_url: str):
+    """
+    Requests the missing ancestors of an orphan block to node_url one by one, and connects them once the first one
+    follows a known block. Falls back to a full sync for deeper gaps or if the blocks are on another chain.
+    """
+    node_interface = NodeInterface(node_url)
     try:
-        await _sync_blockchain(node_url)
+        for _ in range(ORPHAN_MAX_PARENTS):
+            missing_hash = orphan_pool.get_missing_parent(block_hash)
+            if missing_hash is None:
+                # already connected, or expired
+                return
+            if await db.get_block_id(missing_hash) is not None:
+                await connect_orphans(missing_hash)
+                if await db.get_block_id(block_hash) is not None:
+                    return
+                break
+            if not orphan_pool.add(await request_block(node_interface, missing_hash)):
+                break
+    except Exception as e:
+        print(e)
+    await sync_blockchain(node_url)
+
+
+async def fetch_block(block_hash: str, node_url: str):
+    """
+    Requests a block with all its transactions to node_url, used when some of them are not pending here.
+    """
+    try:
+        orphan = await request_block(NodeInterface(node_url), block_hash)
     except Exception as e:
         print(e)
         return
+    if orphan_pool.add(orphan):
+        await connect_orphans(orphan.previous_hash)
 
 
 @app.on_event("startup")
 async def startup():
-    global db
+    global db, block_template, mining_pool
     global config
     db = await Database.create(
         user=config['DENARO_DATABASE_USER'] if 'DENARO_DATABASE_USER' in config else "denaro" ,
         password=config['DENARO_DATABASE_PASSWORD'] if 'DENARO_DATABASE_PASSWORD' in config else 'denaro',
         database=config['DENARO_DATABASE_NAME'] if 'DENARO_DATABASE_NAME' in config else "denaro",
-        host=config['DENARO_DATABASE_HOST'] if 'DENARO_DATABASE_HOST' in config else None
+        host=config['DENARO_DATABASE_HOST'] if 'DENARO_DATABASE_HOST' in config else None,
+        # blocks per partition of the transactions tables, partitioning cannot be undone
+        partition_blocks=int(config['DENARO_PARTITION_BLOCKS']) if config.get('DENARO_PARTITION_BLOCKS') else None
     )
+    block_template = BlockTemplate(db.mempool)
+    db.chain_listeners.append(block_template)
+    if config.get('DENARO_POOL_MODE') in ('1', 'true', 'True'):
+        # without DENARO_POOL_ADDRESS every miner mines blocks paying its own address
+        mining_pool = MiningPool(block_template, sync_coordinator, config.get('DENARO_POOL_ADDRESS') or None)
+    # 0 disables the process pool, signatures are then verified in the event loop
+    SignatureVerifier.init(int(config['DENARO_VERIFY_WORKERS']) if config.get('DENARO_VERIFY_WORKERS') else None)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    SignatureVerifier.shutdown()
 
 
 @app.get("/")
@@ -255,6 +364,7 @@ async def middleware(request: Request, call_next):
     try:
         response = await call_next(request)
         response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers[WIRE_FORMATS_HEADER] = WIRE_FORMATS
         if propagate_txs:
             response.background = BackgroundTask(propagate_old_transactions, propagate_txs)
         return response
@@ -276,7 +386,9 @@ transactions_cache = deque(maxlen=100)
 @app.get("/push_tx")
 @app.post("/push_tx")
 async def push_tx(request: Request, background_tasks: BackgroundTasks, tx_hex: str = None, body=Body(False)):
-    if body and tx_hex is None:
+    if request.headers.get('content-type') == BINARY_MEDIA_TYPE:
+        tx_hex = (await request.body()).hex()
+    elif body and tx_hex is None:
         tx_hex = body['tx_hex']
     tx = await Transaction.from_hex(tx_hex)
     if tx.hash() in transactions_cache:
@@ -297,9 +409,11 @@ async def push_tx(request: Request, background_tasks: BackgroundTasks, tx_hex: s
 @app.post("/push_block")
 @app.get("/push_block")
 async def push_block(request: Request, background_tasks: BackgroundTasks, block_content: str = '', txs='', block_no: int = None, body=Body(False)):
-    if is_syncing:
+    if sync_coordinator.is_syncing:
         return {'ok': False, 'error': 'Node is already syncing'}
-    if body:
+    if request.headers.get('content-type') == BINARY_MEDIA_TYPE:
+        block_content, txs, block_no = decode_push_block(await request.body())
+    elif body:
         txs = body['txs']
         if 'block_content' in body:
             block_content = body['block_content']
@@ -311,42 +425,50 @@ async def push_block(request: Request, background_tasks: BackgroundTasks, block_
         txs = txs.split(',')
         if txs == ['']:
             txs = []
+    sender_node = request.headers.get('Sender-Node')
     previous_hash = split_block_content(block_content)[0]
     next_block_id = await db.get_next_block_id()
+    previous_block_id = await db.get_block_id(previous_hash)
+    if previous_block_id is None and (block_no is None or block_no >= next_block_id):
+        # the parent is unknown, but the hash must still meet the current difficulty to be kept
+        difficulty, _ = await get_difficulty()
+        if not await check_block_is_valid(block_content, (difficulty, {'hash': previous_hash})):
+            return {'ok': False, 'error': 'Previous hash not found, block hash does not meet the difficulty'}
+        # the block is kept until its parent arrives
+        orphan = OrphanBlock(block_content, txs, sender_node)
+        orphan_pool.add(orphan)
+        if sender_node and not orphan_pool.allow_request(sender_node):
+            return {'ok': False, 'error': 'Previous hash not found, missing blocks have already been requested to sender node'}
+        if sender_node:
+            background_tasks.add_task(fetch_orphan_parents, orphan.block_hash, sender_node)
+            return {'ok': False,
+                    'error': 'Previous hash not found, missing blocks have been requested to sender node, block may have been accepted'}
+        else:
+            return {'ok': False, 'error': 'Previous hash not found'}
     if block_no is None:
-        previous_block = await db.get_block(previous_hash)
-        if previous_block is None:
-            if 'Sender-Node' in request.headers:
-                background_tasks.add_task(sync_blockchain, request.headers['Sender-Node'])
-                return {'ok': False,
-                        'error': 'Previous hash not found, had to sync according to sender node, block may have been accepted'}
-            else:
-                return {'ok': False, 'error': 'Previous hash not found'}
-        block_no = previous_block['id'] + 1
+        block_no = previous_block_id + 1
     if next_block_id < block_no:
-        background_tasks.add_task(sync_blockchain, request.headers['Sender-Node'] if 'Sender-Node' in request.headers else None)
+        if not orphan_pool.allow_request(sender_node or ''):
+            return {'ok': False, 'error': 'Blocks missing, already syncing according to sender node'}
+        background_tasks.add_task(sync_blockchain, sender_node)
         return {'ok': False, 'error': 'Blocks missing, had to sync according to sender node, block may have been accepted'}
     if next_block_id > block_no:
         return {'ok': False, 'error': 'Too old block'}
-    final_transactions = []
-    hashes = []
-    for tx_hex in txs:
-        if len(tx_hex) == 64:  # it's an hash
-            hashes.append(tx_hex)
+    final_transactions = await get_pushed_block_transactions(txs)
+    if final_transactions is None:
+        if sender_node:
+            background_tasks.add_task(fetch_block, sha256(block_content), sender_node)
+            return {'ok': False,
+                    'error': 'Transaction hash not found, block has been requested to sender node, block may have been accepted'}
         else:
-            final_transactions.append(await Transaction.from_hex(tx_hex))
-    if hashes:
-        pending_transactions = await db.get_pending_transactions_by_hash(hashes)
-        if len(pending_transactions) < len(hashes):  # one or more tx not found
-            if 'Sender-Node' in request.headers:
-                background_tasks.add_task(sync_blockchain, request.headers['Sender-Node'])
-                return {'ok': False,
-                        'error': 'Transaction hash not found, had to sync according to sender node, block may have been accepted'}
-            else:
-                return {'ok': False, 'error': 'Transaction hash not found'}
-        final_transactions.extend(pending_transactions)
-    if not await create_block(block_content, final_transactions):
+            return {'ok': False, 'error': 'Transaction hash not found'}
+    # copies of the block received while it is being added wait for the first result
+    accepted, first = await sync_coordinator.add_block(sha256(block_content), lambda: create_block(block_content, final_transactions))
+    if not accepted:
         return {'ok': False}
+    if not first:
+        return {'ok': True}
+    background_tasks.add_task(connect_orphans, sha256(block_content))
 
     if 'Sender-Node' in request.headers:
         NodesManager.update_last_message(request.headers['Sender-Node'])
@@ -362,53 +484,108 @@ async def push_block(request: Request, background_tasks: BackgroundTasks, block_
 @app.get("/sync_blockchain")
 @limiter.limit("10/minute")
 async def sync(request: Request, node_url: str = None):
-    global is_syncing
-    if is_syncing:
-        return {'ok': False, 'error': 'Node is already syncing'}
-    is_syncing = True
+    # joins the running sync, if any
     await sync_blockchain(node_url)
-    is_syncing = False
+
+
+@app.get("/get_sync_status")
+async def get_sync_status(pretty: bool = False):
+    result = {'ok': True, 'result': {
+        'is_syncing': sync_coordinator.is_syncing,
+        'pipeline': sync_pipeline.get_stats() if sync_pipeline is not None else None
+    }}
+    return Response(content=json.dumps(result, indent=4, cls=CustomJSONEncoder), media_type="application/json") if pretty else result
 
 
 LAST_PENDING_TRANSACTIONS_CLEAN = [0]
 
 
 @app.get("/get_mining_info")
-async def get_mining_info(background_tasks: BackgroundTasks, pretty: bool = False):
-    Manager.difficulty = None
-    difficulty, last_block = await get_difficulty()
-    pending_transactions = await db.get_pending_transactions_limit(hex_only=True)
-    pending_transactions = sorted(pending_transactions)
+async def get_mining_info(background_tasks: BackgroundTasks, pretty: bool = False, last_block_hash: str = None, merkle_root: str = None, timeout: int = Query(default=60, ge=0, le=300)):
+    # when last_block_hash is passed, the request is held until the chain tip changes (long polling),
+    # or until the transactions selection changes too if merkle_root is passed, up to timeout seconds
+    deadline = time.time() + timeout
+    while True:
+        change_event = block_template.get_change_event()
+        # Manager.difficulty is reset every time the chain changes
+        difficulty, last_block = await get_difficulty()
+        if last_block_hash is None or last_block.get('hash') != last_block_hash:
+            break
+        if merkle_root is not None and block_template.get_merkle_root() != merkle_root:
+            break
+        if time.time() >= deadline or not await block_template.wait_for_change(change_event, deadline - time.time()):
+            break
     if LAST_PENDING_TRANSACTIONS_CLEAN[0] < timestamp() - 600:
         print(LAST_PENDING_TRANSACTIONS_CLEAN[0])
         LAST_PENDING_TRANSACTIONS_CLEAN[0] = timestamp()
-        background_tasks.add_task(clear_pending_transactions, pending_transactions)
-    result = {'ok': True, 'result': {
-        'difficulty': difficulty,
-        'last_block': last_block,
-        'pending_transactions': pending_transactions[:10],
-        'pending_transactions_hashes': [sha256(tx) for tx in pending_transactions],
-        'merkle_root': get_transactions_merkle_tree(pending_transactions[:10])
-    }}
+        background_tasks.add_task(clear_pending_transactions, await db.get_pending_transactions_limit(hex_only=True))
+    if pretty:
+        result = {'ok': True, 'result': block_template.get_mining_info(difficulty, last_block)}
+        return Response(content=json.dumps(result, indent=4, cls=CustomJSONEncoder), media_type="application/json")
+    return Response(content=block_template.get_mining_info_response(difficulty, last_block), media_type="application/json")
+
+
+@app.get("/pool/get_work")
+async def pool_get_work(address: str):
+    if mining_pool is None:
+        return {'ok': False, 'error': 'Pool mode is disabled'}
+    try:
+        string_to_point(address)
+    except Exception:
+        return {'ok': False, 'error': 'Invalid address'}
+    return {'ok': True, 'result': await mining_pool.get_work(address)}
+
+
+@app.post("/pool/submit_share")
+@app.get("/pool/submit_share")
+async def pool_submit_share(background_tasks: BackgroundTasks, job_id: str = None, nonce: int = None, address: str = None, body=Body(False)):
+    if mining_pool is None:
+        return {'ok': False, 'error': 'Pool mode is disabled'}
+    if isinstance(body, dict):
+        job_id, nonce, address = body.get('job_id'), body.get('nonce'), body.get('address')
+    if job_id is None or nonce is None or address is None:
+        return {'ok': False, 'error': 'job_id, nonce and address are required'}
+    try:
+        nonce = int(nonce)
+    except (TypeError, ValueError):
+        return {'ok': False, 'error': 'Invalid nonce'}
+    if not 0 <= nonce < NONCE_LIMIT:
+        return {'ok': False, 'error': 'Invalid nonce'}
+    result, job = await mining_pool.submit_share(job_id, nonce, address)
+    if job is not None:
+        background_tasks.add_task(connect_orphans, sha256(job.get_block_content(nonce)))
+        txs = [tx.hex() for tx in job.transactions] if len(job.transactions) < 10 else [tx.hash() for tx in job.transactions]
+        background_tasks.add_task(propagate, 'push_block', {
+            'block_content': job.get_block_content(nonce),
+            'txs': txs,
+            'block_no': job.block_no
+        })
+    return result
+
+
+@app.get("/pool/get_stats")
+async def pool_get_stats(pretty: bool = False):
+    if mining_pool is None:
+        return {'ok': False, 'error': 'Pool mode is disabled'}
+    result = {'ok': True, 'result': mining_pool.get_stats()}
     return Response(content=json.dumps(result, indent=4, cls=CustomJSONEncoder), media_type="application/json") if pretty else result
 
 
 @app.get("/get_address_info")
 @limiter.limit("8/second")
-async def get_address_info(request: Request, address: str, transactions_count_limit: int = Query(default=5, le=50), page: int = Query(default=1, ge=1), show_pending: bool = False, verify: bool = False, pretty: bool = False):    
-    outputs = await db.get_spendable_outputs(address)
-    balance = sum(output.amount for output in outputs)
-    
-     # Calculate offset for pagination
-    offset = (page - 1) * transactions_count_limit
-    
-    # Fetch transactions with pagination
-    transactions = await db.get_address_transactions(address, limit=transactions_count_limit, offset=offset, check_signatures=True) if transactions_count_limit > 0 else []
+async def get_address_info(request: Request, address: str, transactions_count_limit: int = Query(default=5, le=50), cursor: str = Query(default=None, regex=r'^\d+:[0-9a-f]{64}$'), page: int = Query(default=1, ge=1), show_spendable_outputs: bool = True, show_pending: bool = False, verify: bool = False, pretty: bool = False):
+    balance = (await db.get_address_stats(address))['balance']
+    outputs = await db.get_spendable_outputs(address) if show_spendable_outputs else None
+
+    # cursor is next_cursor of the previous page, page is still accepted but deep pages are slower
+    offset = (page - 1) * transactions_count_limit if cursor is None else 0
+    history, next_cursor = await db.get_address_history(address, transactions_count_limit, cursor, offset) if transactions_count_limit > 0 else ([], None)
 
     result = {'ok': True, 'result': {
         'balance': "{:f}".format(balance),
-        'spendable_outputs': [{'amount': "{:f}".format(output.amount), 'tx_hash': output.tx_hash, 'index': output.index} for output in outputs],
-        'transactions': [await db.get_nice_transaction(tx.hash(), address if verify else None) for tx in transactions],
+        'spendable_outputs': [{'amount': "{:f}".format(output.amount), 'tx_hash': output.tx_hash, 'index': output.index} for output in outputs] if show_spendable_outputs else None,
+        'transactions': [await db.get_nice_transaction(tx_hash, address if verify else None) for _, tx_hash, _ in history],
+        'next_cursor': next_cursor,
         #'transactions': [await db.get_nice_transaction(tx.hash(), address if verify else None) for tx in await db.get_address_transactions(address, limit=transactions_count_limit, check_signatures=True)] if transactions_count_limit > 0 else [],
         'pending_transactions': [await db.get_nice_transaction(tx.hash(), address if verify else None) for tx in await db.get_address_pending_transactions(address, True)] if show_pending else None,
         'pending_spent_outputs': await db.get_address_pending_spent_outputs(address) if show_pending else None
@@ -416,6 +593,26 @@ async def get_address_info(request: Request, address: str, transactions_count_li
     return Response(content=json.dumps(result, indent=4, cls=CustomJSONEncoder), media_type="application/json") if pretty else result
 
 
+@app.get("/get_address_stats")
+@limiter.limit("8/second")
+async def get_address_stats(request: Request, address: str, pretty: bool = False):
+    stats = await db.get_address_stats(address)
+    for key in ('balance', 'received', 'sent'):
+        stats[key] = "{:f}".format(stats[key])
+    result = {'ok': True, 'result': stats}
+    return Response(content=json.dumps(result, indent=4, cls=CustomJSONEncoder), media_type="application/json") if pretty else result
+
+
+@app.get("/get_rich_list")
+@limiter.limit("2/second")
+async def get_rich_list(request: Request, limit: int = Query(default=100, le=1000), offset: int = Query(default=0, ge=0, le=10000), pretty: bool = False):
+    rich_list = await db.get_rich_list(limit, offset)
+    for entry in rich_list:
+        entry['balance'] = "{:f}".format(entry['balance'])
+    result = {'ok': True, 'result': rich_list}
+    return Response(content=json.dumps(result, indent=4, cls=CustomJSONEncoder), media_type="application/json") if pretty else result
+
+
 @app.get("/add_node")
 @limiter.limit("10/minute")
 async def add_node(request: Request, url: str, background_tasks: BackgroundTasks):
@@ -482,9 +679,39 @@ async def get_block(request: Request, block: str, full_transactions: bool = Fals
     return Response(content=json.dumps(result, indent=4, cls=CustomJSONEncoder), media_type="application/json") if pretty else result
 
 
+@app.get("/get_block_hashes")
+@limiter.limit("60/minute")
+async def get_block_hashes(request: Request, heights: str):
+    try:
+        heights = [int(height) for height in heights.split(',')]
+    except ValueError:
+        return {'ok': False, 'error': 'Invalid heights'}
+    if len(heights) > MAX_HASHES_PER_REQUEST:
+        return {'ok': False, 'error': f'Too many heights, the limit is {MAX_HASHES_PER_REQUEST}'}
+    return {'ok': True, 'result': [db.header_index.get_hash(height) for height in heights]}
+
+
+@app.get("/get_headers")
+# a node syncing from scratch walks the whole chain, HEADERS_CHUNK_SIZE headers per request
+@limiter.limit("600/minute")
+async def get_headers(request: Request, offset: int, limit: int = Query(default=..., le=HEADERS_CHUNK_SIZE)):
+    contents = await db.get_block_contents(offset, limit)
+    for i, content in enumerate(contents):
+        if content is None:
+            # old blocks have been stored without their content, it is rebuilt for the response only
+            contents[i] = await get_stored_block_content((await db.get_blocks(offset + i, 1))[0])
+    return {'ok': True, 'result': contents}
+
+
 @app.get("/get_blocks")
 @limiter.limit("10/minute")
 async def get_blocks(request: Request, offset: int, limit: int = Query(default=..., le=1000), pretty: bool = False):
+    # nodes ask for a stream, every block is sent as soon as it is read from the database
+    accept = request.headers.get('accept', '')
+    if BINARY_MEDIA_TYPE in accept:
+        return StreamingResponse((encode_blocks([block_info]) async for block_info in db.iter_blocks(offset, limit)), media_type=BINARY_MEDIA_TYPE)
+    if NDJSON_MEDIA_TYPE in accept:
+        return StreamingResponse((json.dumps(block_info, cls=CustomJSONEncoder) + '\n' async for block_info in db.iter_blocks(offset, limit)), media_type=NDJSON_MEDIA_TYPE)
     blocks = await db.get_blocks(offset, limit)
     result = {'ok': True, 'result': blocks}
     return Response(content=json.dumps(result, indent=4, cls=CustomJSONEncoder), media_type="application/json") if pretty else result
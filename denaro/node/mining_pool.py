@@ -0,0 +1,163 @@
+import asyncio
+import secrets
+from decimal import Decimal
+from typing import Dict, List, Tuple
+
+from icecream import ic
+
+from ..constants import ENDIAN
+from ..helpers import sha256, timestamp
+from ..manager import get_difficulty, check_block_is_valid, block_to_bytes, create_block
+from ..transactions import Transaction
+from .block_template import BlockTemplate
+from .sync_coordinator import SyncCoordinator
+
+print = ic
+
+NONCE_LIMIT = 2 ** 32
+POOL_NONCE_RANGE_SIZE = 2 ** 24
+POOL_SHARE_DIFFICULTY_DELTA = Decimal(2)
+POOL_MAX_JOBS = 1000
+
+
+class PoolJob:
+    def __init__(self, job_id: str, address: str, difficulty: Decimal, last_block: dict, transactions: List[Transaction], merkle_root: str, template_version: int, min_timestamp: int = 0):
+        self.job_id = job_id
+        self.address = address
+        self.difficulty = difficulty
+        self.last_block = last_block
+        self.transactions = transactions
+        self.template_version = template_version
+        # the timestamp has to be greater than the previous block one, and than the one of the exhausted job this one
+        # replaces, so that their nonce ranges do not overlap
+        self.timestamp = max(timestamp(), last_block.get('timestamp', 0) + 1, min_timestamp)
+        self.block_no = last_block.get('id', 0) + 1
+        self.prefix = block_to_bytes(last_block['hash'], {
+            'address': address,
+            'merkle_tree': merkle_root,
+            'timestamp': self.timestamp,
+            'difficulty': difficulty,
+            'random': 0
+        })[:-4]
+        self.next_nonce = 0
+        # nonce range start -> miner address
+        self.assigned: Dict[int, str] = {}
+        self.submitted = set()
+
+    def is_exhausted(self) -> bool:
+        return self.next_nonce >= NONCE_LIMIT
+
+    def assign_range(self, miner_address: str) -> Tuple[int, int]:
+        start = self.next_nonce
+        self.next_nonce += POOL_NONCE_RANGE_SIZE
+        self.assigned[start] = miner_address
+        return start, min(self.next_nonce, NONCE_LIMIT)
+
+    def get_range_owner(self, nonce: int) -> str:
+        return self.assigned.get(nonce - nonce % POOL_NONCE_RANGE_SIZE)
+
+    def get_block_content(self, nonce: int) -> str:
+        return (self.prefix + nonce.to_bytes(4, ENDIAN)).hex()
+
+
+class MiningPool:
+    """
+    Work distribution for many miners over the current block template.
+
+    Every miner receives a disjoint nonce range of a job, a job being the block template built on the current chain
+    tip with a fixed timestamp and payout address. Miners submit shares at a lower difficulty, which are checked
+    with check_block_is_valid and counted per miner address. A share meeting the full difficulty is a block, and
+    it is added through sync_coordinator like the blocks pushed by other nodes.
+    """
+
+    def __init__(self, block_template: BlockTemplate, sync_coordinator: SyncCoordinator, address: str = None, share_difficulty_delta: Decimal = POOL_SHARE_DIFFICULTY_DELTA):
+        self.block_template = block_template
+        self.sync_coordinator = sync_coordinator
+        self.address = address
+        self.share_difficulty_delta = share_difficulty_delta
+        self.jobs: Dict[str, PoolJob] = {}
+        self.current_jobs: Dict[str, PoolJob] = {}
+        self.shares: Dict[str, int] = {}
+        self.round_shares: Dict[str, int] = {}
+        self.blocks_found = 0
+
+    def get_share_difficulty(self, difficulty: Decimal) -> Decimal:
+        return max(Decimal(difficulty) - self.share_difficulty_delta, Decimal(1))
+
+    async def _get_job(self, address: str) -> PoolJob:
+        difficulty, last_block = await get_difficulty()
+        transactions = self.block_template.get_transactions()
+        job = self.current_jobs.get(address)
+        if job is None or job.is_exhausted() or job.last_block.get('hash') != last_block.get('hash') or job.template_version != self.block_template.version:
+            if not last_block:
+                raise Exception('Pool mining of the genesis block is not supported')
+            # a new merkle root already makes the job unique, the timestamp has to change when the nonces are exhausted
+            min_timestamp = job.timestamp + 1 if job is not None and job.is_exhausted() and job.last_block.get('hash') == last_block.get('hash') else 0
+            job = PoolJob(secrets.token_hex(8), address, difficulty, last_block, [entry.tx for entry in transactions], self.block_template.get_merkle_root(), self.block_template.version, min_timestamp)
+            self.current_jobs[address] = job
+            self.jobs[job.job_id] = job
+            self._clear_old_jobs(last_block['hash'])
+        return job
+
+    def _clear_old_jobs(self, last_block_hash: str):
+        for job_id, job in list(self.jobs.items()):
+            if job.last_block['hash'] != last_block_hash or len(self.jobs) > POOL_MAX_JOBS:
+                del self.jobs[job_id]
+                if self.current_jobs.get(job.address) is job:
+                    del self.current_jobs[job.address]
+
+    async def get_work(self, miner_address: str) -> dict:
+        job = await self._get_job(self.address or miner_address)
+        nonce_start, nonce_end = job.assign_range(miner_address)
+        # blocks with a timestamp ahead of the clock are rejected, so the work is handed out when it is valid
+        if job.timestamp > timestamp():
+            await asyncio.sleep(job.timestamp - timestamp())
+        return {
+            'job_id': job.job_id,
+            'block_no': job.block_no,
+            'prefix': job.prefix.hex(),
+            'nonce_start': nonce_start,
+            'nonce_end': nonce_end,
+            'difficulty': job.difficulty,
+            'share_difficulty': self.get_share_difficulty(job.difficulty),
+            'last_block_hash': job.last_block['hash'],
+            'pending_transactions_hashes': [transaction.hash() for transaction in job.transactions]
+        }
+
+    async def submit_share(self, job_id: str, nonce: int, miner_address: str) -> Tuple[dict, PoolJob]:
+        """
+        Returns the result of the submission and, if the share is a valid block which has been added, its job.
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return {'ok': False, 'error': 'Job not found or stale'}, None
+        if job.get_range_owner(nonce) != miner_address:
+            return {'ok': False, 'error': 'Nonce has not been assigned to this address'}, None
+        if nonce in job.submitted:
+            return {'ok': False, 'error': 'Duplicate share'}, None
+        block_content = job.get_block_content(nonce)
+        mining_info = (job.difficulty, job.last_block)
+        if not await check_block_is_valid(block_content, (self.get_share_difficulty(job.difficulty), job.last_block)):
+            return {'ok': False, 'error': 'Share does not meet share difficulty'}, None
+        job.submitted.add(nonce)
+        self.shares[miner_address] = self.shares.get(miner_address, 0) + 1
+        self.round_shares[miner_address] = self.round_shares.get(miner_address, 0) + 1
+        if not await check_block_is_valid(block_content, mining_info):
+            return {'ok': True, 'result': 'Share accepted'}, None
+        if self.sync_coordinator.is_syncing:
+            return {'ok': True, 'result': 'Share accepted, block has not been accepted while the node is syncing'}, None
+        accepted, first = await self.sync_coordinator.add_block(sha256(block_content), lambda: create_block(block_content, list(job.transactions)))
+        if not accepted or not first:
+            return {'ok': True, 'result': 'Share accepted, block has not been accepted'}, None
+        print(f'Pool found block {job.block_no}')
+        self.blocks_found += 1
+        self.round_shares = {}
+        return {'ok': True, 'result': 'Share accepted, block found'}, job
+
+    def get_stats(self) -> dict:
+        return {
+            'address': self.address,
+            'blocks_found': self.blocks_found,
+            'shares': self.shares,
+            'round_shares': self.round_shares
+        }
@@ -1,17 +1,24 @@
+import asyncio
 import json
 import os
 from os.path import dirname, exists
 from random import sample
+from typing import AsyncIterator, List, Union
 
 import httpx
 import pickledb
 
-from ..constants import MAX_BLOCK_SIZE_HEX
+from ..constants import MAX_BLOCK_SIZE_HEX, MAX_BLOCKS_RESPONSE_SIZE_HEX
 from ..helpers import timestamp
+from .wire import BINARY_MEDIA_TYPE, NDJSON_MEDIA_TYPE, WIRE_FORMATS_HEADER, BlocksDecoder, NDJSONDecoder, encode_push_block
 
 ACTIVE_NODES_DELTA = 60 * 60 * 24 * 7  # 7 days
 INACTIVE_NODES_DELTA = 60 * 60 * 24 * 90  # 3 months
 MAX_NODES_COUNT = 100
+# a full /get_blocks response, with room for the block fields sent along the transactions
+MAX_BLOCKS_RESPONSE_SIZE = MAX_BLOCKS_RESPONSE_SIZE_HEX + MAX_BLOCK_SIZE_HEX
+# how many times a throttled get_headers request is retried, waiting longer every time
+HEADERS_MAX_RETRIES = 5
 
 path = dirname(os.path.realpath(__file__)) + '/nodes.json'
 if not exists(path):
@@ -19,9 +26,17 @@ if not exists(path):
 db = pickledb.load(path, True)
 
 
+class NodeThrottledError(Exception):
+    """
+    Raised when a node answers 429, the request can be sent again later.
+    """
+
+
 class NodesManager:
     last_messages: dict = None
     nodes: list = None
+    # hosts of the nodes which sent WIRE_FORMATS_HEADER, blocks and transactions are pushed to them in binary
+    binary_nodes: set = set()
     db = db
 
     timeout = httpx.Timeout(3)
@@ -39,14 +54,59 @@ class NodesManager:
         NodesManager.db.set('last_messages', NodesManager.last_messages)
 
     @staticmethod
-    async def request(url: str, method: str = 'GET', **kwargs):
+    def get_host(url: str) -> str:
+        return url.split('://', 1)[-1].split('/', 1)[0]
+
+    @staticmethod
+    async def request(url: str, method: str = 'GET', with_status: bool = False, **kwargs):
+        """
+        Returns the decoded response, and its status code before it if with_status is True.
+        """
         async with NodesManager.async_client.stream(method, url, **kwargs) as response:
-            res = ''
-            async for chunk in response.aiter_text():
-                res += chunk
-                if len(res) > MAX_BLOCK_SIZE_HEX * 10:
-                    break
-        return json.loads(res)
+            NodesManager._check_wire_formats(url, response)
+            result = await NodesManager._read_json(response)
+        return (response.status_code, result) if with_status else result
+
+    @staticmethod
+    async def stream_blocks(url: str, **kwargs) -> AsyncIterator[List[dict]]:
+        """
+        Yields the blocks of a get_blocks response as soon as they are decoded, the ones received before the size
+        limit are kept. Raises an exception if the node answers with an error.
+        """
+        async with NodesManager.async_client.stream('GET', url, **kwargs) as response:
+            NodesManager._check_wire_formats(url, response)
+            if response.status_code == 429:
+                raise NodeThrottledError(f'{url} is limiting requests')
+            content_type = response.headers.get('content-type', '').split(';')[0]
+            if content_type in (BINARY_MEDIA_TYPE, NDJSON_MEDIA_TYPE):
+                decoder = BlocksDecoder() if content_type == BINARY_MEDIA_TYPE else NDJSONDecoder()
+                async for chunk in response.aiter_bytes():
+                    blocks = decoder.feed(chunk)
+                    if blocks:
+                        yield blocks
+                    if decoder.size > MAX_BLOCKS_RESPONSE_SIZE:
+                        break
+                return
+            result = await NodesManager._read_json(response)
+        if 'result' not in result:
+            raise Exception(result.get('error') or result.get('detail'))
+        yield result['result']
+
+    @staticmethod
+    def _check_wire_formats(url: str, response: httpx.Response):
+        if 'binary' in response.headers.get(WIRE_FORMATS_HEADER, ''):
+            NodesManager.binary_nodes.add(NodesManager.get_host(url))
+
+    @staticmethod
+    async def _read_json(response: httpx.Response):
+        chunks = []
+        size = 0
+        async for chunk in response.aiter_bytes():
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > MAX_BLOCK_SIZE_HEX * 10:
+                break
+        return json.loads(b''.join(chunks))
 
     @staticmethod
     async def is_node_working(node: str):
@@ -118,21 +178,53 @@ class NodeInterface:
         res = await self.request('get_block', {'block': block_no, 'full_transactions': full_transactions})
         return res['result']
 
+    async def iter_blocks(self, offset: int, limit: int) -> AsyncIterator[List[dict]]:
+        """
+        Yields the blocks from offset in batches, as soon as they are received.
+        """
+        headers = {'Sender-Node': '', 'Accept': f'{BINARY_MEDIA_TYPE}, {NDJSON_MEDIA_TYPE}, application/json'}
+        async for blocks in NodesManager.stream_blocks(f'{self.url}/get_blocks', params={'offset': offset, 'limit': limit}, headers=headers, timeout=10):
+            yield blocks
+
     async def get_blocks(self, offset: int, limit: int):
-        res = await self.request('get_blocks', {'offset': offset, 'limit': limit})
+        return [block async for blocks in self.iter_blocks(offset, limit) for block in blocks]
+
+    async def get_block_hashes(self, heights: List[int]) -> List[Union[str, None]]:
+        res = await self.request('get_block_hashes', {'heights': ','.join(str(height) for height in heights)})
+        if 'result' not in res:
+            raise Exception(res.get('error') or res.get('detail') or 'get_block_hashes is not supported')
+        return res['result']
+
+    async def get_headers(self, offset: int, limit: int) -> Union[List[str], None]:
+        """
+        Returns None only if the node does not have get_headers, throttled requests are retried and other errors raise.
+        """
+        for retry in range(HEADERS_MAX_RETRIES + 1):
+            status_code, res = await self.request('get_headers', {'offset': offset, 'limit': limit}, with_status=True)
+            if status_code == 404:
+                return None
+            if status_code != 429 or retry == HEADERS_MAX_RETRIES:
+                break
+            await asyncio.sleep(2 ** retry * 5)
         if 'result' not in res:
-            # todo improve error handling
-            raise Exception(res['error'])
+            raise Exception(f'get_headers failed with status {status_code}: {res.get("error") or res.get("detail")}')
         return res['result']
 
     async def get_nodes(self):
         res = await self.request('get_nodes')
         return res['result']
 
-    async def request(self, path: str, data: dict = {}, sender_node: str = ''):
+    async def request(self, path: str, data: dict = {}, sender_node: str = '', with_status: bool = False):
         headers = {'Sender-Node': sender_node}
-        if path in ('push_block', 'push_tx'):
+        if path in ('push_block', 'push_tx') and NodesManager.get_host(self.url) in NodesManager.binary_nodes:
+            headers['Content-Type'] = BINARY_MEDIA_TYPE
+            if path == 'push_tx':
+                content = bytes.fromhex(data['tx_hex'])
+            else:
+                content = encode_push_block(data['block_content'], data['txs'], data.get('block_no'))
+            r = await NodesManager.request(f'{self.url}/{path}', method='POST', content=content, headers=headers, timeout=10)
+        elif path in ('push_block', 'push_tx'):
             r = await NodesManager.request(f'{self.url}/{path}', method='POST', json=data, headers=headers, timeout=10)
         else:
-            r = await NodesManager.request(f'{self.url}/{path}', params=data, headers=headers, timeout=10)
+            r = await NodesManager.request(f'{self.url}/{path}', params=data, headers=headers, timeout=10, with_status=with_status)
         return r
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+from typing import Dict, List, Union
+
+from ..constants import MAX_BLOCK_SIZE_HEX
+from ..helpers import sha256, timestamp
+from ..manager import split_block_content
+
+ORPHAN_POOL_MAX_BLOCKS = 100
+ORPHAN_POOL_MAX_SIZE = MAX_BLOCK_SIZE_HEX * 20
+ORPHAN_MAX_AGE = 60 * 10
+# how many missing parents are requested one by one before falling back to a full sync
+ORPHAN_MAX_PARENTS = 10
+# minimum seconds between two parent requests or syncs triggered by the orphans of the same node
+ORPHAN_PEER_INTERVAL = 10
+
+
+class OrphanBlock:
+    __slots__ = ('block_hash', 'previous_hash', 'block_content', 'txs', 'sender_node', 'time_received', 'size')
+
+    def __init__(self, block_content: str, txs: List[str], sender_node: str = None):
+        self.block_hash = sha256(block_content)
+        self.previous_hash = split_block_content(block_content)[0]
+        self.block_content = block_content
+        self.txs = txs
+        self.sender_node = sender_node
+        self.time_received = timestamp()
+        self.size = len(block_content) + sum(len(tx) for tx in txs)
+
+
+class OrphanPool:
+    """
+    Blocks received before their parent, keyed by previous hash.
+
+    They are connected when the parent is added to the chain (see pop_children) and dropped when older than max_age
+    seconds, or starting from the oldest ones when the pool holds more than max_blocks blocks or max_size hex characters.
+    """
+
+    def __init__(self, max_blocks: int = ORPHAN_POOL_MAX_BLOCKS, max_size: int = ORPHAN_POOL_MAX_SIZE, max_age: int = ORPHAN_MAX_AGE):
+        self.max_blocks = max_blocks
+        self.max_size = max_size
+        self.max_age = max_age
+        self.blocks: Dict[str, OrphanBlock] = OrderedDict()
+        self.children: Dict[str, Dict[str, OrphanBlock]] = {}
+        self.size = 0
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __contains__(self, block_hash: str):
+        return block_hash in self.blocks
+
+    def add(self, orphan: OrphanBlock) -> bool:
+        if orphan.block_hash in self.blocks or orphan.size > self.max_size:
+            return False
+        self.blocks[orphan.block_hash] = orphan
+        self.children.setdefault(orphan.previous_hash, {})[orphan.block_hash] = orphan
+        self.size += orphan.size
+        self.expire()
+        return orphan.block_hash in self.blocks
+
+    def remove(self, block_hash: str) -> Union[OrphanBlock, None]:
+        orphan = self.blocks.pop(block_hash, None)
+        if orphan is None:
+            return None
+        siblings = self.children[orphan.previous_hash]
+        del siblings[block_hash]
+        if not siblings:
+            del self.children[orphan.previous_hash]
+        self.size -= orphan.size
+        return orphan
+
+    def expire(self):
+        min_time = timestamp() - self.max_age
+        while self.blocks:
+            oldest = next(iter(self.blocks.values()))
+            if oldest.time_received >= min_time and len(self.blocks) <= self.max_blocks and self.size <= self.max_size:
+                break
+            self.remove(oldest.block_hash)
+
+    def pop_children(self, block_hash: str) -> List[OrphanBlock]:
+        """
+        Removes and returns the blocks whose parent is block_hash.
+        """
+        return [self.remove(child_hash) for child_hash in list(self.children.get(block_hash, {}))]
+
+    def get_missing_parent(self, block_hash: str) -> Union[str, None]:
+        """
+        Returns the hash of the first block missing to connect block_hash, following its ancestors held by the pool.
+        """
+        if block_hash not in self.blocks:
+            return None
+        while block_hash in self.blocks:
+            block_hash = self.blocks[block_hash].previous_hash
+        return block_hash
+
+    def allow_request(self, node_url: str) -> bool:
+        """
+        Returns whether the orphans sent by node_url can trigger a request of missing blocks now, and records it.
+        """
+        now = timestamp()
+        for url in [url for url, last_request in self.last_requests.items() if last_request <= now - self.peer_interval]:
+            del self.last_requests[url]
+        if node_url in self.last_requests:
+            return False
+        self.last_requests[node_url] = now
+        return True
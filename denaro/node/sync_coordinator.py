@@ -0,0 +1,65 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Tuple
+
+from icecream import ic
+
+print = ic
+
+
+class SyncCoordinator:
+    """
+    Serializes the work which changes the chain: syncs and blocks received from other nodes or miners.
+
+    At most one sync runs at a time. A sync requested while another one is running is merged with the other requests
+    received meanwhile into a single sync which starts right after, and every caller waits until its request is served.
+    Blocks are added one at a time, and a block received again while it is still being added waits for the result
+    of the first copy instead of being validated again.
+    """
+
+    def __init__(self, sync_function: Callable[[str], Awaitable]):
+        self.sync_function = sync_function
+        self.lock = asyncio.Lock()
+        self.sync_task: asyncio.Task = None
+        self.sync_requested = False
+        self.sync_node: str = None
+        self.syncing = False
+        self.blocks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def is_syncing(self) -> bool:
+        return self.syncing or self.sync_requested
+
+    async def sync(self, node_url: str = None):
+        self.sync_requested = True
+        self.sync_node = node_url or self.sync_node
+        if self.sync_task is None or self.sync_task.done():
+            self.sync_task = asyncio.ensure_future(self._run_syncs())
+        await asyncio.shield(self.sync_task)
+
+    async def _run_syncs(self):
+        while self.sync_requested:
+            node_url, self.sync_node, self.sync_requested = self.sync_node, None, False
+            async with self.lock:
+                self.syncing = True
+                try:
+                    await self.sync_function(node_url)
+                except Exception as e:
+                    print(e)
+                finally:
+                    self.syncing = False
+
+    async def add_block(self, block_hash: str, add_function: Callable[[], Awaitable[bool]]) -> Tuple[bool, bool]:
+        """
+        Runs add_function, unless block_hash is already being added. Returns its result and whether it has been run
+        by this call.
+        """
+        task = self.blocks.get(block_hash)
+        if task is not None:
+            return await asyncio.shield(task), False
+        task = self.blocks[block_hash] = asyncio.ensure_future(self._add_block(add_function))
+        task.add_done_callback(lambda _: self.blocks.pop(block_hash, None))
+        return await asyncio.shield(task), True
+
+    async def _add_block(self, add_function: Callable[[], Awaitable[bool]]) -> bool:
+        async with self.lock:
+            return await add_function()
@@ -0,0 +1,178 @@
+import json
+from decimal import Decimal
+from typing import List, Tuple, Union
+
+from ..constants import ENDIAN
+from ..manager import split_block_content
+
+# binary encoding of blocks and transactions exchanged between nodes, JSON is still used when a node does not ask for it
+BINARY_MEDIA_TYPE = 'application/vnd.denaro.binary'
+# blocks streamed as JSON, one per line
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+# header sent by nodes which accept and send BINARY_MEDIA_TYPE
+WIRE_FORMATS_HEADER = 'Denaro-Wire-Formats'
+WIRE_FORMATS = 'json,binary'
+
+
+def _write(out: bytearray, data: bytes, length_size: int):
+    out += len(data).to_bytes(length_size, ENDIAN)
+    out += data
+
+
+def _write_transactions(out: bytearray, txs: List[str]):
+    out += len(txs).to_bytes(4, ENDIAN)
+    for tx_hex in txs:
+        _write(out, bytes.fromhex(tx_hex), 4)
+
+
+class BufferReader:
+    """
+    Reads length-prefixed fields from a buffer without copying it, read raises IndexError if the buffer is too short.
+    """
+
+    def __init__(self, buffer: Union[bytes, bytearray, memoryview], position: int = 0):
+        self.view = memoryview(buffer)
+        self.position = position
+
+    def read(self, size: int) -> memoryview:
+        end = self.position + size
+        if end > len(self.view):
+            raise IndexError('buffer too short')
+        data = self.view[self.position:end]
+        self.position = end
+        return data
+
+    def read_int(self, size: int) -> int:
+        return int.from_bytes(self.read(size), ENDIAN)
+
+    def read_field(self, length_size: int) -> memoryview:
+        return self.read(self.read_int(length_size))
+
+    def read_transactions(self) -> List[str]:
+        return [self.read_field(4).hex() for _ in range(self.read_int(4))]
+
+
+def encode_blocks(blocks: List[dict]) -> bytes:
+    """
+    Encodes the result of Database.get_blocks, every block is
+    id (4 bytes) | hash (32 bytes) | content length (2 bytes) | content | transactions count (4 bytes) | transactions,
+    and every transaction is its length (4 bytes) followed by its bytes.
+    Old blocks stored without content have an empty content followed by
+    address length (2 bytes) | address | timestamp (4 bytes) | difficulty * 10 (2 bytes) | random (4 bytes),
+    and their content is rebuilt by decode_block like for the JSON format.
+    """
+    out = bytearray()
+    for block_info in blocks:
+        block = block_info['block']
+        out += block['id'].to_bytes(4, ENDIAN)
+        out += bytes.fromhex(block['hash'])
+        if block.get('content'):
+            _write(out, bytes.fromhex(block['content']), 2)
+        else:
+            _write(out, b'', 2)
+            _write(out, block['address'].encode(), 2)
+            out += block['timestamp'].to_bytes(4, ENDIAN)
+            out += int(float(block['difficulty']) * 10).to_bytes(2, ENDIAN)
+            out += block['random'].to_bytes(4, ENDIAN)
+        _write_transactions(out, block_info['transactions'])
+    return bytes(out)
+
+
+def read_block(reader: BufferReader) -> dict:
+    block_id = reader.read_int(4)
+    block_hash = reader.read(32).hex()
+    content = reader.read_field(2).hex()
+    if content:
+        _, address, merkle_tree, content_time, difficulty, random = split_block_content(content)
+    else:
+        content, merkle_tree = None, None
+        address = bytes(reader.read_field(2)).decode()
+        content_time = reader.read_int(4)
+        difficulty = reader.read_int(2) / Decimal(10)
+        random = reader.read_int(4)
+    txs = reader.read_transactions()
+    return {
+        'block': {
+            'id': block_id,
+            'hash': block_hash,
+            'content': content,
+            'address': address,
+            'merkle_tree': merkle_tree,
+            'timestamp': content_time,
+            'difficulty': difficulty,
+            'random': random
+        },
+        'transactions': txs
+    }
+
+
+class BlocksDecoder:
+    """
+    Decodes blocks encoded by encode_blocks while they are received: feed can be called with every chunk of the
+    response, complete blocks are appended to blocks and the rest is kept until the next chunk.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.blocks: List[dict] = []
+        self.size = 0
+
+    def feed(self, data: bytes) -> List[dict]:
+        self.buffer += data
+        self.size += len(data)
+        blocks = []
+        reader = BufferReader(self.buffer)
+        position = 0
+        try:
+            while True:
+                blocks.append(read_block(reader))
+                position = reader.position
+        except IndexError:
+            pass
+        finally:
+            # the buffer cannot be resized while it is viewed
+            reader.view.release()
+        del self.buffer[:position]
+        self.blocks.extend(blocks)
+        return blocks
+
+
+class NDJSONDecoder:
+    """
+    Same as BlocksDecoder for blocks streamed as NDJSON.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.blocks: List[dict] = []
+        self.size = 0
+
+    def feed(self, data: bytes) -> List[dict]:
+        self.buffer += data
+        self.size += len(data)
+        end = self.buffer.rfind(b'\n')
+        if end == -1:
+            return []
+        blocks = [json.loads(line) for line in self.buffer[:end].split(b'\n') if line]
+        del self.buffer[:end + 1]
+        self.blocks.extend(blocks)
+        return blocks
+
+
+def encode_push_block(block_content: str, txs: List[str], block_no: int = None) -> bytes:
+    """
+    Encodes the arguments of push_block: block_no (4 bytes, 0 if unknown) | content length (2 bytes) | content |
+    transactions count (4 bytes) | transactions, where a 32 bytes transaction is the hash of a pending one.
+    """
+    out = bytearray((block_no or 0).to_bytes(4, ENDIAN))
+    _write(out, bytes.fromhex(block_content), 2)
+    _write_transactions(out, txs)
+    return bytes(out)
+
+
+def decode_push_block(data: bytes) -> Tuple[str, List[str], Union[int, None]]:
+    reader = BufferReader(data)
+    block_no = reader.read_int(4) or None
+    block_content = reader.read_field(2).hex()
+    txs = reader.read_transactions()
+    return block_content, txs, block_no
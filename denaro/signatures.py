@@ -0,0 +1,108 @@
+import asyncio
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from fastecdsa import ecdsa
+from fastecdsa.point import Point
+
+from .constants import CURVE
+
+SIGNATURES_BATCH_SIZE = 64
+SIGNATURE_CACHE_SIZE = 100_000
+
+
+def verify_signature(signed: Tuple[int, int], message: str, public_key: Point) -> bool:
+    return \
+        ecdsa.verify(signed, bytes.fromhex(message), public_key, CURVE) or \
+        ecdsa.verify(signed, message, public_key, CURVE)
+
+
+def _verify_batch(batch: List[Tuple[str, List[Tuple[Tuple[int, int], int, int]]]]) -> List[List[bool]]:
+    # runs in the worker processes, points are sent as coordinates since they are cheaper to pickle
+    return [[verify_signature(signed, message, Point(x, y, CURVE)) for signed, x, y in signatures] for message, signatures in batch]
+
+
+class SignatureCache:
+    """
+    Least recently used set of transaction inputs whose signature has already been verified.
+    An input is identified by the hash of the spending transaction, which covers message and signatures,
+    and by the spent output, which determines the public key the signature has been verified against.
+    """
+
+    def __init__(self, max_size: int = SIGNATURE_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _key(tx_hash: str, tx_input) -> str:
+        return f'{tx_hash}{tx_input.tx_hash}{tx_input.index:02x}'
+
+    def contains(self, tx_hash: str, tx_input) -> bool:
+        key = self._key(tx_hash, tx_input)
+        if key not in self._entries:
+            return False
+        self._entries.move_to_end(key)
+        return True
+
+    def add(self, tx_hash: str, tx_inputs: list):
+        for tx_input in tx_inputs:
+            key = self._key(tx_hash, tx_input)
+            self._entries[key] = None
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SignatureVerifier:
+    executor: ProcessPoolExecutor = None
+    workers: int = 0
+    cache: SignatureCache = SignatureCache()
+
+    @staticmethod
+    def init(workers: int = None):
+        SignatureVerifier.shutdown()
+        workers = os.cpu_count() if workers is None else workers
+        if workers > 0:
+            SignatureVerifier.executor = ProcessPoolExecutor(max_workers=workers)
+        SignatureVerifier.workers = workers
+
+    @staticmethod
+    def shutdown():
+        if SignatureVerifier.executor is not None:
+            SignatureVerifier.executor.shutdown(wait=False, cancel_futures=True)
+            SignatureVerifier.executor = None
+        SignatureVerifier.workers = 0
+
+    @staticmethod
+    async def verify_transactions(transactions: List[Tuple[str, List[Tuple[Tuple[int, int], Point]]]]) -> List[List[bool]]:
+        """
+        Verifies the signatures of many transactions at once.
+        transactions is a list of (signed message, [(signature, public key), ...]) items, the result contains the
+        verification result of every signature, grouped by transaction and in the same order.
+        If the process pool has been initialized, signatures are verified in batches by the worker processes.
+        """
+        items = [(message, [(signed, public_key.x, public_key.y) for signed, public_key in signatures]) for message, signatures in transactions]
+        if SignatureVerifier.executor is None:
+            return _verify_batch(items)
+        batches = []
+        batch, batch_size = [], 0
+        for item in items:
+            batch.append(item)
+            batch_size += len(item[1])
+            if batch_size >= SIGNATURES_BATCH_SIZE:
+                batches.append(batch)
+                batch, batch_size = [], 0
+        if batch:
+            batches.append(batch)
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*[loop.run_in_executor(SignatureVerifier.executor, _verify_batch, batch) for batch in batches])
+        return sum(results, [])
+
+    @staticmethod
+    async def verify(message: str, signatures: List[Tuple[Tuple[int, int], Point]]) -> List[bool]:
+        return (await SignatureVerifier.verify_transactions([(message, signatures)]))[0]
@@ -1,14 +1,16 @@
 from decimal import Decimal
 from io import BytesIO
-from typing import List
+from typing import List, Tuple, Union
 
 from fastecdsa import keys
+from fastecdsa.point import Point
 from icecream import ic
 
 from . import TransactionInput, TransactionOutput
 from .coinbase_transaction import CoinbaseTransaction
 from ..constants import ENDIAN, SMALLEST, CURVE
 from ..helpers import point_to_string, bytes_to_string, sha256
+from ..signatures import SignatureVerifier
 
 import struct
 
@@ -106,39 +108,58 @@ class Transaction:
         spent_outputs = await Database.instance.get_pending_spent_outputs(check_inputs)
         return spent_outputs == []
 
-    async def _fill_transaction_inputs(self, txs=None) -> None:
+    async def _fill_transaction_inputs(self, outputs=None) -> None:
         from .. import Database
-        check_inputs = [tx_input.tx_hash for tx_input in self.inputs if tx_input.transaction is None and tx_input.transaction_info is None]
+        check_inputs = [(tx_input.tx_hash, tx_input.index) for tx_input in self.inputs if tx_input.transaction is None and tx_input.output_info is None]
         if not check_inputs:
             return
-        if txs is None:
-            txs = await Database.instance.get_transactions_info(check_inputs)
+        if outputs is None:
+            outputs = await Database.instance.get_unspent_outputs_info(check_inputs)
         for tx_input in self.inputs:
-            tx_hash = tx_input.tx_hash
-            if tx_hash in txs:
-                tx_input.transaction_info = txs[tx_hash]
+            output_info = outputs.get((tx_input.tx_hash, tx_input.index))
+            # outputs not found in the unspent outputs table are read from their transaction
+            if output_info is not None and output_info['amount'] is not None and output_info['address'] is not None:
+                tx_input.output_info = output_info
 
-    async def _check_signature(self):
-        tx_hex = self.hex(False)
+    async def _get_signatures(self, skip_cached: bool = False) -> Union[List[Tuple[Tuple[int, int], Point]], None]:
+        """
+        Returns the (signature, public key) couples which have to be verified against self.hex(False),
+        or None if the transaction cannot be verified at all.
+        If skip_cached is True, inputs already verified by SignatureVerifier.cache are left out.
+        """
         checked_signatures = []
+        signatures = []
         for tx_input in self.inputs:
             if tx_input.signed is None:
                 print('not signed')
-                return False
-            await tx_input.get_public_key()
+                return None
+            if skip_cached and SignatureVerifier.cache.contains(self.hash(), tx_input):
+                continue
+            try:
+                public_key = await tx_input.get_public_key()
+            except AssertionError:
+                return None
             signature = (tx_input.public_key, tx_input.signed)
             if signature in checked_signatures:
                 continue
-            if not await tx_input.verify(tx_hex):
-                print('signature not valid')
-                return False
+            signatures.append((tx_input.signed, public_key))
             checked_signatures.append(signature)
+        return signatures
+
+    async def _check_signature(self):
+        signatures = await self._get_signatures()
+        if signatures is None:
+            return False
+        if not all(await SignatureVerifier.verify(self.hex(False), signatures)):
+            print('signature not valid')
+            return False
+        SignatureVerifier.cache.add(self.hash(), self.inputs)
         return True
 
     def _verify_outputs(self):
         return (self.outputs or self.hash() == '915ddf143e14647ba1e04c44cf61e57084254c44cd4454318240f359a414065c') and all(tx_output.verify() for tx_output in self.outputs)
 
-    async def verify(self, check_double_spend: bool = True) -> bool:
+    async def verify(self, check_double_spend: bool = True, check_signatures: bool = True) -> bool:
         if check_double_spend and not self._verify_double_spend_same_transaction():
             print('double spend inside same transaction')
             return False
@@ -149,7 +170,7 @@ class Transaction:
 
         await self._fill_transaction_inputs()
 
-        if not await self._check_signature():
+        if check_signatures and not await self._check_signature():
             return False
 
         if not self._verify_outputs():
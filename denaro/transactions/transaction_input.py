@@ -6,6 +6,7 @@ from fastecdsa.point import Point
 
 from ..constants import CURVE, ENDIAN, SMALLEST
 from ..helpers import point_to_string, string_to_point
+from ..signatures import verify_signature
 
 
 class TransactionInput:
@@ -20,6 +21,8 @@ class TransactionInput:
         self.private_key = private_key
         self.transaction = transaction
         self.transaction_info = None
+        # address and amount of the spent output, from the unspent outputs table
+        self.output_info = None
         self.amount = amount
         self.public_key = public_key
         if transaction is not None and amount is None:
@@ -46,10 +49,11 @@ class TransactionInput:
         return related_output
 
     async def get_related_output_info(self):
-        tx = await self.get_transaction_info()
-        related_output = {'address': tx['outputs_addresses'][self.index], 'amount': Decimal(tx['outputs_amounts'][self.index]) / SMALLEST}
-        self.amount = related_output['amount']
-        return related_output
+        if self.output_info is None:
+            tx = await self.get_transaction_info()
+            self.output_info = {'address': tx['outputs_addresses'][self.index], 'amount': Decimal(tx['outputs_amounts'][self.index]) / SMALLEST}
+        self.amount = self.output_info['amount']
+        return self.output_info
 
     async def get_amount(self):
         if self.amount is None:
@@ -84,9 +88,7 @@ class TransactionInput:
             return False
         # print('verifying with', point_to_string(public_key))
 
-        return \
-            ecdsa.verify(self.signed, bytes.fromhex(input_tx), public_key, CURVE) or \
-            ecdsa.verify(self.signed, input_tx, public_key, CURVE)
+        return verify_signature(self.signed, input_tx, public_key)
 
     @property
     def as_dict(self):
@@ -94,6 +96,7 @@ class TransactionInput:
         self_dict['signed'] = self_dict['signed'] is not None
         if 'public_key' in self_dict: self_dict['public_key'] = point_to_string(self_dict['public_key'])
         if 'transaction' in self_dict: del self_dict['transaction']
+        if 'output_info' in self_dict: del self_dict['output_info']
         if 'private_key' in self_dict: del self_dict['private_key']
         return self_dict
 
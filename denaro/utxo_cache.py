@@ -0,0 +1,80 @@
+from typing import Dict, List, Set, Tuple
+
+UTXO_CACHE_FLUSH_BLOCKS = 1000
+UTXO_CACHE_MAX_ENTRIES = 2_000_000
+
+
+class UTXOCache:
+    """
+    Write-back cache of the unspent outputs, used by Database while syncing.
+
+    outputs holds the known unspent outputs (address, amount and height), both the ones created by blocks connected since
+    the last flush (created) and the ones read from unspent_outputs. Outputs created and spent between two flushes never
+    reach the database. spent holds the outputs which are still in unspent_outputs but have been spent since the last flush.
+
+    The database is consistent only at flush boundaries: flush_height is the id of the last block whose outputs are in
+    unspent_outputs, and it is stored with every flush so that blocks after it can be removed after a crash.
+    """
+
+    def __init__(self, flush_height: int, flush_blocks: int = UTXO_CACHE_FLUSH_BLOCKS, max_entries: int = UTXO_CACHE_MAX_ENTRIES):
+        self.flush_height = flush_height
+        self.height = flush_height
+        self.flush_blocks = flush_blocks
+        self.max_entries = max_entries
+        self.outputs: Dict[Tuple[str, int], dict] = {}
+        self.created: Set[Tuple[str, int]] = set()
+        self.spent: Set[Tuple[str, int]] = set()
+        # increased by every flush, database reads started before a flush cannot be cached
+        self.generation = 0
+
+    def __len__(self):
+        return len(self.outputs) + len(self.spent)
+
+    def get(self, outpoints: List[Tuple[str, int]]) -> Tuple[Dict[Tuple[str, int], dict], List[Tuple[str, int]]]:
+        """
+        Returns the unspent outputs found in memory and the ones which have to be read from the database.
+        """
+        found = {}
+        missing = []
+        for outpoint in outpoints:
+            if outpoint in self.outputs:
+                found[outpoint] = self.outputs[outpoint]
+            elif outpoint not in self.spent:
+                missing.append(outpoint)
+        return found, missing
+
+    def add_fetched(self, outputs: Dict[Tuple[str, int], dict], generation: int):
+        if generation != self.generation:
+            return
+        for outpoint, output in outputs.items():
+            if outpoint not in self.spent and outpoint not in self.outputs:
+                self.outputs[outpoint] = output
+
+    def connect(self, height: int, created: Dict[Tuple[str, int], dict], spent: List[Tuple[str, int]]):
+        for outpoint, output in created.items():
+            self.outputs[outpoint] = output
+            self.created.add(outpoint)
+        for outpoint in spent:
+            self.outputs.pop(outpoint, None)
+            if outpoint in self.created:
+                self.created.remove(outpoint)
+            else:
+                self.spent.add(outpoint)
+        self.height = height
+
+    def need_flush(self) -> bool:
+        return self.height - self.flush_height >= self.flush_blocks or len(self) >= self.max_entries
+
+    def get_changes(self) -> Tuple[List[tuple], List[Tuple[str, int]]]:
+        """
+        Returns the records to be inserted in unspent_outputs and the outputs to be deleted from it.
+        """
+        created = [(tx_hash, index, self.outputs[(tx_hash, index)]['address'], self.outputs[(tx_hash, index)]['amount'], self.outputs[(tx_hash, index)]['height']) for tx_hash, index in self.created]
+        return created, list(self.spent)
+
+    def flushed(self):
+        self.flush_height = self.height
+        self.generation += 1
+        self.outputs.clear()
+        self.created.clear()
+        self.spent.clear()
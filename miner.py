@@ -1,8 +1,10 @@
 import hashlib
+import struct
 import sys
 import time
 from math import ceil
-from multiprocessing import Process
+from multiprocessing import Process, Queue, Array
+from threading import Thread
 
 import requests
 
@@ -15,33 +17,65 @@ def get_transactions_merkle_tree(transactions):
 
 
 NODE = sys.argv[3].strip('/')+'/' if len(sys.argv) >= 4 else 'http://localhost:3006/'
+LONG_POLL_TIMEOUT = 60
+# nodes without long polling are polled less and less often, up to the interval work was refreshed at before
+MINING_INFO_MAX_INTERVAL = 90
+JOB_CHECK_INTERVAL = 100000
+HASHRATE_REPORT_INTERVAL = 5000000
+HASHRATE_REPORT_SECONDS = 30
+NONCE = struct.Struct('<I' if ENDIAN == 'little' else '>I')
+NONCE_LIMIT = 2 ** 32
 
 
-def run(start: int = 0, step: int = 1, res: dict = None):
-    difficulty = res['difficulty']
+def get_block_hash_checker(last_block_hash: str, difficulty):
+    """
+    Returns (target, check_rest): a block hash is valid if its digest starts with the target bytes and check_rest(digest)
+    is True. This is the same rule of check_block_is_valid, evaluated on the raw digest instead of its hex string.
+    """
+    idifficulty = int(difficulty)
     decimal = difficulty % 1
+    chunk = last_block_hash[-idifficulty:] if idifficulty else ''
+    target = bytes.fromhex(chunk[:idifficulty - idifficulty % 2])
+    half_byte = int(chunk[-1], 16) if idifficulty % 2 else None
+    # with a decimal difficulty, the hex char following the chunk must be lower than count
+    count = ceil(16 * (1 - decimal)) if decimal > 0 else None
+    position = len(target)
+
+    def get_nibble(digest: bytes, index: int) -> int:
+        return digest[index // 2] >> 4 if index % 2 == 0 else digest[index // 2] & 15
+
+    if half_byte is None and count is None:
+        return target, None
+
+    def check_rest(digest: bytes) -> bool:
+        if half_byte is not None and digest[position] >> 4 != half_byte:
+            return False
+        return count is None or get_nibble(digest, idifficulty) < count
+
+    return target, check_rest
+
+
+def search_nonce(midstate, target: bytes, check_rest, first: int, last: int, step: int):
+    copy = midstate.copy
+    pack = NONCE.pack
+    for nonce in range(first, last, step):
+        h = copy()
+        h.update(pack(nonce))
+        digest = h.digest()
+        if digest.startswith(target) and (check_rest is None or check_rest(digest)):
+            return nonce
+    return None
+
+
+def run(start: int = 0, step: int = 1, res: dict = None, jobs: Queue = None, hashes_counter=None):
+    difficulty = res['difficulty']
     last_block = res['last_block']
     last_block['hash'] = last_block['hash'] if 'hash' in last_block else (30_06_2005).to_bytes(32, ENDIAN).hex()
     last_block['id'] = last_block['id'] if 'id' in last_block else 0
-    chunk = last_block['hash'][-int(difficulty):]
-
-    charset = '0123456789abcdef'
-    if decimal > 0:
-        count = ceil(16 * (1 - decimal))
-        charset = charset[:count]
-        idifficulty = int(difficulty)
-
-        def check_block_is_valid(block_content: bytes) -> bool:
-            block_hash = hashlib.sha256(block_content).hexdigest()
-            return block_hash.startswith(chunk) and block_hash[idifficulty] in charset
-    else:
-        def check_block_is_valid(block_content: bytes) -> bool:
-            return hashlib.sha256(block_content).hexdigest().startswith(chunk)
+    target, check_rest = get_block_hash_checker(last_block['hash'], difficulty)
 
     address = sys.argv[1]
     address_bytes = string_to_bytes(address)
-    t = time.time()
-    i = start
     a = timestamp()
     txs = res['pending_transactions_hashes']
     merkle_tree = get_transactions_merkle_tree(txs)
@@ -50,66 +84,129 @@ def run(start: int = 0, step: int = 1, res: dict = None):
         print(f'difficulty: {difficulty}')
         print(f'block number: {last_block["id"]}')
         print(f'Confirming {len(txs)} transactions')
-    prefix = bytes.fromhex(last_block['hash']) + address_bytes + bytes.fromhex(merkle_tree) + a.to_bytes(4, byteorder=ENDIAN) + int(difficulty * 10).to_bytes(2, ENDIAN)
-    if len(address_bytes) == 33:
-        prefix = (2).to_bytes(1, ENDIAN) + prefix
+
+    def get_prefix(block_timestamp: int) -> bytes:
+        prefix = bytes.fromhex(last_block['hash']) + address_bytes + bytes.fromhex(merkle_tree) + block_timestamp.to_bytes(4, byteorder=ENDIAN) + int(difficulty * 10).to_bytes(2, ENDIAN)
+        if len(address_bytes) == 33:
+            prefix = (2).to_bytes(1, ENDIAN) + prefix
+        return prefix
+
+    prefix = get_prefix(a)
+    # sha256 state after the constant part of the block, every nonce only hashes the last 4 bytes from here
+    midstate = hashlib.sha256(prefix)
+    t = time.time()
+    hashes = 0
+    last_report = 0
+    # new work is checked every JOB_CHECK_INTERVAL hashes, so workers switch to it without being restarted
+    batch = JOB_CHECK_INTERVAL * step
+    i = start
     while True:
-        found = True
-        check = 5000000 * step
-        while not check_block_is_valid(_hex := prefix + i.to_bytes(4, ENDIAN)):
-            if ((i := i + step) - start) % check == 0:
-                elapsed_time = time.time() - t
-                print(f'Worker {start + 1}: ' + str(int(i / step / elapsed_time / 1000)) + 'k hash/s')
-                if elapsed_time > 90:
-                    found = False
-                    break
-        if found:
-            print(_hex.hex())
-            print(','.join(txs))
-            r = requests.post(NODE + 'push_block', json={
-                'block_content': _hex.hex(),
-                'txs': txs,
-                'id': last_block["id"] + 1
-            }, timeout=20 + int((len(txs) or 1) / 3))
-            print(res := r.json())
-            if res['ok']:
-                print('BLOCK MINED\n\n')
-            exit()
-
-
-def worker(start: int, step: int, res: dict):
+        if i >= NONCE_LIMIT:
+            # nonce space is over, roll the timestamp and start again
+            a = max(timestamp(), a + 1)
+            prefix = get_prefix(a)
+            midstate = hashlib.sha256(prefix)
+            i = start
+        last = min(i + batch, NONCE_LIMIT)
+        nonce = search_nonce(midstate, target, check_rest, i, last, step)
+        if nonce is not None:
+            break
+        hashes += len(range(i, last, step))
+        i = last
+        if hashes_counter is not None:
+            hashes_counter[start] = hashes
+        if not jobs.empty():
+            return get_latest_job(jobs)
+        if hashes - last_report >= HASHRATE_REPORT_INTERVAL:
+            last_report = hashes
+            print(f'Worker {start + 1}: ' + str(int(hashes / (time.time() - t) / 1000)) + 'k hash/s')
+    _hex = prefix + NONCE.pack(nonce)
+    print(_hex.hex())
+    print(','.join(txs))
+    r = requests.post(NODE + 'push_block', json={
+        'block_content': _hex.hex(),
+        'txs': txs,
+        'id': last_block["id"] + 1
+    }, timeout=20 + int((len(txs) or 1) / 3))
+    print(res := r.json())
+    if res['ok']:
+        print('BLOCK MINED\n\n')
+    # wait for the work on top of the new block
+    return get_latest_job(jobs, block=True)
+
+
+def get_latest_job(jobs: Queue, block: bool = False) -> dict:
+    job = jobs.get() if block else jobs.get_nowait()
+    while not jobs.empty():
+        job = jobs.get_nowait()
+    return job
+
+
+def worker(start: int, step: int, res: dict, jobs: Queue, hashes_counter=None):
     while True:
         try:
-            run(start, step, res)
-        except Exception:
-            raise
-            time.sleep(3)
+            res = run(start, step, res, jobs, hashes_counter)
+        except Exception as e:
+            print(e)
+            res = get_latest_job(jobs, block=True)
+
+
+def report_hashrate(hashes_counter):
+    last_hashes = [0] * len(hashes_counter)
+    while True:
+        time.sleep(HASHRATE_REPORT_SECONDS)
+        hashes = list(hashes_counter)
+        # counters are reset when a worker switches to new work
+        done = sum(current - last if current >= last else current for current, last in zip(hashes, last_hashes))
+        last_hashes = hashes
+        print(f'Total: {int(done / HASHRATE_REPORT_SECONDS / 1000)}k hash/s')
+
+
+def get_mining_info(previous: dict = None) -> dict:
+    params = {}
+    if previous is not None:
+        # long polling, the node answers as soon as a new block or a new transactions selection is available
+        params = {'last_block_hash': previous['last_block'].get('hash'), 'merkle_root': previous['merkle_root'], 'timeout': LONG_POLL_TIMEOUT}
+    r = requests.get(NODE + 'get_mining_info', params=params, timeout=LONG_POLL_TIMEOUT + 10)
+    return r.json()['result']
 
 
 if __name__ == '__main__':
     workers = int(sys.argv[2]) if len(sys.argv) >= 3 else 1
+    res = None
+    while res is None:
+        try:
+            res = get_mining_info()
+        except Exception as e:
+            print(e)
+            time.sleep(1)
+    print(f'Starting {workers} workers')
+    queues = []
+    # hashes computed by each worker on its current work, used to print the total hashrate
+    hashes_counter = Array('Q', workers, lock=False)
+    for i in range(1, workers + 1):
+        print(f'Starting worker n.{i}')
+        queue = Queue()
+        Process(target=worker, daemon=True, args=(i - 1, workers, res, queue, hashes_counter)).start()
+        queues.append(queue)
+    Thread(target=report_hashrate, daemon=True, args=(hashes_counter,)).start()
+    interval = 1
     while True:
-        print(f'Starting {workers} workers')
-        res = None
-        while res is None:
-            try:
-                r = requests.get(NODE + 'get_mining_info', timeout=5)
-                res = r.json()['result']
-            except Exception as e:
-                print(e)
-                time.sleep(1)
-                pass
-        processes = []
-        for i in range(1, workers + 1):
-            print(f'Starting worker n.{i}')
-            p = Process(target=worker, daemon=True, args=(i-1, workers, res))
-            p.start()
-            processes.append(p)
-        elapsed_seconds = 0
-        while all(p.is_alive() for p in processes):
+        started = time.time()
+        try:
+            new_res = get_mining_info(res)
+        except Exception as e:
+            print(e)
             time.sleep(1)
-            elapsed_seconds += 1
-            if elapsed_seconds > 100:
-                break
-        for p in processes:
-            p.kill()
+            continue
+        if new_res['last_block'].get('hash') == res['last_block'].get('hash') and new_res['merkle_root'] == res['merkle_root']:
+            if time.time() - started < LONG_POLL_TIMEOUT / 2:
+                # the node answered at once with the same work, it does not support long polling
+                time.sleep(interval)
+                interval = min(interval * 2, MINING_INFO_MAX_INTERVAL)
+            continue
+        interval = 1
+        res = new_res
+        print(f'New work received for block {(res["last_block"].get("id") or 0) + 1}')
+        for queue in queues:
+            queue.put(res)
@@ -15,7 +15,7 @@ END$$;
 CREATE TABLE IF NOT EXISTS blocks (
     id SERIAL PRIMARY KEY,
     hash CHAR(64) UNIQUE,
-    content TEXT NOT NULL,
+    content BYTEA NOT NULL,
     address VARCHAR(128) NOT NULL,
     random BIGINT NOT NULL,
     difficulty NUMERIC(3, 1) NOT NULL,
@@ -26,18 +26,22 @@ CREATE TABLE IF NOT EXISTS blocks (
 CREATE TABLE IF NOT EXISTS transactions (
     block_hash CHAR(64) NOT NULL REFERENCES blocks(hash) ON DELETE CASCADE,
     tx_hash CHAR(64) UNIQUE,
-    tx_hex TEXT,
+    tx_hex BYTEA,
     inputs_addresses TEXT[],
     outputs_addresses TEXT[],
     outputs_amounts BIGINT[],
     fees NUMERIC(14, 6) NOT NULL,
-    time_received TIMESTAMP(0)
+    time_received TIMESTAMP(0),
+    block_id INTEGER NULL
 );
 
 CREATE TABLE IF NOT EXISTS unspent_outputs (
     tx_hash CHAR(64) REFERENCES transactions(tx_hash) ON DELETE CASCADE,
     index SMALLINT NOT NULL,
-    address TEXT NULL
+    address TEXT NULL,
+    amount BIGINT NULL,
+    height INTEGER NULL,
+    PRIMARY KEY (tx_hash, index)
 );
 
 CREATE TABLE IF NOT EXISTS pending_transactions (
@@ -54,5 +58,55 @@ CREATE TABLE IF NOT EXISTS pending_spent_outputs (
     index SMALLINT NOT NULL
 );
 
+CREATE TABLE IF NOT EXISTS spent_outputs (
+    tx_hash CHAR(64) NOT NULL,
+    index SMALLINT NOT NULL,
+    address TEXT NULL,
+    amount BIGINT NULL,
+    height INTEGER NOT NULL,
+    block_id INTEGER NOT NULL REFERENCES blocks(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS address_transactions (
+    address TEXT NOT NULL,
+    block_id INTEGER NOT NULL REFERENCES blocks(id) ON DELETE CASCADE,
+    tx_hash CHAR(64) NOT NULL,
+    direction SMALLINT NOT NULL,
+    PRIMARY KEY (address, block_id, tx_hash)
+);
+
+CREATE TABLE IF NOT EXISTS address_stats (
+    address TEXT PRIMARY KEY,
+    balance BIGINT NOT NULL,
+    utxo_count INTEGER NOT NULL,
+    received BIGINT NOT NULL,
+    sent BIGINT NOT NULL,
+    tx_count INTEGER NOT NULL,
+    first_height INTEGER NULL,
+    last_height INTEGER NULL
+);
+
+CREATE TABLE IF NOT EXISTS spent_by (
+    tx_hash CHAR(64) NOT NULL,
+    index SMALLINT NOT NULL,
+    spending_tx_hash CHAR(64) NOT NULL,
+    block_id INTEGER NOT NULL REFERENCES blocks(id) ON DELETE CASCADE,
+    PRIMARY KEY (tx_hash, index)
+);
+
+CREATE TABLE IF NOT EXISTS pending_spent_by (
+    tx_hash CHAR(64) NOT NULL,
+    index SMALLINT NOT NULL,
+    spending_tx_hash CHAR(64) NOT NULL REFERENCES pending_transactions(tx_hash) ON DELETE CASCADE,
+    PRIMARY KEY (tx_hash, index, spending_tx_hash)
+);
+
 CREATE INDEX IF NOT EXISTS tx_hash_idx ON unspent_outputs (tx_hash);
+CREATE INDEX IF NOT EXISTS spent_by_block_id_idx ON spent_by (block_id);
+CREATE INDEX IF NOT EXISTS pending_spent_by_spending_tx_hash_idx ON pending_spent_by (spending_tx_hash);
+CREATE INDEX IF NOT EXISTS address_stats_balance_idx ON address_stats (balance DESC);
+CREATE INDEX IF NOT EXISTS address_transactions_block_id_idx ON address_transactions (block_id);
+CREATE INDEX IF NOT EXISTS spent_outputs_block_id_idx ON spent_outputs (block_id);
+CREATE INDEX IF NOT EXISTS unspent_outputs_address_idx ON unspent_outputs (address);
 CREATE INDEX IF NOT EXISTS block_hash_idx ON transactions (block_hash);
+CREATE INDEX IF NOT EXISTS transactions_block_id_idx ON transactions (block_id);
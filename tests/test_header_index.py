@@ -0,0 +1,38 @@
+from decimal import Decimal
+
+from denaro.header_index import HeaderIndex
+from denaro.manager import BLOCKS_COUNT
+
+
+def build_index(blocks_count: int) -> HeaderIndex:
+    index = HeaderIndex()
+    for block_id in range(1, blocks_count + 1):
+        index.append(block_id, block_id.to_bytes(32, 'big').hex(), 1_000_000 + block_id * 180, Decimal('6.5'))
+    return index
+
+
+def test_decimal_heights():
+    index = build_index(1000)
+    # calculate_difficulty asks for the first block of the period, BLOCKS_COUNT is a Decimal
+    block_id = 1000 - BLOCKS_COUNT + 1
+    assert isinstance(block_id, Decimal)
+    assert index.get_timestamp(block_id) == 1_000_000 + 501 * 180
+    assert index.get_hash(block_id) == (501).to_bytes(32, 'big').hex()
+    assert index.get_difficulty(block_id) == Decimal('6.5')
+
+
+def test_missing_heights():
+    index = build_index(10)
+    assert index.get_timestamp(11) is None
+    assert index.get_timestamp(Decimal(0)) is None
+    assert index.get_hash(11) is None
+
+
+def test_truncate():
+    index = build_index(10)
+    block_hash = index.get_hash(8)
+    assert index.get_id(block_hash) == 8
+    index.truncate(5)
+    assert len(index) == 5
+    assert index.get_id(block_hash) is None
+    assert index.get_next_id() == 6
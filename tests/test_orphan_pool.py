@@ -0,0 +1,36 @@
+from decimal import Decimal
+
+from fastecdsa import keys
+
+from denaro.constants import CURVE
+from denaro.helpers import point_to_string
+from denaro.manager import block_to_bytes
+from denaro.node.orphan_pool import OrphanPool, OrphanBlock
+
+ADDRESS = point_to_string(keys.gen_keypair(CURVE)[1])
+
+
+def make_orphan(previous_hash: str, random: int) -> OrphanBlock:
+    block = {'address': ADDRESS, 'merkle_tree': '03' * 32, 'timestamp': 1_700_000_000, 'difficulty': Decimal('6.5'), 'random': random}
+    return OrphanBlock(block_to_bytes(previous_hash, block).hex(), [])
+
+
+def test_missing_parent():
+    pool = OrphanPool()
+    parent = make_orphan('01' * 32, 1)
+    child = make_orphan(parent.block_hash, 2)
+    assert pool.add(child) and pool.add(parent)
+    assert pool.get_missing_parent(child.block_hash) == '01' * 32
+    assert pool.pop_children(parent.block_hash) == [child]
+    assert child.block_hash not in pool
+
+
+def test_allow_request():
+    pool = OrphanPool(peer_interval=10)
+    assert pool.allow_request('http://node-a')
+    # the same node has to wait, the others do not
+    assert not pool.allow_request('http://node-a')
+    assert pool.allow_request('http://node-b')
+    pool.last_requests['http://node-a'] -= 10
+    assert pool.allow_request('http://node-a')
+    assert not pool.allow_request('http://node-a')
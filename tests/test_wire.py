@@ -0,0 +1,53 @@
+from decimal import Decimal
+
+from fastecdsa import keys
+
+from denaro.constants import CURVE
+from denaro.helpers import point_to_string, sha256
+from denaro.manager import block_to_bytes
+from denaro.node.wire import BlocksDecoder, encode_blocks, encode_push_block, decode_push_block
+
+ADDRESS = point_to_string(keys.gen_keypair(CURVE)[1])
+TRANSACTIONS = ['01' * 40, '02' * 70]
+
+
+def make_block(block_id: int, with_content: bool = True) -> dict:
+    block = {
+        'address': ADDRESS,
+        'merkle_tree': '03' * 32,
+        'timestamp': 1_700_000_000 + block_id,
+        'difficulty': Decimal('6.5'),
+        'random': 123456 + block_id
+    }
+    content = block_to_bytes('04' * 32, block).hex()
+    block.update(id=block_id, hash=sha256(content), content=content if with_content else None)
+    return {'block': block, 'transactions': TRANSACTIONS}
+
+
+def test_blocks_round_trip():
+    blocks = [make_block(1), make_block(2, with_content=False), make_block(3)]
+    data = encode_blocks(blocks)
+    decoder = BlocksDecoder()
+    # blocks are decoded while they are received, one byte at a time here
+    for n in range(len(data)):
+        decoder.feed(data[n:n + 1])
+    assert len(decoder.blocks) == 3
+    for block_info, decoded in zip(blocks, decoder.blocks):
+        block = block_info['block']
+        assert decoded['transactions'] == TRANSACTIONS
+        assert decoded['block']['id'] == block['id']
+        assert decoded['block']['hash'] == block['hash']
+        assert decoded['block']['content'] == block['content']
+        assert decoded['block']['address'] == ADDRESS
+        assert decoded['block']['timestamp'] == block['timestamp']
+        assert decoded['block']['difficulty'] == block['difficulty']
+        assert decoded['block']['random'] == block['random']
+    # the content of the block stored without it is rebuilt from its fields
+    rebuilt = dict(decoder.blocks[1]['block'], merkle_tree='03' * 32)
+    assert sha256(block_to_bytes('04' * 32, rebuilt)) == blocks[1]['block']['hash']
+
+
+def test_push_block_round_trip():
+    block_content = make_block(1)['block']['content']
+    assert decode_push_block(encode_push_block(block_content, TRANSACTIONS, 10)) == (block_content, TRANSACTIONS, 10)
+    assert decode_push_block(encode_push_block(block_content, [])) == (block_content, [], None)